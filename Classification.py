@@ -9,37 +9,13 @@ Original file is located at
 
 
 import pandas as pd
-import re
-
-def nettoyer_desi_arti(valeur):
-    if pd.isna(valeur):
-        return valeur
-    texte = str(valeur)
-    texte = texte.lstrip()  # Supprimer les espaces au début
-    texte = re.sub(r'^[^a-zA-Z0-9]+', '', texte)  # Supprimer les caractères spéciaux en début de chaîne
-    return texte
-
-def nettoyer_csv(input_file, output_file):
-    # Charger le CSV
-    df = pd.read_csv(input_file)
-
-    # Nettoyer uniquement la colonne DESI_ARTI
-    if 'DESI_ARTI' in df.columns:
-        df['DESI_ARTI'] = df['DESI_ARTI'].apply(nettoyer_desi_arti)
-    else:
-        print("Erreur : colonne 'DESI_ARTI' introuvable.")
-
-    # Sauvegarder le CSV nettoyé
-    df.to_csv(output_file, index=False)
-    print(f"Fichier nettoyé sauvegardé sous : {output_file}")
-
-
+from preparation_donnees import nettoyer_csv
 
 # Exemple d'utilisation
 input_file = 'dataset_gpairo (1).csv'  # Remplacez par le chemin réel
 output_file = 'dataset_gpairo_nettoye.csv'
 
-nettoyer_excel(input_file, output_file)
+nettoyer_csv(input_file, output_file)
 
 import pandas as pd
 
@@ -68,11 +44,31 @@ df = pd.read_csv("dataset_gpairo_webpdrmif.csv", encoding="utf-8-sig")
 
 df.columns = [c.strip().upper() for c in df.columns]
 
-df["DESI_ARTI"] = df["DESI_ARTI"].astype(str).str.strip().str.lower()
+# Pré-normalisation locale (dimensions, valeurs électriques, références, marques, couleurs,
+# abréviations, mots collés) : plus de désignations tombent dans le même groupe et les
+# prompts sont plus courts. Les attributs retirés sont gardés par ID dans attributs_designations.csv
+from prenormalisation import prenormaliser
+
+nb_avant = df["DESI_ARTI"].astype(str).str.strip().str.lower().nunique()
+attributs = prenormaliser(df["DESI_ARTI"])
+pd.concat([df[["ID", "BASE", "DESI_ARTI"]], attributs], axis=1).to_csv(
+    "attributs_designations.csv", index=False, encoding="utf-8-sig")
+df["DESI_ARTI"] = attributs["designation_normalisee"].fillna(df["DESI_ARTI"].astype(str).str.strip().str.lower())
+print(f"Désignations distinctes : {nb_avant} -> {df['DESI_ARTI'].nunique()} après pré-normalisation")
+
+# Quasi-doublons (faute de frappe, ordre des mots, mots collés) : chaque désignation est remplacée
+# par le représentant de son groupe, seul envoyé au LLM ; le dégroupage reporte le résultat sur
+# tous les (ID, BASE) du groupe. Correspondance gardée dans groupes_proches.csv
+from regroupement_proches import regrouper_proches
+
+groupes_proches = regrouper_proches(df["DESI_ARTI"])
+groupes_proches.to_csv("groupes_proches.csv", index=False, encoding="utf-8-sig")
+df["DESI_ARTI"] = df["DESI_ARTI"].map(dict(zip(groupes_proches["designation"], groupes_proches["representant"])))
+print(f"Désignations envoyées au LLM : {df['DESI_ARTI'].nunique()} après regroupement des quasi-doublons")
 
-df_grouped = df.groupby("DESI_ARTI").apply(
-    lambda group: list(zip(group["ID"], group["BASE"]))
-).reset_index(name="PAIRES_ID_BASE")
+from preparation_donnees import grouper_designations
+
+df_grouped = grouper_designations(df)
 
 df_grouped.to_csv("groupement_resultat.csv", index=False, encoding="utf-8-sig")
 
@@ -84,10 +80,13 @@ import csv
 import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
-from together import Together
+from pool_llm import charger_pool
 from threading import Lock
+from ecriture_groupee import EcrivainGroupe
+from profilage import etape, profiler_thread
+from filtrage_designations import separer_non_identifiables, LIBELLE_NON_IDENTIFIABLE
 
-client = Together(api_key="")
+client = charger_pool()  # endpoints.json ou TOGETHER_API_KEY_<i>
 
 input_file = "groupement_resultat.csv"
 output_file = "classification.csv"
@@ -97,188 +96,35 @@ print("Lecture et nettoyage...")
 df = pd.read_csv(input_file)
 #df = df[df["ID"].notna()].drop_duplicates(subset="ID")  # ici y a pas de doublons c'est juste par sécurité
 print(len(df))
+# Désignations non classables (« 0 », codes, numéros) : directement « Non identifiable », sans appel API
+df, df_non_identifiables = separer_non_identifiables(df, "DESI_ARTI")
 df = df.head(500).copy()
 #echantillon_x = df[df["BASE"] == "gpairo"].head(500)
 #echantillon_y = df[df["BASE"] == "webpdrmif"].head(500)
 #df = pd.concat([echantillon_x, echantillon_y]).copy()
 print(len(df))
 
-# Créer les fichiers de sortie avec les en-têtes
-with open(output_file, "w", newline="", encoding="utf-8-sig") as f:
-    csv.writer(f).writerow(["DESI_ARTI", "PAIRES_ID_BASE", "famille", "sous famille", "agregat", "nom produit"])
-
-with open(inconnus_file, "w", newline="", encoding="utf-8-sig") as f:
-    csv.writer(f).writerow(["DESI_ARTI", "PAIRES_ID_BASE", "designation_nettoyee"])
-
-# Verrous pour éviter les conflits d'écriture
-print_lock = Lock()
-output_lock = Lock()
-inconnus_lock = Lock()
 log_file_path = "log.txt"
+ENTETE_INCONNUS = ["DESI_ARTI", "PAIRES_ID_BASE", "designation_nettoyee"]
+
+# Un seul thread écrit les trois sorties : les workers déposent leurs lignes et repartent
+# aussitôt aux appels API ; écriture par paquets (taille / délai), fsync aux checkpoints.
+# Créer les fichiers de sortie avec les en-têtes
+ecrivain = EcrivainGroupe()
+ecrivain.ajouter_sortie("classification", output_file,
+                        entete=["DESI_ARTI", "PAIRES_ID_BASE", "famille", "sous famille", "agregat", "nom produit"])
+ecrivain.ajouter_sortie("inconnus", inconnus_file, entete=ENTETE_INCONNUS)
+ecrivain.ajouter_sortie("log", log_file_path, format="texte")
+ecrivain.ecrire("classification", [
+    [desi, paires, LIBELLE_NON_IDENTIFIABLE, LIBELLE_NON_IDENTIFIABLE, LIBELLE_NON_IDENTIFIABLE, desi]
+    for desi, paires in zip(df_non_identifiables["DESI_ARTI"], df_non_identifiables["PAIRES_ID_BASE"])
+])
 
 # Set pour tracker les IDs déjà traités et éviter les doublons
 ids_traites = set()
 traites_lock = Lock()
 
-def nettoyer_et_classer_batch(designations, batch_id=0, exemples_precedents=None):
-    prompt_intro = """
- Tu travailles sur une base de données industrielle de pièces de rechange pour des installations fixes et du matériel roulant.
-Ta tâche pour chaque désignation brute fournie est de:
-1. Nettoyer la désignation pour obtenir une version plus claire et normalisée.
-2. Classer le produit en identifiant : la famille, la sous-famille, l'agrégat et le nom.
-
-IMPORTANT : Chaque produit possède un champ PAIRES_ID_BASE. Ne le modifie jamais. Tu dois le renvoyer strictement identique dans ta réponse.
-
-Tu dois traiter plusieurs désignations à la suite (batch). Assure-toi d'être cohérent : deux désignations similaires doivent donner les mêmes catégories, même si elles apparaissent dans des batchs séparés.
-IMPORTANT : Tu dois OBLIGATOIREMENT remplir les 4 champs pour chaque désignation :
-
- Nettoyage :
-- Supprime tous les éléments techniques inutiles, y compris :
-  - Dimensions et mesures : chiffres (10, 160, 4P, 12 pouces, 40A, etc), diamètres (Ø), références (REF, reference, RF), longueurs (mm, pouces), tensions (V, W), pressions (bar).
-  - Unités, symboles, positions : (A, V, W, mm, ", ', Q32, 4P, 2 positions, etc).
-  - Codes techniques ou commerciaux et marques (atlas, parker, hyundai ...).
-  - Couleurs, tailles (petit, grand), formes (rond, carré...).
-  - Expressions commerciales comme "jeu de", "lot de", "assortiment de".
-
-- Corrige les fautes d'orthographe fréquentes sans changer la nature du produit.
-- Ajoute des espaces aux mots collés (ex : dejoint → de joint, interrupteuretanche → interrupteur étanche).
-- Harmonise systématiquement les abréviations, variantes linguistiques et termes équivalents pour éviter les doublons (ex: synchro = synchronisation, ext = extérieur, int = intérieur, ar = arrière, av = avant ...)
-- Ne jamais rajouter de commentaires.
-
- Classification (basée sur la désignation nettoyée uniquement) :
-- Les catégories (famille, sous-famille, agrégat) doivent strictement rester dans le domaine des pièces de rechange pour installations fixes et matériel roulant, sans jamais sortir de ce périmètre.
-- Ne crée pas de catégories trop spécifiques : préfère les formes simples, normalisées.
-- La hiérarchie des catégories est la suivante (du plus général au plus spécifique) : FAMILLE → SOUS-FAMILLE → AGREGAT → NOM
-- La famille regroupe plusieurs sous-familles, c'est une catégorie très large, unique et ne doit pas changer selon la formulation. (ex : mécanique, électrique).Elle doit être au singulier.
-- La sous-famille est un regroupement large, jamais construit autour de la variante ou l'usage d'un produit spécifique. Elle est moins large que la famille mais plus large que l'agregat, elle regroupe plusieurs agregats.Elle doit être au pluriel.
-- Un terme utilisé comme sous-famille dans une famille ne doit jamais devenir une famille à part entière par la suite(ex: si "signalisation" ou "outils" sont des sous-familles dans "mécanique", il ne faut jamais créer une famille "signalisation" ni "outils").
-- Si un terme existe comme famille autonome (ex : "signalisation"), il est interdit de le recréer ensuite comme sous-famille dans une autre famille (comme "mécanique"). Ce produit doit être classé directement dans la famille existante ("signalisation").
-- Le nom correspond généralement au produit individuel (il doit être au singulier) ou à sa désignation nettoyée.
-- L'agregat doit être dérivé à partir du nom du produit (désignation nettoyée), en retirant les adjectifs (complet, rond, carré ...), matières (cuivre, huile, eau ...), compléments ou formes spécifiques pour ne garder que le mot principal (généralement le premier nom).
-- L'agregat ne doit jamais être identique à la sous-famille sauf s'il n'existe vraiment aucun regroupement possible (cas des vis, boulons, etc.).
-- L'agregat regroupe plusieurs noms de produits très proches (ex:anneau torique, anneau cuivre , anneau m2x5 -> anneaux; filtre à air, filtre huile -> filtres; arbre complet, arbre primaire -> arbre ) — il doit être au pluriel.
-- Une même sous-famille ou agrégat peut exister dans plusieurs familles distinctes (ex: "famille: mécanique et sous_famille: outils", "famille: elecricité et sous_famille: outils")
-- Lorsqu'un terme générique comme "composants" est utilisé en sous-famille, il doit être précisé selon la famille à laquelle il appartient(ex : "composants mécaniques" pour la famille "mécanique", "composants électriques" pour "électricité").
-
-
- Éviter :
-- Les sous-familles comme "kit de joints", "jeu de...", "à tête..." → préférer des formes simples : joints, vis...
-- Les réponses floues comme "embrayage et sélecteur" ou toute catégorie avec "et" ou combinaison hasardeuse.
-- De creer des sous_familles ou des agregats à partir de mots comme "à tête", "à bout", "à embout", "avec", etc.
-- De creer plusieurs catégories (famille " ex: elecrique = elecricité  → elecricité, outils = outillage  → outillage, chimie = chimique  → chimie, sécurité = protection  → sécurité " ou agregat "ex: vis, vis parker, vis à bois, vis abois  → vis" , faut prendre la catégorie la plus générale.
-- La multiplication excessive des sous-familles : regroupe les agrégats proches dans une même sous-famille plutôt que créer des sous-familles spécifiques pour chaque variante. Exemple : préfère une seule sous-famille "barres" plutôt que "barres de connexion", "barres de stabilisation", etc.
-- De creer les familles ou sous familles comme "produits chimiques", "produits de peinture", "produits électriques", etc. Préférer des catégories génériques et universelles (chimie, peinture, electricité).
-- De créer deux catégories distinctes à cause d'un accent manquant ou incorrect, utilise la forme orthographiquement correcte en français (avec accents) pour la catégorie finale (ex: boites = boîtes → boîtes)
-- De créer une famille à partir d'un nom qui a déjà été utilisé comme sous-famille dans une autre famille(ex: si la sous-famille "outils" existe dans la famille "mécanique", il est interdit de créer par la suite une famille "outils"). Ces termes doivent rester des sous-familles, pas devenir des familles.
-
- Format de réponse strict pour chaque désignation :
-
-DESIGNATION: [désignation brute]
-PAIRES_ID_BASE: [ID_BASE fourni]
-FAMILLE: ...
-SOUS_FAMILLE: ...
-AGREGAT: ...
-NOM: [désignation nettoyée]
-
- Exemple :
-
-DESIGNATION : anneau cuivre
-PAIRES_ID_BASE: [(43,gpairo),(5678,webpdrmif)]
-FAMILLE: mécanique
-SOUS_FAMILLE: bagues
-AGREGAT: anneaux
-NOM: anneau cuivre
-
-Maintenant, traite les désignations suivantes :
-"""
-
-
-    for designation, liste_paires in designations:
-        prompt_intro += f"\nPAIRES_ID_BASE : {liste_paires}\nDESIGNATION : {designation.strip().lower()}\n"
-
-    try:
-        completion = client.chat.completions.create(
-            model="meta-llama/Llama-3.3-70B-Instruct-Turbo-Free",
-            messages=[{"role": "user", "content": prompt_intro}],
-            temperature=0.3,
-            max_tokens=1000
-        )
-
-        response = completion.choices[0].message.content.strip()
-        blocs = response.split("\n\n")  # chaque bloc = une désignation traitée
-
-        results = []
-        found_designations = set()
-
-        for bloc in blocs:
-            lines = bloc.strip().splitlines()
-            result = {
-                "designation": "",
-                "paires_id_base": [],
-                "famille": "inconnue",
-                "sous_famille": "inconnue",
-                "agregat": "inconnu",
-                "nom": ""
-            }
-
-            for line in lines:
-                if ":" not in line:
-                    continue
-                cle, valeur = line.split(":", 1)
-                cle = cle.strip().lower()
-                valeur = valeur.strip().lower()
-
-                if "designation" in cle:
-                    result["designation"] = valeur
-                    found_designations.add(valeur)
-                elif cle in result:
-                    result[cle] = valeur
-
-
-            if not result["sous_famille"] or result["sous_famille"] in ["inconnu", "inconnue"]:
-                result["sous_famille"] = result["agregat"]
-            if not result["agregat"] or result["agregat"] in ["inconnu", "inconnue"]:
-                result["agregat"] = result["sous_famille"]
-
-            if result["paires_id_base"]:
-                results.append(result)
-
-        results_dict = {str(r["paires_id_base"]).strip(): r for r in results}
-
-        # Construire les résultats finaux dans l'ordre d'entrée
-        final_results = []
-        for designation, paires_id_base in designations:
-         paires_str = str(paires_id_base).strip()  # Utilisation de la paire comme clé texte
-
-         if paires_str in results_dict:
-           final_results.append(results_dict[paires_str])
-         else:
-          final_results.append({
-            "designation": designation.strip().lower(),
-            "paires_id_base": paires_id_base,
-            "famille": "inconnue",
-            "sous_famille": "inconnue",
-            "agregat": "inconnu",
-            "nom": ""
-        })
-
-
-        taux = round(100 * len([r for r in final_results if r["famille"] != "inconnue"]) / len(designations)) if designations else 0
-        print(f"[Batch {batch_id}] : {len([r for r in final_results if r['famille'] != 'inconnue'])}/{len(designations)} traitées avec succès ({taux}%)")
-
-        return final_results
-
-    except Exception as e:
-        print(f"[Erreur batch {batch_id}]:", e)
-
-        return [{
-            "designation": d.strip().lower(),
-            "paires_id_base": paires_id_base,
-            "famille": "inconnue",
-            "sous_famille": "inconnue",
-            "agregat": "inconnu",
-            "nom": ""
-        } for d, paires_id_base in designations]
+from classification_llm import nettoyer_et_classer_batch, reussi
 
 def charger_exemples_depuis_output(fichier, max_exemples=10):
     exemples = []
@@ -302,6 +148,7 @@ def charger_exemples_depuis_output(fichier, max_exemples=10):
 import ast
 historique = []
 
+@profiler_thread
 def traiter_batch(batch_id, batch):
     global ids_traites
 
@@ -331,58 +178,46 @@ def traiter_batch(batch_id, batch):
             return
 
     exemples = None
-    results = nettoyer_et_classer_batch(ids_a_traiter, batch_id=batch_id, exemples_precedents=exemples)
 
-    # Ajustement des clés pour cohérence
-    for res in results:
+    # Réponse lue en flux : chaque désignation est écrite dès que son bloc est reçu
+    def ecrire_resultat(res):
+        # Ajustement des clés pour cohérence
         res["DESI_ARTI_ORIG"] = res["designation"]
         res["PAIRES_ID_BASE"] = res["paires_id_base"]
 
-    # Mise à jour historique
-    for res in results:
+        # Mise à jour historique
         if res["famille"] != "inconnue":
             historique.append(res)
 
-    with print_lock:
-        with open(log_file_path, "a", encoding="utf-8") as logf:
-            for res in results:
-                log_line = f"{res.get('DESI_ARTI_ORIG')} ➜ [{res['famille']} / {res['sous_famille']} / {res['agregat']} / {res['nom']}]\n"
-                logf.write(log_line)
-
-    reussites = []
+        ecrivain.ecrire("log", [
+            f"{res.get('DESI_ARTI_ORIG')} ➜ [{res['famille']} / {res['sous_famille']} / {res['agregat']} / {res['nom']}]\n"
+        ])
+        if reussi(res):
+            ecrivain.ecrire("classification", [[
+                res.get("DESI_ARTI_ORIG", res["designation"]),
+                str(res["PAIRES_ID_BASE"]),
+                res["famille"],
+                res["sous_famille"],
+                res["agregat"],
+                res["nom"]
+            ]])
+
+    results = nettoyer_et_classer_batch(ids_a_traiter, batch_id=batch_id, exemples_precedents=exemples, client=client,
+                                        sink=ecrire_resultat)
+
+    # Désignations absentes de la réponse (jamais passées par ecrire_resultat) ou non classées
     echecs = []
-
     for res in results:
-        if (res["famille"] != "inconnue" and
-            all(res.get(k, "").strip().lower() not in ["", "inconnu", "inconnue"] for k in ["famille", "sous_famille", "agregat", "nom"])):
-            reussites.append(res)
-        else:
+        if "DESI_ARTI_ORIG" not in res:
+            ecrire_resultat(res)
+        if not reussi(res):
             echecs.append(res)
 
-    if reussites:
-        with output_lock:
-            with open(output_file, "a", newline="", encoding="utf-8-sig") as f:
-                writer = csv.writer(f)
-                for res in reussites:
-                    writer.writerow([
-                        res.get("DESI_ARTI_ORIG", res["designation"]),
-                        str(res["PAIRES_ID_BASE"]),
-                        res["famille"],
-                        res["sous_famille"],
-                        res["agregat"],
-                        res["nom"]
-                    ])
-
-    if echecs:
-        with inconnus_lock:
-            with open(inconnus_file, "a", newline="", encoding="utf-8-sig") as f:
-                writer = csv.writer(f)
-                for res in echecs:
-                    writer.writerow([
-                        res.get("DESI_ARTI_ORIG", res["designation"]),
-                        str(res["PAIRES_ID_BASE"]),
-                        ""
-                    ])
+    ecrivain.ecrire("inconnus", [[
+        res.get("DESI_ARTI_ORIG", res["designation"]),
+        str(res["PAIRES_ID_BASE"]),
+        ""
+    ] for res in echecs])
 
     time.sleep(3.5)
 
@@ -390,6 +225,8 @@ def retraiter_inconnus(max_retentatives, batch_size):
     global ids_traites
 
     for tentative in range(1, max_retentatives + 1):
+        # Les lignes encore en mémoire chez l'écrivain doivent être sur disque avant relecture
+        ecrivain.synchroniser()
         with open(inconnus_file, "r", encoding="utf-8-sig") as f:
             reader = csv.DictReader(f)
             inconnus = []
@@ -410,9 +247,19 @@ def retraiter_inconnus(max_retentatives, batch_size):
         batched_inconnus = [inconnus[i:i+batch_size] for i in range(0, len(inconnus), batch_size)]
         all_results = []
 
+        def ecrire_reussite(res):
+            # Classées écrites dès réception ; les échecs attendent la fin de la tentative
+            if reussi(res):
+                ecrivain.ecrire("classification", [[
+                    res["designation"], str(res["paires_id_base"]), res["famille"], res["sous_famille"],
+                    res["agregat"], res["nom"]
+                ]])
+
+        @profiler_thread
         def traiter_batch_inconnu(i_batch, batch):
             # batch est liste de (DESI_ARTI, PAIRES_ID_BASE_str)
-            results = nettoyer_et_classer_batch(batch, batch_id=f"RETRY-{tentative}-{i_batch+1}", exemples_precedents=exemples)
+            results = nettoyer_et_classer_batch(batch, batch_id=f"RETRY-{tentative}-{i_batch+1}", exemples_precedents=exemples,
+                                                client=client, sink=ecrire_reussite)
             for res in results:
                 res["DESI_ARTI_ORIG"] = res["designation"]
                 res["PAIRES_ID_BASE"] = res["paires_id_base"]
@@ -428,39 +275,17 @@ def retraiter_inconnus(max_retentatives, batch_size):
                 except Exception as e:
                     print(f"[Erreur thread retraitement batch {futures[future]}] {e}")
 
-        reussites = []
-        echecs = []
-
-        for res in all_results:
-            if (res["famille"] != "inconnue" and
-                all(res.get(k, "").strip().lower() not in ["", "inconnu", "inconnue"]
-                    for k in ["famille", "sous_famille", "agregat", "nom"])):
-                reussites.append(res)
-            else:
-                echecs.append(res)
-
-        if reussites:
-            with open(output_file, "a", newline="", encoding="utf-8-sig") as f:
-                writer = csv.writer(f)
-                for res in reussites:
-                    writer.writerow([
-                        res.get("DESI_ARTI_ORIG", res["designation"]),
-                        str(res["PAIRES_ID_BASE"]),
-                        res["famille"],
-                        res["sous_famille"],
-                        res["agregat"],
-                        res["nom"]
-                    ])
-
-        with open(inconnus_file, "w", newline="", encoding="utf-8-sig") as f:
-            writer = csv.writer(f)
-            writer.writerow(["DESI_ARTI", "PAIRES_ID_BASE", "designation_nettoyee"])
-            for res in echecs:
-                writer.writerow([
-                    res.get("DESI_ARTI_ORIG", res["designation"]),
-                    str(res["PAIRES_ID_BASE"]),
-                    ""
-                ])
+        # Les réussites sont déjà écrites par ecrire_reussite
+        reussites = [res for res in all_results if reussi(res)]
+        echecs = [res for res in all_results if not reussi(res)]
+
+        # inconnus.csv est réécrit avec les seuls échecs restants
+        ecrivain.ajouter_sortie("inconnus", inconnus_file, entete=ENTETE_INCONNUS)
+        ecrivain.ecrire("inconnus", [[
+            res.get("DESI_ARTI_ORIG", res["designation"]),
+            str(res["PAIRES_ID_BASE"]),
+            ""
+        ] for res in echecs])
 
         print(f"[Retry {tentative}] : {len(reussites)}/{len(inconnus)} traités. Restants : {len(echecs)}")
 
@@ -474,13 +299,14 @@ batch_list = [rows[i:i+batch_size] for i in range(0, len(rows), batch_size)]
 print(f"\nDémarrage du traitement en parallèle ({len(rows)} lignes, {len(batch_list)} batches)...")
 start = time.time()
 
-# Traitement principal
-with ThreadPoolExecutor(max_workers=4) as executor:
+# Traitement principal (REFERENTIEL_PROFILAGE=1 : profil par étape dans profils/)
+with etape("classification"), ThreadPoolExecutor(max_workers=4) as executor:
     list(tqdm(executor.map(lambda args: traiter_batch(*args), enumerate(batch_list, 1)), total=len(batch_list)))
 
 # Retraitement des inconnus
 batch_size_inconnus = 50
-retraiter_inconnus(max_retentatives, batch_size_inconnus)
+with etape("retraitement"):
+    retraiter_inconnus(max_retentatives, batch_size_inconnus)
 
 duration = time.time() - start
 h = int(duration // 3600)
@@ -489,18 +315,20 @@ s = int(duration % 60)
 print(f"\nTemps total d'exécution : {h}h {m}mn {s}s")
 
 # Vérification finale
+ecrivain.synchroniser()
 print(f"\nVérification finale:")
 #print(f"Nombre d'IDs traités : {len(ids_traites)}")
 with open(output_file, "r", encoding="utf-8-sig") as f:
     reader = csv.DictReader(f)
     output_count = sum(1 for _ in reader)
     print(f"Nombre de lignes dans output_file : {output_count}")
-    Nb_inconnus = len(df) - output_count
+    Nb_inconnus = len(df) + len(df_non_identifiables) - output_count
     print(f"Nombre d'inconnus : {Nb_inconnus}")
 
 max_retentatives = 3
 batch_size_inconnus = 30
-retraiter_inconnus(max_retentatives, batch_size_inconnus)
+with etape("retraitement"):
+    retraiter_inconnus(max_retentatives, batch_size_inconnus)
 
 duration = time.time() - start
 h = int(duration // 3600)
@@ -509,60 +337,35 @@ s = int(duration % 60)
 print(f"\nTemps total d'exécution : {h}h {m}mn {s}s")
 
 # Vérification finale
+ecrivain.synchroniser()
 print(f"\nVérification finale:")
 #print(f"Nombre d'IDs traités : {len(ids_traites)}")
 with open(output_file, "r", encoding="utf-8-sig") as f:
     reader = csv.DictReader(f)
     output_count = sum(1 for _ in reader)
     print(f"Nombre de lignes dans output_file : {output_count}")
-    Nb_inconnus = len(df) - output_count
+    Nb_inconnus = len(df) + len(df_non_identifiables) - output_count
     print(f"Nombre d'inconnus : {Nb_inconnus}")
 
+ecrivain.fermer()
+
 df = pd.read_csv("classification.csv")
 df = df[df["DESI_ARTI"].notna()].drop_duplicates(subset="DESI_ARTI")  # ici y a pas de doublons c'est juste par sécurité
 print(len(df))
 
-import csv
-import ast
-
-def degrouper_fichier(input_file_grouped, output_file_degrouped):
-    with open(input_file_grouped, "r", encoding="utf-8-sig") as f_in, \
-         open(output_file_degrouped, "w", newline="", encoding="utf-8-sig") as f_out:
-
-        reader = csv.DictReader(f_in)
-        fieldnames = ["ID", "BASE", "DESI_ARTI", "FAMILLE", "SOUS_FAMILLE", "AGREGAT", "NOM PRODUIT"]
-        writer = csv.DictWriter(f_out, fieldnames=fieldnames)
-        writer.writeheader()
-
-        for row in reader:
-            paires_str = row.get("PAIRES_ID_BASE", "[]")
-            try:
-                paires = ast.literal_eval(paires_str)
-            except Exception as e:
-                print(f"Erreur de conversion PAIRES_ID_BASE: {e}, ligne ignorée")
-                continue
-
-            for id_val, base_val in paires:
-                writer.writerow({
-                    "ID": id_val,
-                    "BASE": base_val,
-                    "DESI_ARTI": row.get("DESI_ARTI", ""),
-                    "FAMILLE": row.get("famille", ""),
-                    "SOUS_FAMILLE": row.get("sous famille", ""),
-                    "AGREGAT": row.get("agregat", ""),
-                    "NOM PRODUIT": row.get("nom produit", "")
-                })
+from preparation_donnees import degrouper_fichier
 
-    print(f"Fichier dégroupé écrit dans {output_file_degrouped}")
 degrouper_fichier("produits_groupes_corriges.csv", "resultat_dégroupé.csv")
 
 import pandas as pd
+from cles_groupes import attribuer_cles
 
 # Charger le fichier CSV
 df = pd.read_csv("classification (2).csv", encoding="utf-8-sig")
 
-# Créer la colonne clé en utilisant un identifiant unique par combinaison sous_famille + agregat
-df["clé"] = (df["sous famille"].fillna('') + "___" + df["agregat"].fillna('')).astype('category').cat.codes + 1
+# Créer la colonne clé : hash stable du couple sous_famille + agregat normalisé, enregistré
+# dans registre_cles.csv (une nouvelle sous-famille ne renumérote plus les clés existantes)
+df["clé"] = attribuer_cles(df, "sous famille", "agregat")
 
 # Sauvegarder le fichier avec la nouvelle colonne
 df.to_csv("produits_groupes.csv", index=False, encoding="utf-8-sig")
@@ -677,12 +480,11 @@ df_final.to_csv("correction.csv", index=False, encoding="utf-8-sig")
 
 print(" Le fichier classification_corrigee.csv a été généré.")
 
-from together import Together
 import pandas as pd
 import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
-client = Together(api_key="b1e91748251003b14286a7b425fedcd45cce16b718ccb91eae6a7a1695c895d8")
+client = charger_pool()
 
 # Charger le fichier
 df = pd.read_csv("groupes_sous_famille_agregat.csv", encoding="utf-8-sig")
@@ -810,12 +612,11 @@ for batch_index, batch in enumerate(batches):
 
 print("\n Traitement terminé : correction.csv")
 
-from together import Together
 import pandas as pd
 import time
 from tqdm import tqdm
 
-client = Together(api_key="b1e91748251003b14286a7b425fedcd45cce16b718ccb91eae6a7a1695c895d8")
+client = charger_pool()
 
 # Charger le fichier
 df = pd.read_csv("groupes_sous_famille_agregat.csv", encoding="utf-8-sig")
@@ -968,16 +769,41 @@ Pour chaque clé fournie, retourne uniquement :
 
 print("\n Tous les batchs traités. Résultat final : correction.csv")
 
-from together import Together
 import pandas as pd
 import time
 from tqdm import tqdm
 
-client = Together(api_key="b1e91748251003b14286a7b425fedcd45cce16b718ccb91eae6a7a1695c895d8")
+from pool_llm import charger_pool
+from canonicalisation import canonicaliser_groupes, propager_corrections
+from coherence import verifier, cles_a_corriger
+
+client = charger_pool()
 
 # Charger le fichier
 df = pd.read_csv("groupes_sous_famille_agregat.csv", encoding="utf-8-sig")
 
+# Canonicalisation locale (accents, pluriels, synonymes) : seules les clés non résolues
+# partent au LLM, une seule fois par groupe de clés équivalentes
+df_groupes = df
+corrections_locales, df, membres, rapport = canonicaliser_groupes(df)
+
+# Les clés qui enfreignent une règle de hiérarchie repartent au LLM même si elles ont été résolues localement
+violations = verifier(pd.read_csv("produits_groupes.csv", encoding="utf-8-sig"))
+cles_violation = set(cles_a_corriger(violations))
+print(f"Cohérence : {len(cles_violation)} clé(s) en violation ({violations['regle'].value_counts().to_dict()})")
+a_recorriger = corrections_locales["clé"].isin(cles_violation)
+df = pd.concat([df, df_groupes[df_groupes["clé"].isin(corrections_locales.loc[a_recorriger, "clé"])]],
+               ignore_index=True)
+corrections_locales = corrections_locales[~a_recorriger]
+# Bilan recalculé sur ce qui part réellement au LLM, clés en violation comprises (batches de 100)
+rapport["cles_resolues"] = len(corrections_locales)
+rapport["cles_envoyees_llm"] = len(df)
+rapport["appels_api_apres"] = -(-len(df) // 100)
+rapport["appels_api_evites"] = rapport["appels_api_avant"] - rapport["appels_api_apres"]
+print(f"Canonicalisation : {rapport['cles_resolues']} clés résolues localement, "
+      f"{rapport['cles_fusionnees']} fusionnées, {rapport['cles_envoyees_llm']}/{rapport['cles']} envoyées au LLM "
+      f"-> {rapport['appels_api_evites']} appels API évités")
+
 # Préparer les données
 designations = []
 for _, row in df.iterrows():
@@ -987,26 +813,7 @@ for _, row in df.iterrows():
     description = f"{sous_famille} {agregat}"
     designations.append((description, key))
 
-# Fonction : générer des exemples (limité)
-def generer_exemples(resultats_cumules, max_exemples=30):
-    exemples_injectes = set()
-    exemples_textes = []
-
-    for r in resultats_cumules:
-        sous_famille = str(r["sous_famille_corrigée"]).strip().lower()
-        agregat = str(r["agregat_corrigé"]).strip().lower()
-
-        if sous_famille != "inconnue" and sous_famille not in exemples_injectes:
-            exemples_textes.append(
-                f"- clé : {r['clé']}\n- sous famille : {sous_famille}\n- agregat : {agregat}"
-            )
-            exemples_injectes.add(sous_famille)
-
-        if len(exemples_textes) >= max_exemples:
-            break
-
-    return exemples_textes
-
+from classification_llm import generer_exemples, corriger_batch
 
 # Fonction : traiter un batch
 def traiter_batch(batch_index, batch, resultats_cumules):
@@ -1016,83 +823,8 @@ def traiter_batch(batch_index, batch, resultats_cumules):
     for exemple in exemples_textes_list:
         print(exemple)
 
-    exemples_textes = "\n".join(exemples_textes_list)
-
-    prompt_intro = f"""
-
-Tu es un expert en classification produit dans le domaine des pièces de rechange pour installations fixes et matériel roulant.
-
-Objectif :
-
-Corrige la classification de la sous famille et de l’agregat si nécessaire sinon les laisser à l'origine, en respectant les règles suivantes :
-
-1. La sous famille :
-   - Doit être une catégorie large, englobant plusieurs agrégats.
-   - Ne doit pas être spécifique ni construite autour d'un produit individuel.
-   - Doit être au pluriel si possible.
-   - Ne crée pas une sous famille plus précise que l’agregat.
-
-2. L’agregat :
-   - C’est un regroupement de produits très proches.
-   - Doit être au pluriel si possible.
-
-3. Relation hiérarchique :
-   - La sous famille doit toujours être plus large que l’agregat.
-
-4. Ne jamais sortir du domaine des pièces de rechange.
-
-Exemple:
-- clé : 1245
-- sous famille : bobine de démarrage
-- agregat : bobine
-
-->
-- clé : 1245
-- sous famille corrigée : bobine
-- agregat corrigé : bobine de démarrage
-
-Voici des exemples de classification correcte :
- {exemples_textes }
-
-
-Pour chaque clé fournie, retourne uniquement :
-
-- clé : X
-- sous famille corrigée : ...
-- agregat corrigé : ...
-"""
-    for description, key in batch:
-        prompt_intro += f"\nclé : {key}\nsous famille actuelle : {description.strip()}"
-
     try:
-        completion = client.chat.completions.create(
-            model="meta-llama/Llama-3.3-70B-Instruct-Turbo-Free",
-            messages=[{"role": "user", "content": prompt_intro}],
-            temperature=0.3,
-            max_tokens=5000
-        )
-
-        response = completion.choices[0].message.content.strip()
-        lignes = response.splitlines()
-        cle, sous_famille, agregat = None, None, None
-        batch_results = []
-
-        for ligne in lignes:
-            ligne = ligne.strip()
-            if ligne.lower().startswith("clé"):
-                cle = ligne.split(":", 1)[1].strip()
-            elif "sous famille corrigee" in ligne.lower():
-                sous_famille = ligne.split(":", 1)[1].strip()
-            elif "agregat corrige" in ligne.lower():
-                agregat = ligne.split(":", 1)[1].strip()
-
-            if cle and sous_famille and agregat:
-                batch_results.append({
-                    "clé": cle,
-                    "sous_famille_corrigee": sous_famille,
-                    "agregat_corrige": agregat
-                })
-                cle, sous_famille, agregat = None, None, None
+        batch_results = corriger_batch(batch, exemples_textes_list, client=client)
 
         nb_valides = sum(1 for r in batch_results if r["sous_famille_corrigee"].lower() != "inconnue")
         print(f"[Batch {batch_index+1}] {nb_valides}/{len(batch_results)} cas traités.\n")
@@ -1120,16 +852,22 @@ Pour chaque clé fournie, retourne uniquement :
 pd.DataFrame(columns=["clé", "sous_famille_corrigee", "agregat_corrige"]).to_csv(
     "correction.csv", index=False, encoding="utf-8-sig"
 )
+corrections_locales.to_csv("correction.csv", mode='a', header=False, index=False, encoding="utf-8-sig")
 
 
 # Traitement global
 resultats_cumules = []
 batches = [designations[i:i+100] for i in range(0, len(designations), 100)]
 
-for batch_index, batch in enumerate(tqdm(batches, desc="Traitement des batchs")):
-    batch_results = traiter_batch(batch_index, batch, resultats_cumules)
-    resultats_cumules.extend(batch_results)
-    time.sleep(1)
+with etape("correction"):
+    for batch_index, batch in enumerate(tqdm(batches, desc="Traitement des batchs")):
+        batch_results = traiter_batch(batch_index, batch, resultats_cumules)
+        resultats_cumules.extend(batch_results)
+        time.sleep(1)
+
+# Répercuter les corrections des clés représentantes sur les clés fusionnées
+df_correction = pd.read_csv("correction.csv", encoding="utf-8-sig")
+propager_corrections(df_correction, membres).to_csv("correction.csv", index=False, encoding="utf-8-sig")
 
 print("\n Tous les batchs traités. Résultat final : correction.csv")
 
@@ -1152,27 +890,24 @@ def compter_categories(fichier_csv):
 compter_categories("produits_groupes_corriges.csv")
 
 import pandas as pd
+from cles_groupes import appliquer_corrections_incremental
+from overlay_corrections import OverlayCorrections, empreinte_fichier
 
 # Charger les deux fichiers CSV
-df_produits = pd.read_csv("produits_groupes.csv", encoding="utf-8-sig")
-df_corrections = pd.read_csv("correction_normalisee_complet.csv", encoding="latin1")
-
-# Effectuer une jointure gauche (on garde tous les produits même si pas de correction)
-df_merged = pd.merge(
-    df_produits,
-    df_corrections[["clé", "sous_famille_corrigee_normalisee", "agregat_corrige_normalise"]],
-    on="clé",
-    how="left"
-)
-
-# Remplacer les colonnes sous famille et agregat si une correction existe
-df_merged["sous famille"] = df_merged["sous_famille_corrigee_normalisee"].combine_first(df_merged["sous famille"])
-df_merged["agregat"] = df_merged["agregat_corrige_normalise"].combine_first(df_merged["agregat"])
-
-# Supprimer les colonnes de correction temporairement ajoutées
-df_merged = df_merged.drop(columns=["sous_famille_corrigee_normalisee", "agregat_corrige_normalise"])
-
-df_merged.to_csv("produits_groupes_corriges.csv", index=False, encoding="utf-8-sig")
+df_produits = pd.read_csv("produits_groupes.csv", encoding="utf-8-sig", dtype={"clé": str})
+df_corrections = pd.read_csv("correction_normalisee_complet.csv", encoding="latin1", dtype={"clé": str})
+
+# Les corrections sont versionnées dans l'overlay (seules les clés nouvelles ou modifiées y sont
+# ajoutées, jamais par-dessus une correction manuelle ou un rollback, et seulement si le fichier a changé) ; corrections manuelles, rollback et compaction : python overlay_corrections.py
+overlay = OverlayCorrections()
+overlay.importer(df_corrections, "sous_famille_corrigee_normalisee", "agregat_corrige_normalise",
+                 source="correction_normalisee_complet",
+                 empreinte=empreinte_fichier("correction_normalisee_complet.csv"))
+
+# Jointure gauche limitée aux produits nouveaux et aux clés dont la correction a changé depuis
+# le dernier passage (état dans etat_corrections.json) ; le reste est repris de la sortie précédente.
+# Les lecteurs qui n'ont pas besoin du fichier matérialisé utilisent overlay_corrections.lire_resultats.
+appliquer_corrections_incremental(df_produits, overlay.corrections(), "produits_groupes_corriges.csv")
 
 print("Remplacement terminé. Fichier sauvegardé sous 'produits_groupes_corriges.csv'.")
 
@@ -1,7 +1,10 @@
+import os
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
+from stockage_arrow import version_courante, versions_publiees, ouvrir_dataframe
+from requetes_duckdb import MoteurPandas, MoteurDuckDB
+# plotly, jobs_classification et diff_referentiel sont importés au premier usage, dans les
+# sections qui s'en servent : une page qui ne les affiche pas ne paie pas leur import.
 
 # ────────────── CONFIG ──────────────
 st.set_page_config(
@@ -22,10 +25,16 @@ div.stDownloadButton > button { background-color:#ffb703 !important; color:#0230
 """, unsafe_allow_html=True)
 
 # ────────────── IMAGE HEADER ──────────────
-st.image("header.png", use_container_width=True)
+# Images lues une fois par process, pas à chaque rerun
+@st.cache_resource(show_spinner=False)
+def lire_image(fichier):
+    with open(fichier, "rb") as f:
+        return f.read()
+
+st.image(lire_image("header.png"), use_container_width=True)
 
 # ────────────── SIDEBAR NAVIGATION ──────────────
-st.sidebar.image("logo.png", width=140)
+st.sidebar.image(lire_image("logo.png"), width=140)
 st.sidebar.markdown("<br>", unsafe_allow_html=True)  # espace sous le logo
 
 # Initialiser page dans session_state si elle n'existe pas
@@ -39,9 +48,71 @@ if st.sidebar.button("🛠️ Pièces de rechange (Gpairo)"):
     st.session_state.page = "gpairo"
 if st.sidebar.button("🏭 Installations fixes (Webpdrmif)"):
     st.session_state.page = "webpdrmif"
+if st.sidebar.button("⚙️ Classer un extrait"):
+    st.session_state.page = "jobs"
+if st.sidebar.button("🔀 Écarts entre versions"):
+    st.session_state.page = "diff"
 
 page = st.session_state.page
 
+# ────────────── STORE ARROW PARTAGÉ ──────────────
+# Une seule copie mappée en mémoire par version publiée, partagée par toutes les sessions.
+# Ces DataFrames sont partagés : ne jamais les modifier en place.
+@st.cache_resource(max_entries=8, show_spinner=False)
+def charger_depuis_store(nom, version):
+    return ouvrir_dataframe(nom, version)
+
+# Repli CSV : une lecture par fichier et par date de modification, partagée de la même façon
+@st.cache_resource(max_entries=8, show_spinner=False)
+def charger_csv(fichier, date_modification):
+    return pd.read_csv(fichier, encoding="utf-8-sig")
+
+def lire_csv(fichier):
+    return charger_csv(fichier, os.path.getmtime(fichier))
+
+def lire_table(nom, fichier):
+    version = version_courante()
+    if version is not None:
+        try:
+            return charger_depuis_store(nom, version)
+        except FileNotFoundError:
+            pass  # table absente de la version publiée : repli sur le CSV
+    return lire_csv(fichier)
+
+# ────────────── MOTEUR DE REQUÊTES ──────────────
+# REFERENTIEL_BACKEND=duckdb : filtres, comptages et recherches exécutés en SQL sur
+# les fichiers Parquet (générés par `python requetes_duckdb.py`) sans les charger en pandas.
+BACKEND = os.environ.get("REFERENTIEL_BACKEND", "pandas")
+
+@st.cache_resource(show_spinner=False)
+def moteur_duckdb():
+    return MoteurDuckDB()
+
+def ouvrir_moteur(nom, fichier, exclure=None):
+    if BACKEND == "duckdb":
+        moteur = moteur_duckdb()
+        if nom not in moteur.tables:
+            moteur.ajouter_table(nom, exclure=exclure)
+        return moteur
+    moteur = MoteurPandas()
+    moteur.ajouter_table(nom, lire_table(nom, fichier).rename(columns=str.strip), exclure=exclure)
+    return moteur
+
+# ────────────── JOBS DE CLASSIFICATION ──────────────
+# Un gestionnaire par process : ses threads classent hors du script Streamlit et
+# toutes les sessions voient les mêmes jobs.
+@st.cache_resource(show_spinner=False)
+def gestionnaire_jobs():
+    from jobs_classification import GestionnaireJobs
+    return GestionnaireJobs()
+
+# ────────────── ÉCARTS ENTRE VERSIONS ──────────────
+# Clé de cache = contenu des deux versions : un nouveau run invalide le diff sur les CSV
+@st.cache_data(max_entries=4, show_spinner="Comparaison des versions…")
+def calculer_diff(avant, apres, cle_avant, cle_apres):
+    from diff_referentiel import charger, comparer
+    return comparer(charger(avant), charger(apres))
+
 # ────────────── FICHIERS PAR PAGE ──────────────
 page_files = {
     "accueil": {
@@ -59,6 +130,12 @@ page_files = {
         "dataset": "dataset_webpdrmif.csv",
         "result": "Ref_Installations fixes_Mif.csv",
         "title": "Installations fixes (Webpdrmif)"
+    },
+    "jobs": {
+        "title": "Classer un extrait"
+    },
+    "diff": {
+        "title": "Écarts entre versions du référentiel"
     }
 }
 
@@ -66,9 +143,11 @@ st.title(page_files[page]["title"])
 
 # ────────────── PAGE ACCUEIL ──────────────
 if page == "accueil":
+    import plotly.graph_objects as go
+
     # Lecture dataset principal
     try:
-        df_dataset = pd.read_csv(page_files[page]["dataset"], encoding="utf-8-sig")
+        df_dataset = lire_csv(page_files[page]["dataset"])
     except Exception as e:
         st.error(f"Erreur lecture {page_files[page]['dataset']} : {e}")
         st.stop()
@@ -97,103 +176,217 @@ if page == "accueil":
     st.markdown("### Aperçu du dataset global avant l'unification des designations", unsafe_allow_html=True)
     col2.dataframe(df_dataset.head(7), use_container_width=True)
     st.markdown("---")
-    st.subheader("📑 Aperçu du référentiel central unifié")
-    try:
-        df_ref = pd.read_csv(page_files[page]["referentiel"], encoding="utf-8-sig")
-        st.dataframe(df_ref.head(50), use_container_width=True)
-        # 🔎 Recherche par NOM PRODUIT
-        st.markdown("### 🔎 Rechercher un produit")
-        search_term = st.text_input("Entrer le nom du produit")
-
-        if search_term:
-           results = df_ref[df_ref["NOM PRODUIT"].str.contains(search_term, case=False, na=False)]
-           if not results.empty:
-              st.success(f"{len(results)} résultat(s) trouvé(s)")
-              st.dataframe(results, use_container_width=True)
-           else:
-              st.warning("Aucun produit trouvé pour cette recherche.")
-    except Exception as e:
-        st.error(f"Erreur lecture {page_files[page]['referentiel']} : {e}")
 
-    st.markdown("---")
-    st.subheader("🌞 Distribution des familles et sous-familles")
-    try:
-        # Sunburst chart
-        fig_sun = px.sunburst(
-            df_ref,
-            path=['FAMILLE','SOUS_FAMILLE'],
-            values=None,  # compter automatiquement
-            title="Répartition hiérarchique",
-            width=1000,   
-            height=700
-        )
-        st.plotly_chart(fig_sun, use_container_width=True)
-    except Exception as e:
-        st.error(f"Erreur création Sunburst : {e}")
-
-    st.markdown("---")
-    st.subheader("📊 Statistiques supplémentaires")
-    try:
-        c1, c2, c3 = st.columns(3)
-        top_familles = df_ref['FAMILLE'].value_counts().head(10).reset_index()
-        top_familles.columns = ['FAMILLE','Nombre']
-        fig_fam = px.bar(top_familles, x='FAMILLE', y='Nombre', text='Nombre', title="Top 10 FAMILLES")
-        fig_fam.update_traces(textposition='outside')
-        c1.plotly_chart(fig_fam, use_container_width=True)
-
-        top_sousfam = df_ref['SOUS_FAMILLE'].value_counts().head(10).reset_index()
-        top_sousfam.columns = ['SOUS_FAMILLE','Nombre']
-        fig_sousfam = px.bar(top_sousfam, x='SOUS_FAMILLE', y='Nombre', text='Nombre', title="Top 10 SOUS_FAMILLES")
-        fig_sousfam.update_traces(textposition='outside')
-        c2.plotly_chart(fig_sousfam, use_container_width=True)
-
-        top_agreg = df_ref['AGREGAT'].value_counts().head(10).reset_index()
-        top_agreg.columns = ['AGREGAT','Nombre']
-        fig_agreg = px.bar(top_agreg, x='AGREGAT', y='Nombre', text='Nombre', title="Top 10 AGREGATS")
-        fig_agreg.update_traces(textposition='outside')
-        c3.plotly_chart(fig_agreg, use_container_width=True)
-    except Exception as e:
-        st.error(f"Erreur création graphiques supplémentaires : {e}")
+    # Sections du bas en onglets : seul l'onglet ouvert est exécuté (on_change="rerun"),
+    # ses données et ses graphiques ne sont lus qu'à son ouverture
+    onglet_ref, onglet_sun, onglet_stats, onglet_corr = st.tabs(
+        ["📑 Référentiel central unifié", "🌞 Familles et sous-familles", "📊 Statistiques supplémentaires",
+         "🔗 Table de correspondance"], key="onglets_accueil", on_change="rerun")
+
+    if onglet_ref.open:
+        with onglet_ref:
+            st.subheader("📑 Aperçu du référentiel central unifié")
+            try:
+                df_ref = lire_table("referentiel", page_files[page]["referentiel"])
+                st.dataframe(df_ref.head(50), use_container_width=True)
+                # 🔎 Recherche par NOM PRODUIT
+                st.markdown("### 🔎 Rechercher un produit")
+                search_term = st.text_input("Entrer le nom du produit")
+
+                if search_term:
+                   results = df_ref[df_ref["NOM PRODUIT"].str.contains(search_term, case=False, na=False)]
+                   if not results.empty:
+                      st.success(f"{len(results)} résultat(s) trouvé(s)")
+                      st.dataframe(results, use_container_width=True)
+                   else:
+                      st.warning("Aucun produit trouvé pour cette recherche.")
+            except Exception as e:
+                st.error(f"Erreur lecture {page_files[page]['referentiel']} : {e}")
+
+    if onglet_sun.open:
+        with onglet_sun:
+            st.subheader("🌞 Distribution des familles et sous-familles")
+            try:
+                import plotly.express as px
+                df_ref = lire_table("referentiel", page_files[page]["referentiel"])
+                # Sunburst chart
+                fig_sun = px.sunburst(
+                    df_ref,
+                    path=['FAMILLE','SOUS_FAMILLE'],
+                    values=None,  # compter automatiquement
+                    title="Répartition hiérarchique",
+                    width=1000,
+                    height=700
+                )
+                st.plotly_chart(fig_sun, use_container_width=True)
+            except Exception as e:
+                st.error(f"Erreur création Sunburst : {e}")
+
+    if onglet_stats.open:
+        with onglet_stats:
+            st.subheader("📊 Statistiques supplémentaires")
+            try:
+                import plotly.express as px
+                df_ref = lire_table("referentiel", page_files[page]["referentiel"])
+                c1, c2, c3 = st.columns(3)
+                top_familles = df_ref['FAMILLE'].value_counts().head(10).reset_index()
+                top_familles.columns = ['FAMILLE','Nombre']
+                fig_fam = px.bar(top_familles, x='FAMILLE', y='Nombre', text='Nombre', title="Top 10 FAMILLES")
+                fig_fam.update_traces(textposition='outside')
+                c1.plotly_chart(fig_fam, use_container_width=True)
+
+                top_sousfam = df_ref['SOUS_FAMILLE'].value_counts().head(10).reset_index()
+                top_sousfam.columns = ['SOUS_FAMILLE','Nombre']
+                fig_sousfam = px.bar(top_sousfam, x='SOUS_FAMILLE', y='Nombre', text='Nombre', title="Top 10 SOUS_FAMILLES")
+                fig_sousfam.update_traces(textposition='outside')
+                c2.plotly_chart(fig_sousfam, use_container_width=True)
+
+                top_agreg = df_ref['AGREGAT'].value_counts().head(10).reset_index()
+                top_agreg.columns = ['AGREGAT','Nombre']
+                fig_agreg = px.bar(top_agreg, x='AGREGAT', y='Nombre', text='Nombre', title="Top 10 AGREGATS")
+                fig_agreg.update_traces(textposition='outside')
+                c3.plotly_chart(fig_agreg, use_container_width=True)
+            except Exception as e:
+                st.error(f"Erreur création graphiques supplémentaires : {e}")
+
+    if onglet_corr.open:
+        with onglet_corr:
+            st.subheader("📑 Aperçu de la table de correspondance")
+            try:
+                df_corr = lire_table("table_corr", page_files[page]["table_corr"])
+                st.dataframe(df_corr.head(50), use_container_width=True)
+            except Exception as e:
+                st.error(f"Erreur lecture {page_files[page]['table_corr']} : {e}")
+
+# ────────────── PAGE JOBS ──────────────
+elif page == "jobs":
+    gestionnaire = gestionnaire_jobs()
+
+    st.subheader("📤 Nouvel extrait")
+    fichier = st.file_uploader("Fichier CSV ou Excel avec les colonnes ID, BASE, DESI_ARTI", type=["csv", "xlsx"])
+    if fichier is not None:
+        try:
+            if fichier.name.endswith(".csv"):
+                df_extrait = pd.read_csv(fichier, encoding="utf-8-sig")
+            else:
+                df_extrait = pd.read_excel(fichier)
+            st.write(f"{len(df_extrait)} lignes")
+            st.dataframe(df_extrait.head(20), use_container_width=True)
+            if st.button("🚀 Lancer la classification"):
+                id_job = gestionnaire.soumettre(df_extrait, fichier.name)
+                st.success(f"Job {id_job} ajouté à la file")
+        except Exception as e:
+            st.error(f"Erreur : {e}")
 
     st.markdown("---")
-    st.subheader("📑 Aperçu de la table de correspondance")
-    try:
-        df_corr = pd.read_csv(page_files[page]["table_corr"], encoding="utf-8-sig")
-        st.dataframe(df_corr.head(50), use_container_width=True)
-    except Exception as e:
-        st.error(f"Erreur lecture {page_files[page]['table_corr']} : {e}")
+    st.subheader("📋 Jobs")
+
+    def afficher_job(job):
+        titre = f"{job['nom'] or job['id']} — {job['statut']}" + (f" ({job['etape']})" if job["etape"] else "")
+        with st.expander(titre, expanded=job["statut"] in ACTIFS):
+            if job["statut"] == "en cours" and job["lots_total"]:
+                st.progress(min(job["lots_faits"] / job["lots_total"], 1.0))
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric("Lots traités", f"{job['lots_faits']}/{job['lots_total']}")
+            col2.metric("Groupes / s", job["groupes_par_s"])
+            col3.metric("Inconnus", job["inconnus"])
+            col4.metric("Non identifiables", job["non_identifiables"])
+            st.caption(f"{job['lignes']} lignes, {job['groupes']} groupes envoyés au LLM, {job['duree_s']} s")
+            if job["erreur"]:
+                st.error(job["erreur"])
+            if job["statut"] == "terminé":
+                df_resultat = gestionnaire.resultat(job["id"])
+                if df_resultat is not None:
+                    st.dataframe(df_resultat, use_container_width=True)
+                    # CSV généré au clic seulement
+                    st.download_button("💾 Télécharger le résultat",
+                                       data=lambda df=df_resultat: df.to_csv(index=False, encoding="utf-8-sig").encode("utf-8-sig"),
+                                       file_name=f"classification_{job['id']}.csv", mime="text/csv",
+                                       key=f"telecharger_{job['id']}")
+
+    ACTIFS = ("en attente", "en cours")
+    jobs = gestionnaire.liste()
+    actifs = [job["id"] for job in jobs if job["statut"] in ACTIFS]
+    if not jobs:
+        st.info("Aucun job pour l'instant")
+
+    # Seuls les jobs actifs sont dans le fragment réexécuté toutes les 2 s ; sans job actif,
+    # rien ne se rafraîchit. Quand le dernier se termine, un rerun complet le sort du fragment.
+    @st.fragment(run_every=2 if actifs else None)
+    def afficher_jobs_actifs():
+        etats = [gestionnaire.etat(id_job) for id_job in actifs]
+        for job in etats:
+            afficher_job(job)
+        if not any(job["statut"] in ACTIFS for job in etats):
+            st.rerun()
+
+    if actifs:
+        afficher_jobs_actifs()
+    for job in jobs:
+        if job["id"] not in actifs:
+            afficher_job(job)
+
+# ────────────── PAGE ÉCARTS ENTRE VERSIONS ──────────────
+elif page == "diff":
+    from diff_referentiel import SOURCE_CSV, cle_source
+    versions = versions_publiees()[::-1] + [SOURCE_CSV]
+    libelle = lambda v: "Fichiers du dernier run (CSV)" if v == SOURCE_CSV else v + (" (publiée)" if v == version_courante() else "")
+    if len(versions) < 2:
+        st.info("Aucune version publiée à comparer : lancer `python stockage_arrow.py` pour publier la version actuelle")
+    else:
+        col1, col2 = st.columns(2)
+        avant = col1.selectbox("Version de référence", versions, index=0, format_func=libelle)
+        apres = col2.selectbox("Version comparée", versions, index=len(versions) - 1, format_func=libelle)
+        try:
+            diff = calculer_diff(avant, apres, cle_source(avant), cle_source(apres))
+        except Exception as e:
+            st.error(f"Erreur de comparaison : {e}")
+            st.stop()
+
+        tables = {"produits": "📦 Produits", "correspondances": "🔗 Correspondances", "agregats": "🗂️ Agrégats"}
+        colonnes = st.columns(len(tables))
+        for (table, titre), col in zip(tables.items(), colonnes):
+            col.metric(titre, len(diff[table]))
+            col.caption(", ".join(f"{n} {t}" for t, n in diff[table]["type"].value_counts().items()) or "aucun écart")
+
+        for onglet, (table, titre) in zip(st.tabs(list(tables.values())), tables.items()):
+            with onglet:
+                df_ecarts = diff[table]
+                if df_ecarts.empty:
+                    st.success("Aucun écart")
+                    continue
+                col1, col2 = st.columns([1, 2])
+                types = col1.multiselect("Type d'écart", sorted(df_ecarts["type"].unique()),
+                                         default=[t for t in sorted(df_ecarts["type"].unique()) if t != "agrégat déplacé"]
+                                         or sorted(df_ecarts["type"].unique()), key=f"types_{table}")
+                recherche = col2.text_input("Rechercher", key=f"recherche_{table}")
+                vue = df_ecarts[df_ecarts["type"].isin(types)]
+                if recherche:
+                    texte = vue.astype(str).apply(lambda c: c.str.contains(recherche, case=False, regex=False))
+                    vue = vue[texte.any(axis=1)]
+                st.write(f"{len(vue)} ligne(s)")
+                st.dataframe(vue, use_container_width=True)
+                st.download_button("💾 Télécharger ces écarts (CSV)",
+                                   vue.to_csv(index=False, encoding="utf-8-sig").encode("utf-8-sig"),
+                                   file_name=f"ecarts_{table}.csv", mime="text/csv", key=f"telecharger_{table}")
 
 # ────────────── PAGES GPAIRO / WEBPDRMIF ──────────────
 else:
-    dataset_file = page_files[page]["dataset"]
     result_file = page_files[page]["result"]
 
-    # Lecture dataset principal
+    # Lecture fichier résultat (le dataset d'origine n'est affiché par aucune section de ces pages)
     try:
-        if dataset_file.endswith(".csv"):
-            df_dataset = pd.read_csv(dataset_file, encoding="utf-8-sig")
-        else:
-            df_dataset = pd.read_excel(dataset_file)
-    except Exception as e:
-        st.error(f"Erreur lecture {dataset_file} : {e}")
-        st.stop()
-
-    # Lecture fichier résultat
-    try:
-        df = pd.read_csv(result_file, encoding="utf-8-sig")
+        moteur = ouvrir_moteur(page, result_file, exclure={"SOUS_FAMILLE": "Non identifiable"})
     except Exception as e:
         st.error(f"Erreur lecture {result_file} : {e}")
         st.stop()
 
-    df.columns = df.columns.str.strip()
-    df_dataset.columns = df_dataset.columns.str.strip()
-    if "SOUS_FAMILLE" in df.columns:
-        df = df[df["SOUS_FAMILLE"] != "Non identifiable"]
+    colonnes = moteur.colonnes(page)
 
-    total_lignes = len(df)
-    nb_sous_familles = df['SOUS_FAMILLE'].nunique() if 'SOUS_FAMILLE' in df.columns else 0
-    nb_agregats = df['AGREGAT'].nunique() if 'AGREGAT' in df.columns else 0
-    nb_produits = df['NOM PRODUIT'].nunique() if 'NOM PRODUIT' in df.columns else 0
+    total_lignes = moteur.nb_lignes(page)
+    nb_sous_familles = moteur.nb_distincts(page, 'SOUS_FAMILLE') if 'SOUS_FAMILLE' in colonnes else 0
+    nb_agregats = moteur.nb_distincts(page, 'AGREGAT') if 'AGREGAT' in colonnes else 0
+    nb_produits = moteur.nb_distincts(page, 'NOM PRODUIT') if 'NOM PRODUIT' in colonnes else 0
 
     c1, c2, c3, c4 = st.columns(4)
     c1.metric("📄 Lignes totales", f"{total_lignes:,}")
@@ -202,76 +395,84 @@ else:
     c4.metric("🛒 Produits", f"{nb_produits:,}")
 
     st.markdown("---")
-    st.subheader("📑 Aperçu du fichier résultat classifié")
-    st.dataframe(df.head(50), use_container_width=True)
-    st.markdown("### 🔎 Rechercher un produit")
-    search_term = st.text_input("Entrer le nom du produit")
-
-    if search_term:
-           results = df[df["NOM PRODUIT"].str.contains(search_term, case=False, na=False)]
-           if not results.empty:
-              st.success(f"{len(results)} résultat(s) trouvé(s)")
-              st.dataframe(results, use_container_width=True)
-           else:
-              st.warning("Aucun produit trouvé pour cette recherche.")  
-    csv = df.to_csv(index=False).encode('utf-8-sig')
-    st.download_button(
-        "💾 Télécharger le fichier résultat (CSV)",
-        data=csv,
-        file_name=result_file.replace("Ref_", "resultat_"),
-        mime="text/csv"
-    )
+    # Seul l'onglet ouvert est exécuté : graphiques et exploration ne sont construits qu'à la demande
+    onglet_apercu, onglet_repartition, onglet_exploration = st.tabs(
+        ["📑 Aperçu du fichier résultat", "📊 Répartition", "🗂️ Exploration des produits"],
+        key=f"onglets_{page}", on_change="rerun")
+
+    if onglet_apercu.open:
+        with onglet_apercu:
+            st.subheader("📑 Aperçu du fichier résultat classifié")
+            st.dataframe(moteur.apercu(page, 50), use_container_width=True)
+            st.markdown("### 🔎 Rechercher un produit")
+            search_term = st.text_input("Entrer le nom du produit")
+
+            if search_term:
+                   results = moteur.rechercher(page, "NOM PRODUIT", search_term)
+                   if not results.empty:
+                      st.success(f"{len(results)} résultat(s) trouvé(s)")
+                      st.dataframe(results, use_container_width=True)
+                   else:
+                      st.warning("Aucun produit trouvé pour cette recherche.")
+            # CSV généré au clic seulement, pas à chaque rerun
+            st.download_button(
+                "💾 Télécharger le fichier résultat (CSV)",
+                data=lambda: moteur.exporter_csv(page),
+                file_name=result_file.replace("Ref_", "resultat_"),
+                mime="text/csv"
+            )
 
     # Filtrage et exploration visuelle
-    if 'SOUS_FAMILLE' in df.columns:
-        col1, col2 = st.columns(2)
-        sous_familles = sorted(df['SOUS_FAMILLE'].dropna().unique())
-        selected_sous_famille = col1.selectbox("🔎 Choisir une sous-famille :", ["(Toutes)"] + sous_familles)
-
-        df_filtered = df[df['SOUS_FAMILLE'] == selected_sous_famille] if selected_sous_famille != "(Toutes)" else df.copy()
-        agregats = sorted(df_filtered['AGREGAT'].dropna().unique())
-        selected_agregat = col2.selectbox("Choisir un agrégat :", ["(Tous)"] + agregats)
-        df_agregat = df_filtered[df_filtered['AGREGAT'] == selected_agregat] if selected_agregat != "(Tous)" else df_filtered.copy()
-
-        agg_counts = df_filtered['AGREGAT'].value_counts().reset_index()
-        agg_counts.columns = ['AGREGAT', 'Nombre']
-        fig_bar = px.bar(agg_counts, x='AGREGAT', y='Nombre', text='Nombre', title="Répartition des agrégats", color='AGREGAT')
-        fig_bar.update_traces(textposition='outside')
-        st.plotly_chart(fig_bar, use_container_width=True)
-
-        produits_counts = df_agregat['NOM PRODUIT'].value_counts().head(20).reset_index()
-        produits_counts.columns = ['NOM PRODUIT', 'Nombre']
-        if not produits_counts.empty:
-            fig_treemap = px.treemap(produits_counts, path=['NOM PRODUIT'], values='Nombre', title="Top produits")
-            st.plotly_chart(fig_treemap, use_container_width=True)
-        else:
-            st.info("Aucun produit disponible pour l'agrégat sélectionné.")
+    if onglet_repartition.open and 'SOUS_FAMILLE' in colonnes:
+        with onglet_repartition:
+            import plotly.express as px
+            col1, col2 = st.columns(2)
+            sous_familles = moteur.valeurs_distinctes(page, 'SOUS_FAMILLE')
+            selected_sous_famille = col1.selectbox("🔎 Choisir une sous-famille :", ["(Toutes)"] + sous_familles)
+
+            filtre_sous_famille = {'SOUS_FAMILLE': selected_sous_famille} if selected_sous_famille != "(Toutes)" else {}
+            agregats = moteur.valeurs_distinctes(page, 'AGREGAT', filtre_sous_famille)
+            selected_agregat = col2.selectbox("Choisir un agrégat :", ["(Tous)"] + agregats)
+            filtre_agregat = {**filtre_sous_famille, 'AGREGAT': selected_agregat} if selected_agregat != "(Tous)" else filtre_sous_famille
+
+            agg_counts = moteur.compter(page, 'AGREGAT', filtre_sous_famille)
+            fig_bar = px.bar(agg_counts, x='AGREGAT', y='Nombre', text='Nombre', title="Répartition des agrégats", color='AGREGAT')
+            fig_bar.update_traces(textposition='outside')
+            st.plotly_chart(fig_bar, use_container_width=True)
+
+            produits_counts = moteur.compter(page, 'NOM PRODUIT', filtre_agregat, limite=20)
+            if not produits_counts.empty:
+                fig_treemap = px.treemap(produits_counts, path=['NOM PRODUIT'], values='Nombre', title="Top produits")
+                st.plotly_chart(fig_treemap, use_container_width=True)
+            else:
+                st.info("Aucun produit disponible pour l'agrégat sélectionné.")
+
  # ────────────── EXPLORATION VISUELLE DES PRODUITS ──────────────
-    st.markdown("---")
-    st.subheader("🗂️ Exploration des produits")
-    grouped = df.groupby('SOUS_FAMILLE')['AGREGAT'].unique().reset_index()
-
-    for i in range(0, len(grouped), 2):
-        colA, colB = st.columns(2)
-        for j, col in enumerate([colA, colB]):
-            if i + j < len(grouped):
-                sousfam = grouped.iloc[i + j]['SOUS_FAMILLE']
-                if sousfam != "Non identifiable":
-                    with col:
-                        ags = grouped.iloc[i + j]['AGREGAT']
-                        st.markdown(f"""<div style="border:1px solid #ccc; border-radius:8px; padding:10px; margin-bottom:15px;">
-                                         <div style="font-weight:bold; color:blue; font-size:16px; margin-bottom:8px;">{sousfam}</div>""",
-                                    unsafe_allow_html=True)
-                        for agr in ags:
-                            produits = df[df['AGREGAT'] == agr]['NOM PRODUIT'].dropna().tolist()
-                            produits = list(dict.fromkeys(produits))
-                            with st.expander(f"{agr}"):
-                                if len(produits) <= 5:
-                                    for p in produits: st.markdown(f"- {p}")
-                                else:
-                                    show_all = st.checkbox("Voir tout", key=f"chk_{sousfam}_{agr}")
-                                    if show_all:
-                                        for p in produits: st.markdown(f"- {p}")
-                                    else:
-                                        for p in produits[:5]: st.markdown(f"- {p}")
-                        st.markdown("</div>", unsafe_allow_html=True)
\ No newline at end of file
+    if onglet_exploration.open:
+        with onglet_exploration:
+            st.subheader("🗂️ Exploration des produits")
+            grouped = sorted(moteur.regrouper(page, 'SOUS_FAMILLE', 'AGREGAT').items())
+            produits_par_agregat = moteur.regrouper(page, 'AGREGAT', 'NOM PRODUIT')
+
+            for i in range(0, len(grouped), 2):
+                colA, colB = st.columns(2)
+                for j, col in enumerate([colA, colB]):
+                    if i + j < len(grouped):
+                        sousfam, ags = grouped[i + j]
+                        if sousfam != "Non identifiable":
+                            with col:
+                                st.markdown(f"""<div style="border:1px solid #ccc; border-radius:8px; padding:10px; margin-bottom:15px;">
+                                                 <div style="font-weight:bold; color:blue; font-size:16px; margin-bottom:8px;">{sousfam}</div>""",
+                                            unsafe_allow_html=True)
+                                for agr in ags:
+                                    produits = produits_par_agregat.get(agr, [])
+                                    with st.expander(f"{agr}"):
+                                        if len(produits) <= 5:
+                                            for p in produits: st.markdown(f"- {p}")
+                                        else:
+                                            show_all = st.checkbox("Voir tout", key=f"chk_{sousfam}_{agr}")
+                                            if show_all:
+                                                for p in produits: st.markdown(f"- {p}")
+                                            else:
+                                                for p in produits[:5]: st.markdown(f"- {p}")
+                                st.markdown("</div>", unsafe_allow_html=True)
@@ -0,0 +1,368 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from mesure_app import PAGES, mesurer_pages
+from profilage import activer, etape
+from requetes_duckdb import MoteurPandas, catalogue_synthetique
+
+try:
+    import resource
+except ImportError:  # pas de ru_maxrss hors Unix, mémoire non mesurée
+    resource = None
+
+# Banc de performance des étapes du pipeline (nettoyage, pré-normalisation, regroupement,
+# dégroupage, fusion des corrections) et des chemins chauds de app.py (chargement, recherche,
+# filtres), sur les fichiers livrés et sur des copies synthétiques ×10 / ×100.
+# --app ajoute le premier rendu à froid de chaque page de l'application (mesure_app.py).
+# Chaque mesure tourne dans un process neuf : durée médiane et pic mémoire (RSS) de l'étape.
+# Historique dans benchmarks/historique.jsonl, comparaison à benchmarks/reference.json.
+
+DOSSIER = "benchmarks"
+FICHIER_HISTORIQUE = os.path.join(DOSSIER, "historique.jsonl")
+FICHIER_REFERENCE = os.path.join(DOSSIER, "reference.json")
+
+DATASET = "dataset_webpdrmif.csv"
+REFERENTIEL = "Referentiel Central.csv"
+TABLE_CORR = "Table de correspondance.csv"
+
+# Seuils de régression : relatif ET absolu, pour ne pas signaler le bruit des petites mesures
+TOLERANCE_TEMPS = 0.25
+MARGE_TEMPS_S = 0.05
+TOLERANCE_MEMOIRE = 0.25
+MARGE_MEMOIRE_MO = 20
+
+TERME_RECHERCHE = "filtre"
+
+
+# ────────────── ENTRÉES SYNTHÉTIQUES ──────────────
+
+def dataset_synthetique(df, facteur):
+    # Copies avec des ID et des désignations distincts : le nombre de groupes croît aussi
+    copies = []
+    decalage = int(df["ID"].max()) + 1
+    for i in range(facteur):
+        copie = df.copy()
+        copie["ID"] = copie["ID"] + i * decalage
+        if i:
+            copie["DESI_ARTI"] = copie["DESI_ARTI"].astype(str) + f" v{i}"
+        copies.append(copie)
+    return pd.concat(copies, ignore_index=True)
+
+
+def table_corr_synthetique(df, facteur):
+    # Mêmes suffixes de code que catalogue_synthetique pour garder la jointure valide
+    copies = []
+    for i in range(facteur):
+        copie = df.copy()
+        copie["CODE PRODUIT"] = copie["CODE PRODUIT"].astype(str) + f"-{i}"
+        copies.append(copie)
+    return pd.concat(copies, ignore_index=True)
+
+
+def preparer_entrees(dossier, facteur):
+    # Écrit les entrées d'une échelle ; les sorties classées sont simulées à partir du référentiel
+    os.makedirs(dossier, exist_ok=True)
+    dataset = pd.read_csv(DATASET, encoding="utf-8-sig")
+    referentiel = pd.read_csv(REFERENTIEL, encoding="utf-8-sig")
+    table_corr = pd.read_csv(TABLE_CORR, encoding="utf-8-sig")
+    if facteur > 1:
+        dataset = dataset_synthetique(dataset, facteur)
+        referentiel = catalogue_synthetique(referentiel, facteur)
+        table_corr = table_corr_synthetique(table_corr, facteur)
+    dataset.to_csv(os.path.join(dossier, "dataset.csv"), index=False, encoding="utf-8-sig")
+    referentiel.to_csv(os.path.join(dossier, "referentiel.csv"), index=False, encoding="utf-8-sig")
+    table_corr.to_csv(os.path.join(dossier, "table_corr.csv"), index=False, encoding="utf-8-sig")
+
+    # Résultat de classification regroupé (une ligne par désignation), étiquettes du référentiel
+    # Même contenu que grouper_designations, en vectorisé (l'étape mesurée reste l'originale)
+    paires = pd.Series(list(zip(dataset["ID"], dataset["BASE"]))).groupby(dataset["DESI_ARTI"]).agg(list)
+    groupes = paires.reset_index(name="PAIRES_ID_BASE")
+    etiquettes = referentiel.iloc[[i % len(referentiel) for i in range(len(groupes))]].reset_index(drop=True)
+    classes = pd.DataFrame({
+        "DESI_ARTI": groupes["DESI_ARTI"], "PAIRES_ID_BASE": groupes["PAIRES_ID_BASE"].astype(str),
+        "famille": etiquettes["FAMILLE"], "sous famille": etiquettes["SOUS_FAMILLE"],
+        "agregat": etiquettes["AGREGAT"], "nom produit": etiquettes["NOM PRODUIT"],
+    })
+    classes.to_csv(os.path.join(dossier, "classification.csv"), index=False, encoding="utf-8-sig")
+
+    # Fusion des corrections : une clé par couple sous famille / agregat, une correction par clé
+    classes["clé"] = pd.factorize(classes["sous famille"] + "___" + classes["agregat"])[0].astype(str)
+    classes.to_csv(os.path.join(dossier, "produits_groupes.csv"), index=False, encoding="utf-8-sig")
+    corrections = classes[["clé", "sous famille", "agregat"]].drop_duplicates("clé")
+    corrections.columns = ["clé", "sous_famille_corrigee_normalisee", "agregat_corrige_normalise"]
+    corrections["sous_famille_corrigee_normalisee"] = corrections["sous_famille_corrigee_normalisee"].str.lower()
+    corrections.to_csv(os.path.join(dossier, "corrections.csv"), index=False, encoding="utf-8-sig")
+
+
+# ────────────── ÉTAPES ──────────────
+# Chaque étape lit ses entrées (hors mesure) et retourne la fonction mesurée.
+
+def _lire(dossier, nom, **options):
+    return pd.read_csv(os.path.join(dossier, nom), encoding="utf-8-sig", **options)
+
+
+def etape_nettoyage(dossier, sortie):
+    from preparation_donnees import nettoyer_csv
+    return lambda: nettoyer_csv(os.path.join(dossier, "dataset.csv"), os.path.join(sortie, "nettoye.csv"))
+
+
+def etape_prenormalisation(dossier, sortie):
+    from prenormalisation import prenormaliser
+    designations = _lire(dossier, "dataset.csv")["DESI_ARTI"]
+    return lambda: prenormaliser(designations)
+
+
+def etape_regroupement(dossier, sortie):
+    from preparation_donnees import grouper_designations
+    df = _lire(dossier, "dataset.csv")
+    return lambda: grouper_designations(df)
+
+
+def etape_regroupement_proches(dossier, sortie):
+    from regroupement_proches import regrouper_proches
+    designations = _lire(dossier, "dataset.csv")["DESI_ARTI"].astype(str).str.strip().str.lower()
+    return lambda: regrouper_proches(designations)
+
+
+def etape_degroupage(dossier, sortie):
+    from preparation_donnees import degrouper_fichier
+    return lambda: degrouper_fichier(os.path.join(dossier, "classification.csv"),
+                                     os.path.join(sortie, "degroupe.csv"))
+
+
+def etape_fusion_corrections(dossier, sortie):
+    from cles_groupes import appliquer_corrections_incremental
+    produits = _lire(dossier, "produits_groupes.csv", dtype={"clé": str})
+    corrections = _lire(dossier, "corrections.csv", dtype={"clé": str})
+    etat = os.path.join(sortie, "etat_corrections.json")
+
+    def fusion():
+        # Passage complet : pas d'état d'un run précédent
+        if os.path.exists(etat):
+            os.remove(etat)
+        appliquer_corrections_incremental(produits, corrections, os.path.join(sortie, "corriges.csv"),
+                                          fichier_etat=etat)
+    return fusion
+
+
+def etape_app_chargement(dossier, sortie):
+    # Repli CSV de lire_table (pas de store Arrow publié) : référentiel et table de correspondance
+    return lambda: (_lire(dossier, "referentiel.csv").rename(columns=str.strip),
+                    _lire(dossier, "table_corr.csv").rename(columns=str.strip))
+
+
+def etape_app_recherche(dossier, sortie):
+    moteur = MoteurPandas()
+    moteur.ajouter_table("referentiel", _lire(dossier, "referentiel.csv").rename(columns=str.strip))
+    return lambda: moteur.rechercher("referentiel", "NOM PRODUIT", TERME_RECHERCHE)
+
+
+def etape_app_filtres(dossier, sortie):
+    # Métriques, selectbox et comptages d'une page résultat, filtrés sur une sous-famille
+    moteur = MoteurPandas()
+    moteur.ajouter_table("referentiel", _lire(dossier, "referentiel.csv").rename(columns=str.strip))
+    sous_familles = moteur.valeurs_distinctes("referentiel", "SOUS_FAMILLE")
+    filtre = {"SOUS_FAMILLE": sous_familles[len(sous_familles) // 2]}
+
+    def filtres():
+        moteur.nb_lignes("referentiel")
+        moteur.nb_distincts("referentiel", "AGREGAT")
+        moteur.valeurs_distinctes("referentiel", "SOUS_FAMILLE")
+        moteur.valeurs_distinctes("referentiel", "AGREGAT", filtre)
+        moteur.compter("referentiel", "AGREGAT", filtre)
+        moteur.compter("referentiel", "NOM PRODUIT", filtre, limite=20)
+    return filtres
+
+
+ETAPES = {
+    "nettoyage": etape_nettoyage,
+    "prenormalisation": etape_prenormalisation,
+    "regroupement": etape_regroupement,
+    "regroupement_proches": etape_regroupement_proches,
+    "degroupage": etape_degroupage,
+    "fusion_corrections": etape_fusion_corrections,
+    "app_chargement": etape_app_chargement,
+    "app_recherche": etape_app_recherche,
+    "app_filtres": etape_app_filtres,
+}
+
+
+# ────────────── MESURE ──────────────
+
+def _memoire_mo(champ):
+    # VmRSS / VmHWM du process courant (Linux). ru_maxrss est hérité à travers exec :
+    # le process de mesure verrait le pic du process parent.
+    try:
+        with open("/proc/self/status", "r") as f:
+            for ligne in f:
+                if ligne.startswith(champ + ":"):
+                    return int(ligne.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _reinitialiser_pic():
+    # Remet VmHWM au RSS courant : le pic mesuré est celui de l'étape seule
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def mesurer(nom_etape, dossier, repetitions=3):
+    # Exécuté dans un process neuf ; imports et lecture des entrées hors mesure
+    with tempfile.TemporaryDirectory() as sortie:
+        fonction = ETAPES[nom_etape](dossier, sortie)
+        _reinitialiser_pic()
+        avant = _memoire_mo("VmRSS")
+        durees = []
+        with etape(nom_etape):
+            for _ in range(repetitions):
+                debut = time.perf_counter()
+                fonction()
+                durees.append(time.perf_counter() - debut)
+        apres = _memoire_mo("VmHWM")
+    return {"duree_s": round(sorted(durees)[len(durees) // 2], 4), "duree_min_s": round(min(durees), 4),
+            "pic_rss_mo": None if apres is None else round(apres, 1),
+            "memoire_etape_mo": None if apres is None or avant is None else round(apres - avant, 1)}
+
+
+def _mesurer_isole(etape, dossier, repetitions):
+    commande = [sys.executable, os.path.abspath(__file__), "mesurer", etape, dossier, str(repetitions)]
+    sortie = subprocess.run(commande, capture_output=True, text=True, check=True).stdout
+    return json.loads(sortie.strip().splitlines()[-1])
+
+
+def executer(echelles=(1, 10), etapes=tuple(ETAPES), repetitions=3):
+    resultats = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for facteur in echelles:
+            dossier = os.path.join(tmp, f"x{facteur}")
+            preparer_entrees(dossier, facteur)
+            # Une seule répétition aux grandes échelles
+            n = repetitions if facteur <= 10 else 1
+            for etape in etapes:
+                mesure = _mesurer_isole(etape, dossier, n)
+                ligne = {"etape": etape, "echelle": facteur, "repetitions": n, **mesure}
+                print(f"⏱️ {etape} x{facteur} : {mesure['duree_s']:.3f}s, pic {mesure['pic_rss_mo']} Mo")
+                resultats.append(ligne)
+    return resultats
+
+
+def executer_app(pages=PAGES, repetitions=3):
+    # Fichiers livrés uniquement : app.py lit des noms de fichiers fixes
+    resultats = []
+    for mesure in mesurer_pages(pages, repetitions):
+        ligne = {"etape": f"app_page_{mesure['page']}", "echelle": 1, "repetitions": repetitions,
+                 "duree_s": mesure["froid_s"], "duree_chaud_s": mesure["chaud_s"], "pic_rss_mo": mesure["pic_rss_mo"]}
+        print(f"⏱️ {ligne['etape']} : {ligne['duree_s']:.3f}s à froid, {ligne['duree_chaud_s']:.3f}s à chaud, "
+              f"pic {ligne['pic_rss_mo']} Mo" + (f" ⚠️ {mesure['erreurs']}" if mesure["erreurs"] else ""))
+        resultats.append(ligne)
+    return resultats
+
+
+# ────────────── HISTORIQUE ET RÉFÉRENCE ──────────────
+
+def _commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def enregistrer(resultats, fichier=FICHIER_HISTORIQUE):
+    os.makedirs(os.path.dirname(fichier), exist_ok=True)
+    entree = {"date": datetime.now().isoformat(timespec="seconds"), "commit": _commit(),
+              "python": platform.python_version(), "pandas": pd.__version__, "cpu": os.cpu_count(),
+              "resultats": resultats}
+    with open(fichier, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entree, ensure_ascii=False) + "\n")
+    return entree
+
+
+def definir_reference(entree, fichier=FICHIER_REFERENCE):
+    os.makedirs(os.path.dirname(fichier), exist_ok=True)
+    with open(fichier, "w", encoding="utf-8") as f:
+        json.dump(entree, f, ensure_ascii=False, indent=2)
+
+
+def comparer(resultats, fichier=FICHIER_REFERENCE):
+    if not os.path.exists(fichier):
+        return None
+    with open(fichier, "r", encoding="utf-8") as f:
+        reference = {(r["etape"], r["echelle"]): r for r in json.load(f)["resultats"]}
+    lignes = []
+    for r in resultats:
+        ref = reference.get((r["etape"], r["echelle"]))
+        if ref is None:
+            continue
+        lent = (r["duree_s"] > ref["duree_s"] * (1 + TOLERANCE_TEMPS)
+                and r["duree_s"] - ref["duree_s"] > MARGE_TEMPS_S)
+        lourd = (r["pic_rss_mo"] is not None and ref["pic_rss_mo"] is not None
+                 and r["pic_rss_mo"] > ref["pic_rss_mo"] * (1 + TOLERANCE_MEMOIRE)
+                 and r["pic_rss_mo"] - ref["pic_rss_mo"] > MARGE_MEMOIRE_MO)
+        lignes.append({"etape": r["etape"], "echelle": r["echelle"],
+                       "duree_ref_s": ref["duree_s"], "duree_s": r["duree_s"],
+                       "rss_ref_mo": ref["pic_rss_mo"], "rss_mo": r["pic_rss_mo"],
+                       "regression": ", ".join(n for n, v in [("temps", lent), ("memoire", lourd)] if v)})
+    return pd.DataFrame(lignes, columns=["etape", "echelle", "duree_ref_s", "duree_s", "rss_ref_mo", "rss_mo",
+                                         "regression"])
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "mesurer":
+        # Process de mesure lancé par executer()
+        print(json.dumps(mesurer(sys.argv[2], sys.argv[3], int(sys.argv[4]))))
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description="Banc de performance du pipeline et de l'application")
+    parser.add_argument("--echelles", type=int, nargs="+", default=[1, 10],
+                        help="facteurs des copies synthétiques (ex. 1 10 100)")
+    parser.add_argument("--etapes", nargs="+", choices=list(ETAPES), default=list(ETAPES))
+    parser.add_argument("--repetitions", type=int, default=3)
+    parser.add_argument("--app", action="store_true",
+                        help="mesure aussi le premier rendu à froid / à chaud de chaque page de app.py")
+    parser.add_argument("--profiler", action="store_true",
+                        help="profil CPU / mémoire de chaque étape dans profils/ (durées faussées par le profilage)")
+    parser.add_argument("--definir-reference", action="store_true",
+                        help="enregistre ce run comme référence (benchmarks/reference.json)")
+    args = parser.parse_args()
+    if args.profiler:
+        activer()
+
+    resultats = executer(args.echelles, args.etapes, args.repetitions)
+    if args.app:
+        resultats += executer_app(repetitions=args.repetitions)
+    print(pd.DataFrame(resultats).to_string(index=False))
+    if args.profiler:
+        # Durées sous profilage : ni historique ni comparaison
+        sys.exit(0)
+    entree = enregistrer(resultats)
+
+    if args.definir_reference:
+        definir_reference(entree)
+        print(f"✅ Référence enregistrée : {FICHIER_REFERENCE}")
+        sys.exit(0)
+    comparaison = comparer(resultats)
+    if comparaison is None:
+        print(f"⚠️ Pas de référence ({FICHIER_REFERENCE}) : relancer avec --definir-reference")
+    elif (comparaison["regression"] != "").any():
+        print(comparaison.to_string(index=False))
+        print(f"❌ Régression(s) : {(comparaison['regression'] != '').sum()} mesure(s) au-delà des seuils")
+        sys.exit(1)
+    else:
+        print("✅ Aucune régression par rapport à la référence")
@@ -0,0 +1,163 @@
+import math
+import re
+import unicodedata
+
+import pandas as pd
+
+# Registre des synonymes : libellé retenu -> variantes équivalentes (formes repliées,
+# sans accents, au singulier), comparées au libellé complet.
+# Reprend les règles données au LLM dans les prompts de classification.
+SYNONYMES = {
+    "électricité": ["electrique", "electricite", "elec"],
+    "outillage": ["outil", "outillage"],
+    "chimie": ["chimique", "chimie"],
+    "sécurité": ["securite", "protection"],
+    "synchronisation": ["synchro", "synchronisation"],
+    "peinture": ["peinture", "peint"],
+    "mécanique": ["mecanique", "meca"],
+    "électronique": ["electronique"],
+}
+
+# Enveloppes génériques à retirer ("produits chimiques" -> "chimiques", "kit de joints" -> "joints")
+ENVELOPPES = re.compile(
+    r"^(?:produits?|articles?|kits?|jeux|jeu|lots?|assortiments?|ensembles?)\s+(?:de\s+|d'|d\s+|pour\s+)?")
+
+MOTS_OUTILS = {"de", "du", "des", "la", "le", "les", "a", "au", "aux", "en", "et", "pour", "sur", "d", "l"}
+
+_VARIANTES = {variante: libelle for libelle, variantes in SYNONYMES.items() for variante in variantes}
+
+
+def replier(texte):
+    # Minuscules, sans accents, apostrophes et tirets normalisés, espaces réduits
+    texte = unicodedata.normalize("NFKD", str(texte).lower())
+    texte = "".join(c for c in texte if not unicodedata.combining(c))
+    texte = re.sub(r"[’'`\-_/]", " ", texte)
+    texte = re.sub(r"[^a-z0-9 ]", "", texte)
+    return re.sub(r"\s+", " ", texte).strip()
+
+
+def raciner(mot):
+    # Pluriel français simplifié : tuyaux -> tuyau, joints -> joint
+    if len(mot) > 3 and mot not in MOTS_OUTILS and mot[-1] in "sx":
+        return mot[:-1]
+    return mot
+
+
+def cle_canonique(libelle):
+    if libelle is None or (isinstance(libelle, float) and math.isnan(libelle)):
+        return ""
+    texte = ENVELOPPES.sub("", replier(libelle))
+    cle = " ".join(raciner(mot) for mot in texte.split())
+    # Synonymes appliqués au libellé entier seulement : "composants électriques" reste distinct
+    return replier(_VARIANTES[cle]) if cle in _VARIANTES else cle
+
+
+def _score_affichage(libelle):
+    # Préférer la forme accentuée (orthographe correcte), puis le pluriel
+    libelle = str(libelle)
+    accents = sum(1 for c in libelle if ord(c) > 127)
+    pluriel = libelle.strip().lower().endswith(("s", "x"))
+    return (accents, pluriel)
+
+
+def table_canonique(series):
+    # Table de correspondance libellé -> libellé canonique, calculée sur les valeurs
+    # distinctes seulement puis appliquée en bloc avec map.
+    valeurs = series.dropna().astype(str).str.strip()
+    freq = valeurs.value_counts()
+    table = pd.DataFrame({"libelle": freq.index, "frequence": freq.values})
+    table["cle"] = table["libelle"].map(cle_canonique)
+
+    registre = {replier(libelle): libelle for libelle in SYNONYMES}
+    retenu = {}
+    for cle, groupe in table.groupby("cle", sort=False):
+        if cle in registre:
+            retenu[cle] = registre[cle]
+            continue
+        meilleurs = sorted(zip(groupe["libelle"], groupe["frequence"]),
+                           key=lambda lf: (_score_affichage(lf[0]), lf[1]), reverse=True)
+        retenu[cle] = meilleurs[0][0].lower()
+    table["canonique"] = table["cle"].map(retenu)
+    return table
+
+
+def canonicaliser_colonnes(df, colonnes):
+    df = df.copy()
+    tables = {}
+    for colonne in colonnes:
+        table = table_canonique(df[colonne])
+        correspondance = dict(zip(table["libelle"], table["canonique"]))
+        df[colonne] = df[colonne].astype("string").str.strip().map(correspondance).fillna(df[colonne])
+        tables[colonne] = table
+    return df, tables
+
+
+def canonicaliser_groupes(df, col_cle="clé", col_sous_famille="sous famille", col_agregat="agregat",
+                          vocabulaire=None, min_occurrences=3, batch_size=100):
+    # Canonicalise les paires (sous famille, agregat) de groupes_sous_famille_agregat.csv.
+    # Une clé est résolue localement si sa sous-famille canonique est établie (présente
+    # dans le vocabulaire de référence ou partagée par au moins min_occurrences clés),
+    # si son agrégat est distinct de la sous-famille et sans combinaison " et ".
+    # Les clés devenues identiques sont fusionnées : seule la représentante part au LLM.
+    df_can, _ = canonicaliser_colonnes(df, [col_sous_famille, col_agregat])
+    df_can["_cle_sf"] = df_can[col_sous_famille].map(cle_canonique)
+    df_can["_cle_ag"] = df_can[col_agregat].map(cle_canonique)
+
+    # Fusion des clés équivalentes : la plus petite clé du groupe devient représentante
+    df_can["représentante"] = df_can.groupby(["_cle_sf", "_cle_ag"])[col_cle].transform("min")
+
+    etablies = df_can.drop_duplicates(["_cle_sf", "_cle_ag"])["_cle_sf"].value_counts()
+    etablies = set(etablies[etablies >= min_occurrences].index)
+    if vocabulaire is not None:
+        etablies |= {cle_canonique(v) for v in vocabulaire}
+
+    combinaison = (df_can[col_sous_famille].astype(str).str.contains(r"\bet\b", regex=True) |
+                   df_can[col_agregat].astype(str).str.contains(r"\bet\b", regex=True))
+    resolue = (df_can["_cle_sf"].isin(etablies)
+               & (df_can["_cle_sf"] != df_can["_cle_ag"])
+               & (df_can["_cle_ag"] != "")
+               & ~combinaison)
+    df_can["résolue"] = resolue
+
+    representantes = df_can[df_can[col_cle] == df_can["représentante"]]
+    a_envoyer = representantes[~representantes["résolue"]]
+
+    batches_avant = math.ceil(len(df) / batch_size)
+    batches_apres = math.ceil(len(a_envoyer) / batch_size)
+    rapport = {
+        "cles": len(df),
+        "cles_fusionnees": int((df_can[col_cle] != df_can["représentante"]).sum()),
+        "cles_resolues": int(resolue.sum()),
+        "cles_envoyees_llm": len(a_envoyer),
+        "appels_api_avant": batches_avant,
+        "appels_api_apres": batches_apres,
+        "appels_api_evites": batches_avant - batches_apres,
+    }
+
+    corrections = df_can[df_can["résolue"]][[col_cle, col_sous_famille, col_agregat]].rename(
+        columns={col_sous_famille: "sous_famille_corrigee", col_agregat: "agregat_corrige"})
+    membres = df_can[[col_cle, "représentante"]]
+    colonnes = [col_cle, col_sous_famille, col_agregat]
+    return corrections, a_envoyer[colonnes].reset_index(drop=True), membres, rapport
+
+
+def propager_corrections(df_corrections, membres, col_cle="clé"):
+    # Répercute la correction de chaque représentante sur toutes les clés fusionnées avec elle
+    df_corrections = df_corrections.copy()
+    df_corrections[col_cle] = df_corrections[col_cle].astype(str)
+    membres = membres.astype({col_cle: str, "représentante": str})
+    deja = set(df_corrections[col_cle])
+    propagees = membres[~membres[col_cle].isin(deja)].merge(
+        df_corrections.rename(columns={col_cle: "représentante"}), on="représentante", how="inner"
+    ).drop(columns="représentante")
+    return pd.concat([df_corrections, propagees], ignore_index=True)
+
+
+if __name__ == "__main__":
+    import sys
+
+    fichier = sys.argv[1] if len(sys.argv) > 1 else "groupes_sous_famille_agregat.csv"
+    df = pd.read_csv(fichier, encoding="utf-8-sig")
+    _, a_envoyer, _, rapport = canonicaliser_groupes(df)
+    for cle, valeur in rapport.items():
+        print(f"{cle} : {valeur}")
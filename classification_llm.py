@@ -0,0 +1,381 @@
+import unicodedata
+
+from profilage import profiler_thread
+
+# Prompts et lecture des réponses des étapes de classification et de correction, partagés
+# par Classification.py, les runs shardés (classification_shards.py) et le banc
+# d'évaluation des paramètres (evaluation_parametres.py).
+
+MODELE = "meta-llama/Llama-3.3-70B-Instruct-Turbo-Free"
+TEMPERATURE = 0.3
+MAX_TOKENS = 1000
+MAX_TOKENS_CORRECTION = 5000
+
+_client = None
+
+
+def client_par_defaut():
+    # Pool créé à la première utilisation : endpoints.json, sinon un endpoint Together par clé
+    # TOGETHER_API_KEY / TOGETHER_API_KEY_<i> (voir pool_llm.py)
+    global _client
+    if _client is None:
+        from pool_llm import charger_pool
+        _client = charger_pool()
+    return _client
+
+
+PROMPT_CLASSIFICATION = """
+ Tu travailles sur une base de données industrielle de pièces de rechange pour des installations fixes et du matériel roulant.
+Ta tâche pour chaque désignation brute fournie est de:
+1. Nettoyer la désignation pour obtenir une version plus claire et normalisée.
+2. Classer le produit en identifiant : la famille, la sous-famille, l'agrégat et le nom.
+
+IMPORTANT : Chaque produit possède un champ PAIRES_ID_BASE. Ne le modifie jamais. Tu dois le renvoyer strictement identique dans ta réponse.
+
+Tu dois traiter plusieurs désignations à la suite (batch). Assure-toi d'être cohérent : deux désignations similaires doivent donner les mêmes catégories, même si elles apparaissent dans des batchs séparés.
+IMPORTANT : Tu dois OBLIGATOIREMENT remplir les 4 champs pour chaque désignation :
+
+ Nettoyage :
+- Supprime tous les éléments techniques inutiles, y compris :
+  - Dimensions et mesures : chiffres (10, 160, 4P, 12 pouces, 40A, etc), diamètres (Ø), références (REF, reference, RF), longueurs (mm, pouces), tensions (V, W), pressions (bar).
+  - Unités, symboles, positions : (A, V, W, mm, ", ', Q32, 4P, 2 positions, etc).
+  - Codes techniques ou commerciaux et marques (atlas, parker, hyundai ...).
+  - Couleurs, tailles (petit, grand), formes (rond, carré...).
+  - Expressions commerciales comme "jeu de", "lot de", "assortiment de".
+
+- Corrige les fautes d'orthographe fréquentes sans changer la nature du produit.
+- Ajoute des espaces aux mots collés (ex : dejoint → de joint, interrupteuretanche → interrupteur étanche).
+- Harmonise systématiquement les abréviations, variantes linguistiques et termes équivalents pour éviter les doublons (ex: synchro = synchronisation, ext = extérieur, int = intérieur, ar = arrière, av = avant ...)
+- Ne jamais rajouter de commentaires.
+
+ Classification (basée sur la désignation nettoyée uniquement) :
+- Les catégories (famille, sous-famille, agrégat) doivent strictement rester dans le domaine des pièces de rechange pour installations fixes et matériel roulant, sans jamais sortir de ce périmètre.
+- Ne crée pas de catégories trop spécifiques : préfère les formes simples, normalisées.
+- La hiérarchie des catégories est la suivante (du plus général au plus spécifique) : FAMILLE → SOUS-FAMILLE → AGREGAT → NOM
+- La famille regroupe plusieurs sous-familles, c'est une catégorie très large, unique et ne doit pas changer selon la formulation. (ex : mécanique, électrique).Elle doit être au singulier.
+- La sous-famille est un regroupement large, jamais construit autour de la variante ou l'usage d'un produit spécifique. Elle est moins large que la famille mais plus large que l'agregat, elle regroupe plusieurs agregats.Elle doit être au pluriel.
+- Un terme utilisé comme sous-famille dans une famille ne doit jamais devenir une famille à part entière par la suite(ex: si "signalisation" ou "outils" sont des sous-familles dans "mécanique", il ne faut jamais créer une famille "signalisation" ni "outils").
+- Si un terme existe comme famille autonome (ex : "signalisation"), il est interdit de le recréer ensuite comme sous-famille dans une autre famille (comme "mécanique"). Ce produit doit être classé directement dans la famille existante ("signalisation").
+- Le nom correspond généralement au produit individuel (il doit être au singulier) ou à sa désignation nettoyée.
+- L'agregat doit être dérivé à partir du nom du produit (désignation nettoyée), en retirant les adjectifs (complet, rond, carré ...), matières (cuivre, huile, eau ...), compléments ou formes spécifiques pour ne garder que le mot principal (généralement le premier nom).
+- L'agregat ne doit jamais être identique à la sous-famille sauf s'il n'existe vraiment aucun regroupement possible (cas des vis, boulons, etc.).
+- L'agregat regroupe plusieurs noms de produits très proches (ex:anneau torique, anneau cuivre , anneau m2x5 -> anneaux; filtre à air, filtre huile -> filtres; arbre complet, arbre primaire -> arbre ) — il doit être au pluriel.
+- Une même sous-famille ou agrégat peut exister dans plusieurs familles distinctes (ex: "famille: mécanique et sous_famille: outils", "famille: elecricité et sous_famille: outils")
+- Lorsqu'un terme générique comme "composants" est utilisé en sous-famille, il doit être précisé selon la famille à laquelle il appartient(ex : "composants mécaniques" pour la famille "mécanique", "composants électriques" pour "électricité").
+
+
+ Éviter :
+- Les sous-familles comme "kit de joints", "jeu de...", "à tête..." → préférer des formes simples : joints, vis...
+- Les réponses floues comme "embrayage et sélecteur" ou toute catégorie avec "et" ou combinaison hasardeuse.
+- De creer des sous_familles ou des agregats à partir de mots comme "à tête", "à bout", "à embout", "avec", etc.
+- De creer plusieurs catégories (famille " ex: elecrique = elecricité  → elecricité, outils = outillage  → outillage, chimie = chimique  → chimie, sécurité = protection  → sécurité " ou agregat "ex: vis, vis parker, vis à bois, vis abois  → vis" , faut prendre la catégorie la plus générale.
+- La multiplication excessive des sous-familles : regroupe les agrégats proches dans une même sous-famille plutôt que créer des sous-familles spécifiques pour chaque variante. Exemple : préfère une seule sous-famille "barres" plutôt que "barres de connexion", "barres de stabilisation", etc.
+- De creer les familles ou sous familles comme "produits chimiques", "produits de peinture", "produits électriques", etc. Préférer des catégories génériques et universelles (chimie, peinture, electricité).
+- De créer deux catégories distinctes à cause d'un accent manquant ou incorrect, utilise la forme orthographiquement correcte en français (avec accents) pour la catégorie finale (ex: boites = boîtes → boîtes)
+- De créer une famille à partir d'un nom qui a déjà été utilisé comme sous-famille dans une autre famille(ex: si la sous-famille "outils" existe dans la famille "mécanique", il est interdit de créer par la suite une famille "outils"). Ces termes doivent rester des sous-familles, pas devenir des familles.
+
+ Format de réponse strict pour chaque désignation :
+
+DESIGNATION: [désignation brute]
+PAIRES_ID_BASE: [ID_BASE fourni]
+FAMILLE: ...
+SOUS_FAMILLE: ...
+AGREGAT: ...
+NOM: [désignation nettoyée]
+
+ Exemple :
+
+DESIGNATION : anneau cuivre
+PAIRES_ID_BASE: [(43,gpairo),(5678,webpdrmif)]
+FAMILLE: mécanique
+SOUS_FAMILLE: bagues
+AGREGAT: anneaux
+NOM: anneau cuivre
+
+Maintenant, traite les désignations suivantes :
+"""
+
+
+def construire_prompt(designations):
+    prompt = PROMPT_CLASSIFICATION
+    for designation, liste_paires in designations:
+        prompt += f"\nPAIRES_ID_BASE : {liste_paires}\nDESIGNATION : {designation.strip().lower()}\n"
+    return prompt
+
+
+# ────────────── RÉPONSES EN FLUX ──────────────
+# Les réponses sont lues en flux (stream=True) et chaque élément est lu dès que son bloc
+# est complet : un flux coupé (timeout, connexion, max_tokens atteint) garde les éléments
+# déjà reçus et seul le reste est redemandé, dans un prompt plus court.
+
+MAX_REPRISES = 2
+
+
+class FluxInterrompu(Exception):
+    pass
+
+
+def flux_completion(client, prompt, temperature=TEMPERATURE, max_tokens=MAX_TOKENS):
+    # Fragments de texte de la réponse ; FluxInterrompu si elle est tronquée par max_tokens
+    flux = client.chat.completions.create(
+        model=MODELE,
+        messages=[{"role": "user", "content": prompt}],
+        temperature=temperature,
+        max_tokens=max_tokens,
+        stream=True
+    )
+    fin = None
+    for morceau in flux:
+        if not morceau.choices:
+            continue
+        choix = morceau.choices[0]
+        if choix.delta is not None and choix.delta.content:
+            yield choix.delta.content
+        fin = choix.finish_reason or fin
+    if fin == "length":
+        raise FluxInterrompu("réponse tronquée (max_tokens)")
+
+
+def lire_bloc_classification(bloc):
+    result = {
+        "designation": "",
+        "paires_id_base": [],
+        "famille": "inconnue",
+        "sous_famille": "inconnue",
+        "agregat": "inconnu",
+        "nom": ""
+    }
+
+    for line in bloc.strip().splitlines():
+        if ":" not in line:
+            continue
+        cle, valeur = line.split(":", 1)
+        cle = cle.strip().lower()
+        valeur = valeur.strip().lower()
+
+        if "designation" in cle:
+            result["designation"] = valeur
+        elif cle in result:
+            result[cle] = valeur
+
+    if not result["sous_famille"] or result["sous_famille"] in ["inconnu", "inconnue"]:
+        result["sous_famille"] = result["agregat"]
+    if not result["agregat"] or result["agregat"] in ["inconnu", "inconnue"]:
+        result["agregat"] = result["sous_famille"]
+    return result
+
+
+def lire_flux_classification(morceaux):
+    # Un bloc (une désignation) est complet à la ligne vide suivante ; le dernier à la fin
+    # du flux. Si le flux est coupé, le bloc en cours est abandonné et l'erreur remonte.
+    tampon = ""
+    for morceau in morceaux:
+        tampon += morceau
+        *blocs, tampon = tampon.split("\n\n")
+        for bloc in blocs:
+            result = lire_bloc_classification(bloc)
+            if result["paires_id_base"]:
+                yield result
+    if tampon.strip():
+        result = lire_bloc_classification(tampon)
+        if result["paires_id_base"]:
+            yield result
+
+
+def reussi(res):
+    return (res["famille"] != "inconnue" and
+            all(res.get(k, "").strip().lower() not in ["", "inconnu", "inconnue"]
+                for k in ["famille", "sous_famille", "agregat", "nom"]))
+
+
+def _inconnu(designation, paires_id_base):
+    return {
+        "designation": designation.strip().lower(),
+        "paires_id_base": paires_id_base,
+        "famille": "inconnue",
+        "sous_famille": "inconnue",
+        "agregat": "inconnu",
+        "nom": ""
+    }
+
+
+@profiler_thread
+def nettoyer_et_classer_batch(designations, batch_id=0, exemples_precedents=None, client=None,
+                              temperature=TEMPERATURE, max_tokens=MAX_TOKENS, sink=None,
+                              max_reprises=MAX_REPRISES):
+    # sink(result) est appelé pour chaque élément dès sa réception, avant la fin de la réponse
+    attendus = {str(paires_id_base).strip() for _, paires_id_base in designations}
+    results_dict = {}
+    restants = list(designations)
+
+    for reprise in range(max_reprises + 1):
+        try:
+            client = client or client_par_defaut()
+            morceaux = flux_completion(client, construire_prompt(restants), temperature, max_tokens)
+            for result in lire_flux_classification(morceaux):
+                # Utilisation de la paire comme clé texte
+                paires_str = str(result["paires_id_base"]).strip()
+                if paires_str in attendus and paires_str not in results_dict:
+                    results_dict[paires_str] = result
+                    if sink is not None:
+                        sink(result)
+            break
+        except Exception as e:
+            restants = [(d, p) for d, p in designations if str(p).strip() not in results_dict]
+            print(f"[Erreur batch {batch_id}] flux interrompu ({len(results_dict)} reçue(s), "
+                  f"{len(restants)} à redemander) :", e)
+            if not restants:
+                break
+
+    # Construire les résultats finaux dans l'ordre d'entrée
+    final_results = [results_dict.get(str(paires_id_base).strip()) or _inconnu(designation, paires_id_base)
+                     for designation, paires_id_base in designations]
+
+    nb_ok = len([r for r in final_results if r["famille"] != "inconnue"])
+    taux = round(100 * nb_ok / len(designations)) if designations else 0
+    print(f"[Batch {batch_id}] : {nb_ok}/{len(designations)} traitées avec succès ({taux}%)")
+
+    return final_results
+
+
+# ────────────── CORRECTION SOUS FAMILLE / AGREGAT ──────────────
+
+PROMPT_CORRECTION = """
+
+Tu es un expert en classification produit dans le domaine des pièces de rechange pour installations fixes et matériel roulant.
+
+Objectif :
+
+Corrige la classification de la sous famille et de l’agregat si nécessaire sinon les laisser à l'origine, en respectant les règles suivantes :
+
+1. La sous famille :
+   - Doit être une catégorie large, englobant plusieurs agrégats.
+   - Ne doit pas être spécifique ni construite autour d'un produit individuel.
+   - Doit être au pluriel si possible.
+   - Ne crée pas une sous famille plus précise que l’agregat.
+
+2. L’agregat :
+   - C’est un regroupement de produits très proches.
+   - Doit être au pluriel si possible.
+
+3. Relation hiérarchique :
+   - La sous famille doit toujours être plus large que l’agregat.
+
+4. Ne jamais sortir du domaine des pièces de rechange.
+
+Exemple:
+- clé : 1245
+- sous famille : bobine de démarrage
+- agregat : bobine
+
+->
+- clé : 1245
+- sous famille corrigée : bobine
+- agregat corrigé : bobine de démarrage
+
+Voici des exemples de classification correcte :
+ {exemples_textes}
+
+
+Pour chaque clé fournie, retourne uniquement :
+
+- clé : X
+- sous famille corrigée : ...
+- agregat corrigé : ...
+"""
+
+
+def generer_exemples(resultats_cumules, max_exemples=30):
+    exemples_injectes = set()
+    exemples_textes = []
+
+    for r in resultats_cumules:
+        sous_famille = str(r["sous_famille_corrigee"]).strip().lower()
+        agregat = str(r["agregat_corrige"]).strip().lower()
+
+        if sous_famille != "inconnue" and sous_famille not in exemples_injectes:
+            exemples_textes.append(
+                f"- clé : {r['clé']}\n- sous famille : {sous_famille}\n- agregat : {agregat}"
+            )
+            exemples_injectes.add(sous_famille)
+
+        if len(exemples_textes) >= max_exemples:
+            break
+
+    return exemples_textes
+
+
+def construire_prompt_correction(batch, exemples_textes_list=()):
+    prompt = PROMPT_CORRECTION.format(exemples_textes="\n".join(exemples_textes_list))
+    for description, key in batch:
+        prompt += f"\nclé : {key}\nsous famille actuelle : {description.strip()}"
+    return prompt
+
+
+def _sans_accents(texte):
+    texte = unicodedata.normalize("NFKD", texte.lower())
+    return "".join(c for c in texte if not unicodedata.combining(c))
+
+
+def _lignes(morceaux):
+    # Lignes complètes du flux ; la dernière à la fin du flux (abandonnée s'il est coupé)
+    tampon = ""
+    for morceau in morceaux:
+        tampon += morceau
+        *lignes, tampon = tampon.split("\n")
+        yield from lignes
+    yield tampon
+
+
+def lire_flux_correction(morceaux):
+    # Le prompt demande « sous famille corrigée » : les libellés sont comparés sans accents.
+    # Un élément est émis dès que sa clé, sa sous famille et son agregat sont arrivés.
+    cle, sous_famille, agregat = None, None, None
+
+    for ligne in _lignes(morceaux):
+        ligne = ligne.strip()
+        libelle = _sans_accents(ligne)
+        if libelle.lstrip("- ").startswith("cle"):
+            cle = ligne.split(":", 1)[1].strip()
+        elif "sous famille corrigee" in libelle:
+            sous_famille = ligne.split(":", 1)[1].strip()
+        elif "agregat corrige" in libelle:
+            agregat = ligne.split(":", 1)[1].strip()
+
+        if cle and sous_famille and agregat:
+            yield {
+                "clé": cle,
+                "sous_famille_corrigee": sous_famille,
+                "agregat_corrige": agregat
+            }
+            cle, sous_famille, agregat = None, None, None
+
+
+def lire_reponse_correction(response):
+    return list(lire_flux_correction([response]))
+
+
+@profiler_thread
+def corriger_batch(batch, exemples_textes_list=(), client=None, temperature=TEMPERATURE,
+                   max_tokens=MAX_TOKENS_CORRECTION, sink=None, max_reprises=MAX_REPRISES):
+    client = client or client_par_defaut()
+    attendues = {str(key).strip() for _, key in batch}
+    recus = {}
+    restants = list(batch)
+
+    for reprise in range(max_reprises + 1):
+        try:
+            morceaux = flux_completion(client, construire_prompt_correction(restants, exemples_textes_list),
+                                       temperature, max_tokens)
+            for res in lire_flux_correction(morceaux):
+                if res["clé"] in attendues and res["clé"] not in recus:
+                    recus[res["clé"]] = res
+                    if sink is not None:
+                        sink(res)
+            break
+        except Exception as e:
+            restants = [(d, key) for d, key in batch if str(key).strip() not in recus]
+            print(f"[Correction] flux interrompu ({len(recus)} reçue(s), {len(restants)} à redemander) :", e)
+            if not restants:
+                break
+    return list(recus.values())
@@ -0,0 +1,445 @@
+import argparse
+import ast
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import pandas as pd
+
+from ecriture_groupee import EcrivainGroupe
+from classification_llm import reussi
+from filtrage_designations import separer_non_identifiables, LIBELLE_NON_IDENTIFIABLE
+from profilage import activer, etape, profiler_thread
+
+# Classification shardée : les groupes de groupement_resultat.csv sont répartis en N shards
+# par hash stable de la désignation ; chaque shard tourne dans son propre process (ou sur
+# sa propre machine) avec sa clé API et son budget d'appels, puis fusionner() recombine
+# les sorties de façon déterministe.
+#
+#   python classification_shards.py partitionner --shards 4
+#   python classification_shards.py executer --shard 2          (clé : TOGETHER_API_KEY_2)
+#   python classification_shards.py lancer --shards 4           (les 4 shards en local)
+#   python classification_shards.py fusionner
+
+DOSSIER_SHARDS = "shards"
+FICHIER_MANIFESTE = "manifeste.json"
+ENTETE_CLASSIFICATION = ["DESI_ARTI", "PAIRES_ID_BASE", "famille", "sous famille", "agregat", "nom produit"]
+ENTETE_INCONNUS = ["DESI_ARTI", "PAIRES_ID_BASE", "designation_nettoyee"]
+COLONNES_CLASSE = ["famille", "sous famille", "agregat", "nom produit"]
+SORTIES_SHARD = ["classification.csv", "inconnus.csv", "log.txt", "etat.json", "partition.json"]
+
+
+def numero_shard(designation, nb_shards):
+    # Ne dépend que de la désignation : un groupe reste dans le même shard d'un run à l'autre
+    empreinte = hashlib.sha1(str(designation).strip().lower().encode("utf-8")).digest()
+    return int.from_bytes(empreinte[:8], "big") % nb_shards
+
+
+def dossier_shard(dossier, index):
+    return os.path.join(dossier, f"shard_{index:03d}")
+
+
+def _empreinte_fichier(chemin):
+    h = hashlib.sha1()
+    with open(chemin, "rb") as f:
+        for bloc in iter(lambda: f.read(1 << 20), b""):
+            h.update(bloc)
+    return h.hexdigest()
+
+
+def _archiver_sorties(dossier):
+    # Les sorties d'un partitionnement précédent serviraient d'état de reprise au nouveau :
+    # elles sont déplacées dans <dossier>/archive_<horodatage>/, pas supprimées (appels déjà payés)
+    if not os.path.isdir(dossier):
+        return None
+    archive = os.path.join(dossier, "archive_" + time.strftime("%Y%m%d-%H%M%S"))
+    deplaces = 0
+    for nom in sorted(os.listdir(dossier)):
+        racine = os.path.join(dossier, nom)
+        if not (nom.startswith("shard_") and os.path.isdir(racine)):
+            continue
+        for sortie in SORTIES_SHARD:
+            if os.path.exists(os.path.join(racine, sortie)):
+                os.makedirs(os.path.join(archive, nom), exist_ok=True)
+                os.replace(os.path.join(racine, sortie), os.path.join(archive, nom, sortie))
+                deplaces += 1
+        shutil.rmtree(racine, ignore_errors=True)
+    if os.path.exists(os.path.join(dossier, FICHIER_MANIFESTE)):
+        os.makedirs(archive, exist_ok=True)
+        os.replace(os.path.join(dossier, FICHIER_MANIFESTE), os.path.join(archive, FICHIER_MANIFESTE))
+    if deplaces:
+        print(f"↪️ {deplaces} sortie(s) du partitionnement précédent déplacées dans {archive}")
+    return archive
+
+
+def partitionner(fichier="groupement_resultat.csv", nb_shards=4, dossier=DOSSIER_SHARDS):
+    df = pd.read_csv(fichier, encoding="utf-8-sig")
+    _archiver_sorties(dossier)
+    shards = df["DESI_ARTI"].map(lambda d: numero_shard(d, nb_shards))
+    manifeste = {"source": os.path.abspath(fichier), "empreinte": _empreinte_fichier(fichier),
+                 "shards": nb_shards, "groupes": {}, "date": time.strftime("%Y-%m-%d %H:%M:%S")}
+    for index in range(nb_shards):
+        racine = dossier_shard(dossier, index)
+        os.makedirs(racine, exist_ok=True)
+        part = df[shards == index]
+        part.to_csv(os.path.join(racine, "groupement_resultat.csv"), index=False, encoding="utf-8-sig")
+        manifeste["groupes"][str(index)] = len(part)
+    with open(os.path.join(dossier, FICHIER_MANIFESTE), "w", encoding="utf-8") as f:
+        json.dump(manifeste, f, ensure_ascii=False, indent=2)
+    print(f"{len(df)} groupe(s) répartis en {nb_shards} shard(s) : {list(manifeste['groupes'].values())}")
+    return manifeste
+
+
+def lire_manifeste(dossier=DOSSIER_SHARDS):
+    with open(os.path.join(dossier, FICHIER_MANIFESTE), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def verifier_manifeste(fichier, nb_shards=None, dossier=DOSSIER_SHARDS):
+    # Reprise seulement si le partitionnement existant correspond à la même entrée et au
+    # même nombre de shards ; sinon les sorties des shards mélangeraient deux runs
+    manifeste = lire_manifeste(dossier)
+    ecarts = []
+    if manifeste["empreinte"] != _empreinte_fichier(fichier):
+        ecarts.append(f"{fichier} a changé depuis le partitionnement de {manifeste['source']} ({manifeste['date']})")
+    if nb_shards is not None and manifeste["shards"] != nb_shards:
+        ecarts.append(f"{manifeste['shards']} shard(s) partitionnés, {nb_shards} demandés")
+    if ecarts:
+        raise ValueError("Partitionnement existant incompatible : " + " ; ".join(ecarts)
+                         + f". Relancer `partitionner` (les sorties actuelles seront archivées dans {dossier}).")
+    return manifeste
+
+
+# ────────────── EXÉCUTION D'UN SHARD ──────────────
+
+class Limiteur:
+    # Budget d'appels par minute de la clé du shard, partagé par ses threads
+    def __init__(self, appels_par_minute=None):
+        self.intervalle = 60.0 / appels_par_minute if appels_par_minute else 0.0
+        self.prochain = time.monotonic()
+        self.verrou = threading.Lock()
+
+    def attendre(self):
+        if not self.intervalle:
+            return
+        with self.verrou:
+            maintenant = time.monotonic()
+            depart = max(self.prochain, maintenant)
+            self.prochain = depart + self.intervalle
+        time.sleep(max(0.0, depart - maintenant))
+
+
+def classer_together(cle_api, limiteur=None):
+    from classification_llm import nettoyer_et_classer_batch
+    from pool_llm import URL_TOGETHER, ClientHTTP
+    client = ClientHTTP(URL_TOGETHER, cle_api)
+    if limiteur is not None:
+        # Budget compté par appel API : un lot tronqué fait jusqu'à 1 + MAX_REPRISES appels
+        creer = client.chat.completions.create
+
+        def creer_limite(*args, **kwargs):
+            limiteur.attendre()
+            return creer(*args, **kwargs)
+        client.chat.completions.create = creer_limite
+    return partial(nettoyer_et_classer_batch, client=client)
+
+
+def classer_simule(latence=0.5, limiteur=None):
+    # Remplace l'API pour mesurer le passage à l'échelle : latence fixe par appel,
+    # catégories dérivées de la désignation.
+    def classer(designations, batch_id=0, exemples_precedents=None, sink=None):
+        if limiteur is not None:
+            limiteur.attendre()
+        time.sleep(latence)
+        resultats = []
+        for designation, paires in designations:
+            mots = str(designation).split() or ["divers"]
+            resultats.append({"designation": designation, "paires_id_base": paires, "famille": "mécanique",
+                              "sous_famille": mots[0] + "s", "agregat": mots[-1] + "s", "nom": designation})
+            if sink is not None:
+                sink(resultats[-1])
+        return resultats
+    return classer
+
+
+def cle_api_shard(index, variable=None):
+    return os.environ.get(variable or f"TOGETHER_API_KEY_{index}") or os.environ.get("TOGETHER_API_KEY", "")
+
+
+def executer_shard(index, classer, dossier=DOSSIER_SHARDS, batch_size=50, workers=4, max_retentatives=3):
+    # Le budget d'appels par minute est appliqué par classer (Limiteur passé à classer_together)
+    manifeste = lire_manifeste(dossier)
+    nb_shards = manifeste["shards"]
+    if not 0 <= index < nb_shards:
+        raise ValueError(f"Shard {index} hors du partitionnement ({nb_shards} shard(s))")
+    racine = dossier_shard(dossier, index)
+    sortie = os.path.join(racine, "classification.csv")
+
+    # partition.json relie les sorties du shard au partitionnement qui les a produites : sur une
+    # machine distante, un groupement_resultat.csv recopié après un nouveau partitionnement ne
+    # doit pas reprendre d'anciennes sorties
+    partition = {"empreinte": manifeste["empreinte"], "shards": nb_shards, "date": manifeste["date"]}
+    chemin_partition = os.path.join(racine, "partition.json")
+    if os.path.exists(sortie):
+        precedente = None
+        if os.path.exists(chemin_partition):
+            with open(chemin_partition, "r", encoding="utf-8") as f:
+                precedente = json.load(f)
+        if precedente != partition:
+            raise ValueError(f"Sorties du shard {index} issues d'un autre partitionnement que {FICHIER_MANIFESTE} "
+                             f"({(precedente or {}).get('date', 'inconnu')} contre {manifeste['date']}) : "
+                             f"relancer `partitionner` ou retirer les sorties de {racine}")
+    else:
+        with open(chemin_partition + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(partition, f, indent=2)
+        os.replace(chemin_partition + ".tmp", chemin_partition)
+    df = pd.read_csv(os.path.join(racine, "groupement_resultat.csv"), encoding="utf-8-sig", dtype=str)
+
+    # Reprise : les groupes déjà classés lors d'un run interrompu ne sont pas renvoyés
+    reprise = os.path.exists(sortie)
+    if reprise:
+        deja = set(pd.read_csv(sortie, encoding="utf-8-sig", dtype=str)["PAIRES_ID_BASE"])
+        df = df[~df["PAIRES_ID_BASE"].isin(deja)]
+    df, rejetees = separer_non_identifiables(df, "DESI_ARTI")
+
+    ecrivain = EcrivainGroupe()
+    ecrivain.ajouter_sortie("classification", sortie, entete=None if reprise else ENTETE_CLASSIFICATION)
+    ecrivain.ajouter_sortie("log", os.path.join(racine, "log.txt"), format="texte")
+    ecrivain.ecrire("classification", [
+        [desi, paires, LIBELLE_NON_IDENTIFIABLE, LIBELLE_NON_IDENTIFIABLE, LIBELLE_NON_IDENTIFIABLE, desi]
+        for desi, paires in zip(rejetees["DESI_ARTI"], rejetees["PAIRES_ID_BASE"])])
+
+    appels = 0
+
+    def ecrire_reussite(r):
+        if reussi(r):
+            ecrivain.ecrire("classification", [
+                [r.get("designation"), str(r["paires_id_base"]), r["famille"], r["sous_famille"], r["agregat"],
+                 r["nom"]]])
+
+    @profiler_thread
+    def traiter(args):
+        numero, lot = args
+        # Chaque désignation classée part vers l'écrivain dès sa réception dans le flux
+        resultats = classer(lot, batch_id=f"S{index}-{numero}", sink=ecrire_reussite)
+        ecrivain.ecrire("log", [
+            f"{r.get('designation')} ➜ [{r['famille']} / {r['sous_famille']} / {r['agregat']} / {r['nom']}]\n"
+            for r in resultats])
+        classees = {str(r["paires_id_base"]).strip() for r in resultats if reussi(r)}
+        return [(d, p) for d, p in lot if str(p).strip() not in classees]
+
+    debut = time.time()
+    a_traiter = list(zip(df["DESI_ARTI"], df["PAIRES_ID_BASE"]))
+    for tentative in range(max_retentatives + 1):
+        if not a_traiter:
+            break
+        lots = [a_traiter[i:i + batch_size] for i in range(0, len(a_traiter), batch_size)]
+        appels += len(lots)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            a_traiter = [echec for echecs in executor.map(traiter, enumerate(lots)) for echec in echecs]
+        print(f"[Shard {index}] passe {tentative} : {len(lots)} appel(s), {len(a_traiter)} inconnu(s) restant(s)")
+
+    ecrivain.ajouter_sortie("inconnus", os.path.join(racine, "inconnus.csv"), entete=ENTETE_INCONNUS)
+    ecrivain.ecrire("inconnus", [[d, p, ""] for d, p in a_traiter])
+    ecrivain.fermer()
+
+    duree = time.time() - debut
+    etat = {"shard": index, "groupes": len(df) + len(rejetees), "non_identifiables": len(rejetees),
+            "inconnus": len(a_traiter), "appels": appels, "duree_s": round(duree, 2),
+            "groupes_par_s": round(len(df) / duree, 2) if duree else None, "reprise": reprise}
+    with open(os.path.join(racine, "etat.json"), "w", encoding="utf-8") as f:
+        json.dump(etat, f, indent=2)
+    print(f"[Shard {index}] terminé : {etat}")
+    return etat
+
+
+# ────────────── LANCEMENT LOCAL ──────────────
+
+def lancer(nb_shards, dossier=DOSSIER_SHARDS, options=()):
+    # Un process par shard ; chaque process lit sa propre clé (TOGETHER_API_KEY_<i>)
+    process = [subprocess.Popen([sys.executable, os.path.abspath(__file__), "executer", "--shard", str(i),
+                                 "--dossier", dossier, *options]) for i in range(nb_shards)]
+    codes = [p.wait() for p in process]
+    echecs = [i for i, code in enumerate(codes) if code != 0]
+    if echecs:
+        print(f"Shard(s) en échec : {echecs} (relancer `executer --shard <i>` reprend où il s'est arrêté)")
+    return codes
+
+
+# ────────────── FUSION ──────────────
+
+def _paires(valeur):
+    try:
+        return [str(tuple(p)) for p in ast.literal_eval(valeur)]
+    except (ValueError, SyntaxError, TypeError):
+        return [str(valeur)]
+
+
+def _garder_par_paire(df, exclues=()):
+    # Chaque paire (ID, BASE) n'est gardée qu'une fois, sur la première ligne de df qui la porte ;
+    # une ligne dont une partie des paires est prise ailleurs est réécrite avec les siennes seulement
+    paires = df["PAIRES_ID_BASE"].map(_paires)
+    long = paires.explode().dropna()
+    long = long[~long.isin(set(exclues))]
+    gardees = long[~long.duplicated()].groupby(level=0).agg(list)
+    df = df.loc[gardees.index].copy()
+    reduites = gardees.map(len) < paires.loc[gardees.index].map(len)
+    df.loc[reduites, "PAIRES_ID_BASE"] = gardees[reduites].map(lambda p: "[" + ", ".join(p) + "]")
+    return df
+
+
+def fusionner(dossier=DOSSIER_SHARDS, sortie="classification.csv", sortie_inconnus="inconnus.csv",
+              rapport="rapport_fusion.csv"):
+    manifeste = lire_manifeste(dossier)
+    parts, inconnus, manquants = [], [], []
+    for index in range(manifeste["shards"]):
+        racine = dossier_shard(dossier, index)
+        chemin = os.path.join(racine, "classification.csv")
+        if not os.path.exists(chemin):
+            manquants.append(index)
+            continue
+        parts.append(pd.read_csv(chemin, encoding="utf-8-sig", dtype=str, keep_default_na=False).assign(shard=index))
+        chemin_inconnus = os.path.join(racine, "inconnus.csv")
+        if os.path.exists(chemin_inconnus):
+            inconnus.append(pd.read_csv(chemin_inconnus, encoding="utf-8-sig", dtype=str, keep_default_na=False))
+    if manquants:
+        print(f"⚠️ Shard(s) sans sortie : {manquants}")
+    if not parts:
+        raise FileNotFoundError(f"Aucune sortie de shard dans {dossier}")
+
+    # Ordre total indépendant de l'ordre de fin des shards et des threads
+    df = pd.concat(parts, ignore_index=True).sort_values(
+        ["shard", "PAIRES_ID_BASE", "DESI_ARTI"] + COLONNES_CLASSE, kind="mergesort")
+
+    # Doublons / conflits au niveau de la paire (ID, BASE)
+    long = df.assign(paire=df["PAIRES_ID_BASE"].map(_paires)).explode("paire")
+    long["classe"] = long[COLONNES_CLASSE].agg(" / ".join, axis=1)
+    par_paire = long.groupby("paire")["classe"].agg(["size", "nunique"])
+    doublons = par_paire[(par_paire["size"] > 1) & (par_paire["nunique"] == 1)].index
+    conflits = par_paire[par_paire["nunique"] > 1].index
+    details = long[long["paire"].isin(doublons.union(conflits))].assign(
+        type=lambda d: d["paire"].isin(conflits).map({True: "conflit", False: "doublon"}))
+    details[["type", "paire", "shard", "DESI_ARTI", "classe"]].to_csv(rapport, index=False, encoding="utf-8-sig")
+
+    # Résolution déterministe par paire : première occurrence dans l'ordre (shard, paires, désignation),
+    # le même que le rapport ; une paire en conflit ne sort donc qu'avec une seule classe
+    fusion = _garder_par_paire(df)
+    fusion = fusion.sort_values(["DESI_ARTI", "PAIRES_ID_BASE"], kind="mergesort")[ENTETE_CLASSIFICATION]
+    fusion.to_csv(sortie, index=False, encoding="utf-8-sig")
+    df_inconnus = (pd.concat(inconnus, ignore_index=True) if inconnus else pd.DataFrame(columns=ENTETE_INCONNUS))
+    df_inconnus = df_inconnus.sort_values(["DESI_ARTI", "PAIRES_ID_BASE"], kind="mergesort")
+    df_inconnus = _garder_par_paire(df_inconnus, exclues=long["paire"])[ENTETE_INCONNUS]
+    df_inconnus.to_csv(sortie_inconnus, index=False, encoding="utf-8-sig")
+
+    resume = {"shards": manifeste["shards"], "shards_manquants": manquants, "lignes": len(fusion),
+              "inconnus": len(df_inconnus), "paires_en_doublon": len(doublons), "paires_en_conflit": len(conflits)}
+    print(f"Fusion : {resume} -> {sortie}, détail des doublons/conflits dans {rapport}")
+    return fusion, resume
+
+
+# ────────────── MESURE DU PASSAGE À L'ÉCHELLE ──────────────
+
+def benchmark(nb_shards_liste, fichier, groupes=2000, latence=0.5, appels_par_minute=120, workers=4):
+    import tempfile
+
+    source = pd.read_csv(fichier, encoding="utf-8-sig").head(groupes)
+    lignes = []
+    for nb_shards in nb_shards_liste:
+        dossier = tempfile.mkdtemp(prefix=f"shards{nb_shards}_")
+        entree = os.path.join(dossier, "groupement_resultat.csv")
+        source.to_csv(entree, index=False, encoding="utf-8-sig")
+        partitionner(entree, nb_shards, dossier)
+        debut = time.perf_counter()
+        lancer(nb_shards, dossier, ["--simulation", str(latence), "--appels-par-minute", str(appels_par_minute),
+                                    "--workers", str(workers)])
+        duree = time.perf_counter() - debut
+        fusion, _ = fusionner(dossier, os.path.join(dossier, "classification.csv"),
+                              os.path.join(dossier, "inconnus.csv"), os.path.join(dossier, "rapport_fusion.csv"))
+        lignes.append({"shards": nb_shards, "duree_s": round(duree, 2), "groupes_par_s": round(len(source) / duree, 1),
+                       "lignes_fusionnees": len(fusion)})
+    resultat = pd.DataFrame(lignes)
+    resultat["acceleration"] = (resultat["groupes_par_s"] / resultat["groupes_par_s"].iloc[0]).round(2)
+    return resultat
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Classification shardée multi-process / multi-machine")
+    sous = parser.add_subparsers(dest="commande", required=True)
+
+    p = sous.add_parser("partitionner", help="répartir groupement_resultat.csv en N shards")
+    p.add_argument("--shards", type=int, default=4)
+    p.add_argument("--fichier", default="groupement_resultat.csv")
+    p.add_argument("--dossier", default=DOSSIER_SHARDS)
+
+    for nom, aide in [("executer", "classer un shard (process ou machine dédiée)"),
+                      ("lancer", "partitionner si besoin puis lancer tous les shards en local et fusionner")]:
+        p = sous.add_parser(nom, help=aide)
+        if nom == "executer":
+            p.add_argument("--shard", type=int, required=True)
+            p.add_argument("--cle-env", help="variable d'environnement de la clé API (défaut TOGETHER_API_KEY_<shard>)")
+            p.add_argument("--fichier", help="groupement_resultat.csv source, vérifié contre le manifeste s'il est fourni")
+        else:
+            p.add_argument("--shards", type=int, default=4)
+            p.add_argument("--fichier", default="groupement_resultat.csv")
+        p.add_argument("--dossier", default=DOSSIER_SHARDS)
+        p.add_argument("--batch-size", type=int, default=50)
+        p.add_argument("--workers", type=int, default=4)
+        p.add_argument("--appels-par-minute", type=float, help="budget d'appels de la clé du shard")
+        p.add_argument("--retentatives", type=int, default=3)
+        p.add_argument("--simulation", type=float, metavar="LATENCE", help="classifieur simulé (secondes par appel)")
+        p.add_argument("--profiler", action="store_true", help="profil CPU / mémoire par shard dans profils/")
+
+    p = sous.add_parser("fusionner", help="fusionner les sorties des shards")
+    p.add_argument("--dossier", default=DOSSIER_SHARDS)
+    p.add_argument("--sortie", default="classification.csv")
+
+    p = sous.add_parser("bench", help="débit selon le nombre de shards, classifieur simulé")
+    p.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    p.add_argument("--fichier", default="groupement_resultat.csv")
+    p.add_argument("--groupes", type=int, default=2000)
+    p.add_argument("--latence", type=float, default=0.5)
+    p.add_argument("--appels-par-minute", type=float, default=120)
+    args = parser.parse_args()
+    if getattr(args, "profiler", False):
+        activer()
+
+    if args.commande == "partitionner":
+        partitionner(args.fichier, args.shards, args.dossier)
+    elif args.commande == "executer":
+        limiteur = Limiteur(args.appels_par_minute)
+        classer = (classer_simule(args.simulation, limiteur) if args.simulation is not None
+                   else classer_together(cle_api_shard(args.shard, args.cle_env), limiteur))
+        try:
+            if args.fichier:
+                verifier_manifeste(args.fichier, dossier=args.dossier)
+            with etape(f"shard_{args.shard}"):
+                executer_shard(args.shard, classer, args.dossier, args.batch_size, args.workers, args.retentatives)
+        except ValueError as e:
+            parser.error(str(e))
+    elif args.commande == "lancer":
+        if not os.path.exists(os.path.join(args.dossier, FICHIER_MANIFESTE)):
+            partitionner(args.fichier, args.shards, args.dossier)
+        else:
+            try:
+                verifier_manifeste(args.fichier, args.shards, args.dossier)
+            except ValueError as e:
+                parser.error(str(e))
+        options = ["--fichier", args.fichier, "--batch-size", str(args.batch_size), "--workers", str(args.workers),
+                   "--retentatives", str(args.retentatives)]
+        if args.appels_par_minute:
+            options += ["--appels-par-minute", str(args.appels_par_minute)]
+        if args.simulation is not None:
+            options += ["--simulation", str(args.simulation)]
+        lancer(lire_manifeste(args.dossier)["shards"], args.dossier, options)
+        fusionner(args.dossier)
+    elif args.commande == "fusionner":
+        fusionner(args.dossier, args.sortie)
+    else:
+        print(benchmark(args.shards, args.fichier, args.groupes, args.latence, args.appels_par_minute).to_string(index=False))
@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+import re
+import time
+import unicodedata
+
+import pandas as pd
+
+from profilage import profiler_etape
+
+FICHIER_REGISTRE = "registre_cles.csv"
+FICHIER_ETAT_CORRECTIONS = "etat_corrections.json"
+COLONNES_REGISTRE = ["clé", "sous famille", "agregat", "date_creation"]
+
+
+def normaliser(libelle):
+    if libelle is None or (isinstance(libelle, float) and pd.isna(libelle)):
+        return ""
+    texte = unicodedata.normalize("NFC", str(libelle)).strip().lower()
+    return re.sub(r"\s+", " ", texte)
+
+
+def cle_stable(sous_famille, agregat):
+    # La clé ne dépend que du couple normalisé : ajouter une sous-famille ne renumérote
+    # plus les autres. Préfixe "K" pour que pandas ne relise jamais la clé comme un entier.
+    paire = f"{normaliser(sous_famille)}___{normaliser(agregat)}"
+    return "K" + hashlib.sha1(paire.encode("utf-8")).hexdigest()[:12]
+
+
+def lire_registre(fichier=FICHIER_REGISTRE):
+    if not os.path.exists(fichier):
+        return pd.DataFrame(columns=COLONNES_REGISTRE)
+    return pd.read_csv(fichier, encoding="utf-8-sig", dtype=str, keep_default_na=False)
+
+
+def attribuer_cles(df, col_sous_famille="sous famille", col_agregat="agregat", fichier_registre=FICHIER_REGISTRE):
+    # Calcule la clé de chaque ligne (sur les couples distincts uniquement) et ajoute au
+    # registre les nouveaux couples. Le registre n'est jamais réécrit, seulement complété.
+    paires = pd.DataFrame({
+        "sous famille": df[col_sous_famille].map(normaliser),
+        "agregat": df[col_agregat].map(normaliser),
+    })
+    uniques = paires.drop_duplicates().copy()
+    uniques["clé"] = [cle_stable(sf, ag) for sf, ag in zip(uniques["sous famille"], uniques["agregat"])]
+
+    registre = lire_registre(fichier_registre)
+    connues = uniques.merge(registre[["clé", "sous famille", "agregat"]], on="clé", how="inner",
+                            suffixes=("", "_registre"))
+    collisions = connues[(connues["sous famille"] != connues["sous famille_registre"]) |
+                         (connues["agregat"] != connues["agregat_registre"])]
+    if not collisions.empty:
+        raise ValueError(f"Collision de clés dans le registre : {collisions['clé'].tolist()[:5]}")
+
+    nouvelles = uniques[~uniques["clé"].isin(registre["clé"])].assign(date_creation=time.strftime("%Y-%m-%d"))
+    if not nouvelles.empty:
+        ecrire_entete = not os.path.exists(fichier_registre)
+        nouvelles[COLONNES_REGISTRE].to_csv(fichier_registre, mode="a", header=ecrire_entete,
+                                            index=False, encoding="utf-8-sig")
+    print(f"Registre des clés : {len(uniques)} couple(s), {len(nouvelles)} nouveau(x)")
+
+    return paires.merge(uniques, on=["sous famille", "agregat"], how="left")["clé"].set_axis(df.index)
+
+
+# ────────────── FUSION INCRÉMENTALE DES CORRECTIONS ──────────────
+
+def _signatures(df_corrections, col_sf, col_ag):
+    valeurs = df_corrections[col_sf].astype(str) + "___" + df_corrections[col_ag].astype(str)
+    return dict(zip(df_corrections["clé"].astype(str),
+                    valeurs.map(lambda v: hashlib.sha1(v.encode("utf-8")).hexdigest())))
+
+
+@profiler_etape("fusion_corrections")
+def appliquer_corrections_incremental(df_produits, df_corrections, fichier_sortie,
+                                      fichier_etat=FICHIER_ETAT_CORRECTIONS,
+                                      col_sf_corr="sous_famille_corrigee_normalisee",
+                                      col_ag_corr="agregat_corrige_normalise"):
+    # Ne recalcule que les lignes nouvelles ou dont la correction de clé a changé depuis
+    # le dernier passage ; les autres lignes sont reprises telles quelles de la sortie précédente.
+    # Identité d'une ligne : toutes les colonnes que la correction ne modifie pas
+    # (sous famille et agregat sont déjà portés par la clé).
+    identite = [c for c in df_produits.columns if c not in ("sous famille", "agregat")]
+    df_corrections = df_corrections.drop_duplicates("clé", keep="last").astype({"clé": str})
+    df_produits = df_produits.astype({"clé": str})
+    signatures = _signatures(df_corrections, col_sf_corr, col_ag_corr)
+
+    etat = {}
+    if os.path.exists(fichier_etat):
+        with open(fichier_etat, "r", encoding="utf-8") as f:
+            etat = json.load(f)
+    precedent = None
+    if etat and os.path.exists(fichier_sortie):
+        precedent = pd.read_csv(fichier_sortie, encoding="utf-8-sig", dtype={"clé": str})
+
+    cles_changees = {c for c in set(signatures) | set(etat) if signatures.get(c) != etat.get(c)}
+    if precedent is None:
+        a_traiter = df_produits
+        conserves = df_produits.iloc[0:0]
+    else:
+        deja = pd.MultiIndex.from_frame(precedent[identite].astype(str))
+        courant = pd.MultiIndex.from_frame(df_produits[identite].astype(str))
+        a_traiter = df_produits[~courant.isin(deja) | df_produits["clé"].isin(cles_changees)]
+        # Lignes précédentes toujours présentes et non recalculées
+        ids_a_traiter = pd.MultiIndex.from_frame(a_traiter[identite].astype(str))
+        conserves = precedent[deja.isin(courant) & ~deja.isin(ids_a_traiter)]
+
+    df_merged = a_traiter.merge(df_corrections[["clé", col_sf_corr, col_ag_corr]], on="clé", how="left")
+    df_merged["sous famille"] = df_merged[col_sf_corr].combine_first(df_merged["sous famille"])
+    df_merged["agregat"] = df_merged[col_ag_corr].combine_first(df_merged["agregat"])
+    df_merged = df_merged.drop(columns=[col_sf_corr, col_ag_corr])
+
+    resultat = pd.concat([conserves, df_merged], ignore_index=True)
+    resultat.to_csv(fichier_sortie, index=False, encoding="utf-8-sig")
+    with open(fichier_etat, "w", encoding="utf-8") as f:
+        json.dump(signatures, f)
+
+    print(f"Corrections : {len(a_traiter)} ligne(s) recalculée(s), {len(conserves)} reprise(s), "
+          f"{len(cles_changees)} clé(s) nouvelle(s) ou modifiée(s)")
+    return resultat
@@ -0,0 +1,81 @@
+import pandas as pd
+
+from filtrage_designations import LIBELLE_NON_IDENTIFIABLE
+
+# Règles structurelles du prompt de nettoyer_et_classer_batch, vérifiées sur toute la
+# table classifiée par opérations vectorisées (isin, str.*, merge), sans boucle par ligne.
+REGLES = {
+    "famille_deja_sous_famille": "un terme utilisé comme sous-famille ne doit jamais devenir une famille",
+    "sous_famille_deja_famille": "un terme existant comme famille ne doit pas être recréé comme sous-famille",
+    "agregat_egal_sous_famille": "l'agrégat ne doit pas être identique à la sous-famille",
+    "combinaison_et": "pas de catégorie combinée avec « et »",
+    "enveloppe_generique": "pas de catégorie « produits X », « kit de X », « jeu de X »",
+}
+
+COLONNES = {"famille": "famille", "sous_famille": "sous famille", "agregat": "agregat"}
+
+
+def replier(series):
+    # Repli proche de canonicalisation.replier + raciner (minuscules, sans accents, pluriel simple
+    # retiré), pour que « Outils » et « outil » soient comparés comme égaux. Contrairement à
+    # cle_canonique, ni enveloppes ni synonymes : « kit de joints » doit rester visible.
+    return (series.astype("string").fillna("")
+            .str.lower()
+            .str.normalize("NFKD")
+            .str.replace("[\u0300-\u036f]", "", regex=True)
+            .str.replace(r"[’'\-_/]", " ", regex=True)
+            .str.replace(r"(?<=\w\w\w)[sx]\b", "", regex=True)
+            .str.replace(r"\s+", " ", regex=True)
+            .str.strip())
+
+
+def verifier(df, col_cle="clé", colonnes=COLONNES):
+    col_fam, col_sf, col_ag = colonnes["famille"], colonnes["sous_famille"], colonnes["agregat"]
+    df = df.copy()
+    if col_cle not in df.columns:
+        df[col_cle] = df.index
+    # Une ligne par combinaison distincte : les règles portent sur les catégories, pas sur les produits
+    cats = df[[col_cle, col_fam, col_sf, col_ag]].drop_duplicates()
+    # Les désignations non identifiables portent le même libellé aux trois niveaux : hors règles
+    non_identifiable = cats[[col_fam, col_sf, col_ag]].eq(LIBELLE_NON_IDENTIFIABLE).any(axis=1)
+    cats = cats[~non_identifiable].reset_index(drop=True)
+    fam, sf, ag = replier(cats[col_fam]), replier(cats[col_sf]), replier(cats[col_ag])
+
+    # Une sous-famille homonyme de sa propre famille (« outillage / outillage ») n'est pas un conflit
+    autre_niveau = sf != fam
+    familles = set(fam[(fam != "") & autre_niveau])
+    sous_familles = set(sf[(sf != "") & autre_niveau])
+
+    enveloppe = r"^(?:produits?|kits?|jeux?|lots?|assortiments?)\s+(?:de\s+|d\s+|pour\s+)?\w"
+    masques = {
+        "famille_deja_sous_famille": fam.isin(sous_familles) & (fam != ""),
+        "sous_famille_deja_famille": sf.isin(familles) & (sf != ""),
+        "agregat_egal_sous_famille": (ag == sf) & (ag != ""),
+        "combinaison_et": fam.str.contains(r"\bet\b") | sf.str.contains(r"\bet\b") | ag.str.contains(r"\bet\b"),
+        "enveloppe_generique": fam.str.contains(enveloppe) | sf.str.contains(enveloppe) | ag.str.contains(enveloppe),
+    }
+
+    violations = pd.concat(
+        [cats[masque.fillna(False).astype(bool)].assign(regle=regle) for regle, masque in masques.items()],
+        ignore_index=True)
+    violations["description"] = violations["regle"].map(REGLES)
+    return violations[[col_cle, "regle", col_fam, col_sf, col_ag, "description"]]
+
+
+def cles_a_corriger(violations, col_cle="clé"):
+    return sorted(violations[col_cle].unique())
+
+
+def resume(violations):
+    return violations["regle"].value_counts().reindex(list(REGLES), fill_value=0)
+
+
+if __name__ == "__main__":
+    import sys
+
+    fichier = sys.argv[1] if len(sys.argv) > 1 else "produits_groupes.csv"
+    df = pd.read_csv(fichier, encoding="utf-8-sig")
+    violations = verifier(df)
+    violations.to_csv("violations_hierarchie.csv", index=False, encoding="utf-8-sig")
+    print(resume(violations).to_string())
+    print(f"{len(cles_a_corriger(violations))} clé(s) à corriger -> violations_hierarchie.csv")
@@ -0,0 +1,194 @@
+import argparse
+import os
+import re
+import time
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+from service_correspondance import FICHIER_CORRESPONDANCE, FICHIER_REFERENTIEL
+
+# Consolidation des produits quasi-doublons du Referentiel Central (« aile arriere » / « arriere »
+# dans le même agrégat, chacun avec son CODE_PRODUIT). Les candidats sont bloqués par
+# (FAMILLE, SOUS_FAMILLE, AGREGAT) : seules les paires d'un même bloc sont comparées.
+# Par bloc, similarités vectorisées avec numpy : cosinus des trigrammes de caractères et
+# inclusion des mots, par produits de matrices.
+#
+# 1. proposer   -> propositions_consolidation.csv, une ligne par produit à fusionner, colonne decision vide
+# 2. relecture  : decision = « oui » sur les fusions validées
+# 3. appliquer  -> réécrit CODE PRODUIT dans la Table de correspondance en une passe, retire les
+#                  produits fusionnés du référentiel, journal dans consolidations.csv
+
+FICHIER_PROPOSITIONS = "propositions_consolidation.csv"
+FICHIER_JOURNAL = "consolidations.csv"
+CLES_BLOC = ["FAMILLE", "SOUS_FAMILLE", "AGREGAT"]
+SEUIL = 0.85
+
+
+def normaliser_nom(nom):
+    texte = unicodedata.normalize("NFKD", str(nom).lower())
+    texte = "".join(c for c in texte if not unicodedata.combining(c))
+    return re.sub(r"\s+", " ", re.sub(r"[^\w]+", " ", texte)).strip()
+
+
+def _mots(texte):
+    # Singulier approximatif : « filtres » et « filtre » comptent pour le même mot
+    return {m[:-1] if len(m) > 3 and m.endswith(("s", "x")) else m for m in texte.split()}
+
+
+def _matrice(listes):
+    # Matrice dense (éléments × vocabulaire) des comptes, vocabulaire propre au bloc
+    vocabulaire = {}
+    colonnes = [[vocabulaire.setdefault(t, len(vocabulaire)) for t in liste] for liste in listes]
+    lignes = np.repeat(np.arange(len(listes)), [len(c) for c in colonnes])
+    matrice = np.zeros((len(listes), max(len(vocabulaire), 1)), dtype=np.float32)
+    np.add.at(matrice, (lignes, np.concatenate(colonnes).astype(np.int64) if len(lignes) else lignes), 1)
+    return matrice
+
+
+def comparer_bloc(noms, agregat, seuil=SEUIL):
+    # Retourne les paires (i, j, score, motif) d'un bloc
+    trigrammes = _matrice([[f" {n} "[k:k + 3] for k in range(len(n))] for n in noms])
+    trigrammes /= np.maximum(np.linalg.norm(trigrammes, axis=1, keepdims=True), 1e-9)
+    cosinus = trigrammes @ trigrammes.T
+
+    mots = [_mots(n) for n in noms]
+    presence = np.minimum(_matrice([list(m) for m in mots]), 1)
+    communs = presence @ presence.T
+    nb_mots = presence.sum(axis=1)
+    inclusion = communs / np.maximum(np.minimum.outer(nb_mots, nb_mots), 1)
+    # Nom générique : tous ses mots sont dans le nom de l'agrégat (« arriere » dans « Partie arrière »)
+    mots_agregat = _mots(normaliser_nom(agregat))
+    generique = np.array([bool(m) and m <= mots_agregat for m in mots])
+
+    i, j = np.triu_indices(len(noms), 1)
+    score = cosinus[i, j]
+    motif = np.where(score >= 1 - 1e-6, "nom_identique", "similarite")
+    inclus = (inclusion[i, j] >= 1) & (generique[i] != generique[j])
+    motif = np.where((score < seuil) & inclus, "generique", motif)
+    garder = (score >= seuil) | inclus
+    return i[garder], j[garder], score[garder], motif[garder]
+
+
+def proposer(fichier_ref=FICHIER_REFERENTIEL, fichier_corr=FICHIER_CORRESPONDANCE, seuil=SEUIL):
+    ref = pd.read_csv(fichier_ref, encoding="utf-8-sig", dtype=str)
+    corr = pd.read_csv(fichier_corr, encoding="utf-8-sig", dtype=str)
+    ref.columns, corr.columns = ref.columns.str.strip(), corr.columns.str.strip()
+    ref["CODE_PRODUIT"] = ref["CODE_PRODUIT"].str.strip()
+    ref["nom"] = ref["NOM PRODUIT"].fillna("").map(normaliser_nom)
+    ref["nb_articles"] = ref["CODE_PRODUIT"].map(corr["CODE PRODUIT"].str.strip().value_counts()).fillna(0).astype(int)
+
+    paires, nb_comparees = [], 0
+    for (_, _, agregat), bloc in ref.groupby(CLES_BLOC, sort=False):
+        if len(bloc) < 2:
+            continue
+        nb_comparees += len(bloc) * (len(bloc) - 1) // 2
+        i, j, score, motif = comparer_bloc(bloc["nom"].tolist(), agregat, seuil)
+        index = bloc.index.to_numpy()
+        paires.append(pd.DataFrame({"a": index[i], "b": index[j], "score": score.round(3), "motif": motif}))
+    paires = pd.concat(paires, ignore_index=True) if paires else pd.DataFrame(columns=["a", "b", "score", "motif"])
+
+    # Sens de la fusion : un nom générique va vers le nom précis, sinon le produit le moins
+    # référencé va vers le plus référencé (puis le plus petit code)
+    a, b = ref.loc[paires["a"]].reset_index(drop=True), ref.loc[paires["b"]].reset_index(drop=True)
+    precis_b = b["nom"].str.len() > a["nom"].str.len()
+    garde_b = np.where(paires["motif"] == "generique", precis_b,
+                       (b["nb_articles"] > a["nb_articles"]) |
+                       ((b["nb_articles"] == a["nb_articles"]) & (b["CODE_PRODUIT"] < a["CODE_PRODUIT"])))
+    source = a.where(pd.Series(garde_b), b)
+    cible = b.where(pd.Series(garde_b), a)
+    propositions = pd.DataFrame({
+        "CODE_SOURCE": source["CODE_PRODUIT"], "NOM_SOURCE": source["NOM PRODUIT"],
+        "ARTICLES_SOURCE": source["nb_articles"],
+        "CODE_CIBLE": cible["CODE_PRODUIT"], "NOM_CIBLE": cible["NOM PRODUIT"],
+        "ARTICLES_CIBLE": cible["nb_articles"],
+        "FAMILLE": source["FAMILLE"], "SOUS_FAMILLE": source["SOUS_FAMILLE"], "AGREGAT": source["AGREGAT"],
+        "score": paires["score"], "motif": paires["motif"],
+    })
+    # Une proposition par produit source : la cible la plus similaire, ou pour un nom générique
+    # (inclus dans plusieurs noms précis) le produit précis le plus référencé
+    generique = propositions["motif"] == "generique"
+    propositions["_priorite"] = propositions["score"].where(~generique, propositions["ARTICLES_CIBLE"])
+    propositions = (propositions.assign(_generique=generique)
+                    .sort_values(["_generique", "_priorite", "CODE_CIBLE"], ascending=[True, False, True])
+                    .drop_duplicates("CODE_SOURCE").drop(columns=["_generique", "_priorite"])
+                    .sort_values(CLES_BLOC + ["CODE_CIBLE", "CODE_SOURCE"]))
+    propositions["decision"] = ""
+    return propositions.reset_index(drop=True), nb_comparees, len(ref) * (len(ref) - 1) // 2
+
+
+def _resoudre_chaines(remplacements):
+    # A -> B et B -> C : A -> C ; un cycle (A -> B -> A) est coupé sur le plus petit code
+    resolus = {}
+    for source in remplacements:
+        vus, code = [source], remplacements[source]
+        while code in remplacements and code not in vus:
+            vus.append(code)
+            code = remplacements[code]
+        resolus[source] = min(vus) if code in vus else code
+    return {s: c for s, c in resolus.items() if s != c}
+
+
+def _ecrire_atomique(df, fichier):
+    tmp = fichier + ".tmp"
+    df.to_csv(tmp, index=False, encoding="utf-8-sig")
+    os.replace(tmp, fichier)
+
+
+def appliquer(fichier_propositions=FICHIER_PROPOSITIONS, fichier_ref=FICHIER_REFERENTIEL,
+              fichier_corr=FICHIER_CORRESPONDANCE, fichier_journal=FICHIER_JOURNAL):
+    propositions = pd.read_csv(fichier_propositions, encoding="utf-8-sig", dtype=str, keep_default_na=False)
+    validees = propositions[propositions["decision"].str.strip().str.lower().isin(["oui", "o", "x", "1"])]
+    remplacements = _resoudre_chaines(dict(zip(validees["CODE_SOURCE"].str.strip(), validees["CODE_CIBLE"].str.strip())))
+    if not remplacements:
+        print("Aucune fusion validée (colonne decision)")
+        return 0
+
+    corr = pd.read_csv(fichier_corr, encoding="utf-8-sig", dtype=str, keep_default_na=False)
+    ref = pd.read_csv(fichier_ref, encoding="utf-8-sig", dtype=str, keep_default_na=False)
+    col_corr = next(c for c in corr.columns if c.strip() == "CODE PRODUIT")
+    col_ref = next(c for c in ref.columns if c.strip() == "CODE_PRODUIT")
+
+    # Une seule passe sur la table : map vectorisé des codes fusionnés
+    codes = corr[col_corr].str.strip()
+    touchees = codes.isin(remplacements.keys())
+    corr[col_corr] = codes.map(remplacements).fillna(corr[col_corr])
+    corr = corr[~(corr.duplicated() & touchees)]  # lignes devenues identiques après fusion
+    retires = ref[col_ref].str.strip().isin(remplacements.keys())
+
+    _ecrire_atomique(corr, fichier_corr)
+    _ecrire_atomique(ref[~retires], fichier_ref)
+    journal = pd.DataFrame({"CODE_FUSIONNE": list(remplacements), "CODE_CIBLE": list(remplacements.values()),
+                            "date": time.strftime("%Y-%m-%d %H:%M:%S")})
+    journal.to_csv(fichier_journal, mode="a", header=not os.path.exists(fichier_journal),
+                   index=False, encoding="utf-8-sig")
+    print(f"✅ {len(remplacements)} produit(s) fusionné(s) : {int(touchees.sum())} ligne(s) de correspondance "
+          f"réaffectées, {int(retires.sum())} produit(s) retiré(s) du référentiel, journal dans {fichier_journal}")
+    return len(remplacements)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Consolidation des produits quasi-doublons du Referentiel Central")
+    sous = parser.add_subparsers(dest="commande", required=True)
+    p = sous.add_parser("proposer", help="propositions de fusion à relire")
+    p.add_argument("--seuil", type=float, default=SEUIL, help="cosinus des trigrammes minimal")
+    p.add_argument("--valider-identiques", action="store_true",
+                   help="pré-remplit decision = oui pour les noms identiques après normalisation")
+    p.add_argument("--sortie", default=FICHIER_PROPOSITIONS)
+    p = sous.add_parser("appliquer", help="applique les fusions validées (decision = oui)")
+    p.add_argument("--propositions", default=FICHIER_PROPOSITIONS)
+    args = parser.parse_args()
+
+    if args.commande == "proposer":
+        debut = time.perf_counter()
+        propositions, nb_comparees, nb_toutes = proposer(seuil=args.seuil)
+        duree = time.perf_counter() - debut
+        if args.valider_identiques:
+            propositions.loc[propositions["motif"] == "nom_identique", "decision"] = "oui"
+        propositions.to_csv(args.sortie, index=False, encoding="utf-8-sig")
+        print(f"{nb_comparees} paires comparées par bloc (sur {nb_toutes} possibles) en {duree:.2f}s")
+        print(f"{len(propositions)} fusion(s) proposée(s) dans {args.sortie} : "
+              + ", ".join(f"{n} {m}" for m, n in propositions["motif"].value_counts().items()))
+    else:
+        appliquer(args.propositions)
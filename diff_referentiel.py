@@ -0,0 +1,212 @@
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from stockage_arrow import TABLES, DOSSIER_STORE, version_courante, versions_publiees, ouvrir_dataframe
+
+# Écarts entre deux versions du référentiel (Referentiel Central + Table de correspondance).
+# Chaque ligne est réduite à des empreintes (hash_pandas_object) : nom, hiérarchie
+# (FAMILLE, SOUS_FAMILLE, AGREGAT) et code produit. Une jointure externe par table, sur
+# CODE_PRODUIT et sur (CODE ARTICLE, SOURCE), compare les empreintes en une passe vectorisée ;
+# seules les lignes modifiées sont ensuite enrichies avec leurs valeurs avant / après.
+#
+# Une version est : "csv" (fichiers du dernier run), une version publiée du store Arrow,
+# ou un dossier contenant les deux fichiers (CSV ou Parquet, p. ex. un export du store SQLite).
+
+SOURCE_CSV = "csv"
+CLE_PRODUIT = ["CODE_PRODUIT"]
+CLE_ARTICLE = ["CODE ARTICLE", "SOURCE"]
+HIERARCHIE = ["FAMILLE", "SOUS_FAMILLE", "AGREGAT"]
+COLONNES_PRODUIT = CLE_PRODUIT + ["NOM PRODUIT"] + HIERARCHIE
+COLONNES_ARTICLE = ["CODE PRODUIT"] + CLE_ARTICLE
+PART_DEPLACEMENT = 0.5  # part des produits d'un agrégat passés sous un même nœud pour le dire déplacé
+SUFFIXES = (" avant", " après")
+
+
+def _normaliser(df, colonnes):
+    df = df.rename(columns=str.strip)
+    return pd.DataFrame({c: df[c].fillna("").astype(str).str.strip() for c in colonnes})
+
+
+def _lire_fichier(chemin):
+    parquet = os.path.splitext(chemin)[0] + ".parquet"
+    if not os.path.exists(chemin) and os.path.exists(parquet):
+        return pd.read_parquet(parquet)
+    return pd.read_csv(chemin, encoding="utf-8-sig", dtype=str, keep_default_na=False)
+
+
+def charger(source, dossier_store=DOSSIER_STORE):
+    # Retourne (referentiel, correspondances) en colonnes texte normalisées
+    if source == SOURCE_CSV:
+        lire = lambda nom: _lire_fichier(TABLES[nom])
+    elif source in versions_publiees(dossier_store):
+        lire = lambda nom: ouvrir_dataframe(nom, source, dossier_store)
+    elif os.path.isdir(source):
+        lire = lambda nom: _lire_fichier(os.path.join(source, TABLES[nom]))
+    else:
+        raise FileNotFoundError(f"Version introuvable : {source} (ni '{SOURCE_CSV}', ni version publiée, ni dossier)")
+    return _normaliser(lire("referentiel"), COLONNES_PRODUIT), _normaliser(lire("table_corr"), COLONNES_ARTICLE)
+
+
+def cle_source(source):
+    # Identifie le contenu d'une version pour les caches : une version publiée ne change
+    # plus, des fichiers peuvent être régénérés par un nouveau run
+    if source in versions_publiees():
+        return source
+    dossier = "." if source == SOURCE_CSV else source
+    dates = [os.path.getmtime(os.path.join(dossier, TABLES[nom]))
+             for nom in ("referentiel", "table_corr") if os.path.exists(os.path.join(dossier, TABLES[nom]))]
+    return f"{source}@{max(dates, default=0)}"
+
+
+def empreinte(df, colonnes):
+    # UInt64 nullable : les empreintes restent exactes après une jointure externe
+    return pd.array(pd.util.hash_pandas_object(df[colonnes], index=False).to_numpy(), dtype="UInt64")
+
+
+def _joindre(avant, apres, cle):
+    lignes = avant.merge(apres, on=cle, how="outer", suffixes=("_avant", "_apres"), indicator=True)
+    return lignes, lignes["_merge"].to_numpy()
+
+
+def _differe(lignes, colonne):
+    return (lignes[f"{colonne}_avant"] != lignes[f"{colonne}_apres"]).fillna(False).to_numpy(dtype=bool)
+
+
+def _details(changes, cle, avant, apres, colonnes):
+    # Valeurs avant / après des seules lignes modifiées
+    avant = avant[cle + colonnes].drop_duplicates(cle)
+    apres = apres[cle + colonnes].drop_duplicates(cle)
+    details = changes.merge(avant, on=cle, how="left").merge(apres, on=cle, how="left", suffixes=SUFFIXES)
+    return details[["type"] + cle + [c + s for c in colonnes for s in SUFFIXES]].fillna("")
+
+
+def _lignes_produits(ref_avant, ref_apres):
+    indexer = lambda ref: ref[CLE_PRODUIT].assign(nom=empreinte(ref, ["NOM PRODUIT"]),
+                                                  noeud=empreinte(ref, HIERARCHIE)).drop_duplicates(CLE_PRODUIT)
+    lignes, origine = _joindre(indexer(ref_avant), indexer(ref_apres), CLE_PRODUIT)
+    reclasse, renomme = _differe(lignes, "noeud"), _differe(lignes, "nom")
+    lignes["type"] = np.select([origine == "left_only", origine == "right_only", reclasse, renomme],
+                               ["supprimé", "ajouté", "reclassé", "renommé"], default="")
+    return lignes
+
+
+def _lignes_correspondances(ref_avant, corr_avant, ref_apres, corr_apres):
+    # La hiérarchie d'un article est celle de son produit dans la même version
+    def indexer(ref, corr):
+        noeuds = ref[CLE_PRODUIT].assign(noeud=empreinte(ref, HIERARCHIE)).drop_duplicates(CLE_PRODUIT)
+        articles = corr.assign(code=empreinte(corr, ["CODE PRODUIT"])).drop_duplicates(CLE_ARTICLE)
+        articles = articles.merge(noeuds, left_on="CODE PRODUIT", right_on="CODE_PRODUIT", how="left")
+        return articles[CLE_ARTICLE + ["code", "noeud"]]
+
+    lignes, origine = _joindre(indexer(ref_avant, corr_avant), indexer(ref_apres, corr_apres), CLE_ARTICLE)
+    reclasse, reaffecte = _differe(lignes, "noeud"), _differe(lignes, "code")
+    lignes["type"] = np.select([origine == "left_only", origine == "right_only", reclasse, reaffecte],
+                               ["supprimé", "ajouté", "reclassé", "réaffecté"], default="")
+    return lignes
+
+
+def _flux_deplaces(lignes_produits):
+    # Un nœud (FAMILLE, SOUS_FAMILLE, AGREGAT) est déplacé quand la majorité de ses produits
+    # encore présents est passée sous un même autre nœud (agrégat renommé ou rattaché ailleurs)
+    communs = lignes_produits[lignes_produits["_merge"] == "both"]
+    flux = communs.groupby(["noeud_avant", "noeud_apres"]).size().rename("produits_deplaces").reset_index()
+    flux["produits"] = flux.groupby("noeud_avant")["produits_deplaces"].transform("sum")
+    flux = flux[flux["noeud_avant"] != flux["noeud_apres"]]
+    flux = flux.sort_values("produits_deplaces", ascending=False).drop_duplicates("noeud_avant")
+    return flux[flux["produits_deplaces"] / flux["produits"] > PART_DEPLACEMENT]
+
+
+def _marquer_deplaces(lignes, deplaces):
+    # Les reclassements qui suivent le déplacement de leur agrégat ne sont pas à revoir un par un
+    suit = lignes[["noeud_avant", "noeud_apres"]].merge(deplaces[["noeud_avant", "noeud_apres"]],
+                                                       how="left", indicator=True)["_merge"].to_numpy() == "both"
+    lignes.loc[suit & (lignes["type"] == "reclassé").to_numpy(), "type"] = "agrégat déplacé"
+    return lignes[lignes["type"] != ""]
+
+
+def _agregats(deplaces, ref_avant, ref_apres):
+    noeuds = lambda ref: ref[HIERARCHIE].assign(noeud=empreinte(ref, HIERARCHIE)).drop_duplicates("noeud")
+    noeuds_avant, noeuds_apres = noeuds(ref_avant), noeuds(ref_apres)
+    supprimes = noeuds_avant[~noeuds_avant["noeud"].isin(noeuds_apres["noeud"]) & ~noeuds_avant["noeud"].isin(deplaces["noeud_avant"])]
+    ajoutes = noeuds_apres[~noeuds_apres["noeud"].isin(noeuds_avant["noeud"]) & ~noeuds_apres["noeud"].isin(deplaces["noeud_apres"])]
+
+    colonnes_avant, colonnes_apres = [c + SUFFIXES[0] for c in HIERARCHIE], [c + SUFFIXES[1] for c in HIERARCHIE]
+    deplaces = (deplaces.merge(noeuds_avant.rename(columns=dict(zip(HIERARCHIE, colonnes_avant))),
+                               left_on="noeud_avant", right_on="noeud")
+                .drop(columns="noeud")
+                .merge(noeuds_apres.rename(columns=dict(zip(HIERARCHIE, colonnes_apres))),
+                       left_on="noeud_apres", right_on="noeud"))
+    agregats = pd.concat([
+        deplaces.assign(type="déplacé"),
+        supprimes.rename(columns=dict(zip(HIERARCHIE, colonnes_avant))).assign(type="supprimé"),
+        ajoutes.rename(columns=dict(zip(HIERARCHIE, colonnes_apres))).assign(type="ajouté"),
+    ], ignore_index=True)
+    texte = ["type"] + [c for paire in zip(colonnes_avant, colonnes_apres) for c in paire]
+    agregats = agregats.reindex(columns=texte + ["produits", "produits_deplaces"])
+    agregats[texte] = agregats[texte].fillna("")
+    agregats[["produits", "produits_deplaces"]] = agregats[["produits", "produits_deplaces"]].astype("Int64")
+    return agregats
+
+
+def comparer(avant, apres):
+    # avant / apres : (referentiel, correspondances) retournés par charger
+    (ref_avant, corr_avant), (ref_apres, corr_apres) = avant, apres
+    lignes_produits = _lignes_produits(ref_avant, ref_apres)
+    deplaces = _flux_deplaces(lignes_produits)
+    produits = _marquer_deplaces(lignes_produits, deplaces)
+    articles = _marquer_deplaces(_lignes_correspondances(ref_avant, corr_avant, ref_apres, corr_apres), deplaces)
+    avec_produit = lambda ref, corr: corr.merge(ref, left_on="CODE PRODUIT", right_on="CODE_PRODUIT", how="left")
+    return {
+        "produits": _details(produits[["type"] + CLE_PRODUIT], CLE_PRODUIT, ref_avant, ref_apres,
+                             ["NOM PRODUIT"] + HIERARCHIE),
+        "correspondances": _details(articles[["type"] + CLE_ARTICLE], CLE_ARTICLE,
+                                    avec_produit(ref_avant, corr_avant), avec_produit(ref_apres, corr_apres),
+                                    ["CODE PRODUIT", "NOM PRODUIT"] + HIERARCHIE),
+        "agregats": _agregats(deplaces, ref_avant, ref_apres),
+    }
+
+
+def resume(diff):
+    return {table: df["type"].value_counts().to_dict() for table, df in diff.items()}
+
+
+def ecrire(diff, dossier):
+    os.makedirs(dossier, exist_ok=True)
+    for table, df in diff.items():
+        df.to_csv(os.path.join(dossier, f"{table}.csv"), index=False, encoding="utf-8-sig")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    # Par défaut : la version publiée contre les fichiers du dernier run, avant de publier
+    parser = argparse.ArgumentParser(description="Écarts entre deux versions du référentiel")
+    parser.add_argument("avant", nargs="?", help="version publiée, 'csv' ou dossier (défaut : version publiée courante)")
+    parser.add_argument("apres", nargs="?", default=SOURCE_CSV, help="défaut : 'csv', les fichiers du dernier run")
+    parser.add_argument("--sortie", default="diff_referentiel", help="dossier des écarts (produits, correspondances, agregats)")
+    parser.add_argument("--versions", action="store_true", help="liste les versions publiées")
+    args = parser.parse_args()
+
+    if args.versions:
+        for version in versions_publiees():
+            print(version + (" (courante)" if version == version_courante() else ""))
+        raise SystemExit(0)
+    avant = args.avant or version_courante()
+    if avant is None:
+        parser.error("aucune version publiée : préciser la version de référence")
+
+    debut = time.perf_counter()
+    versions = charger(avant), charger(args.apres)
+    duree_lecture = time.perf_counter() - debut
+    debut = time.perf_counter()
+    diff = comparer(*versions)
+    duree = time.perf_counter() - debut
+    ecrire(diff, args.sortie)
+    print(f"{avant} -> {args.apres} : {len(versions[1][0])} produits, {len(versions[1][1])} correspondances, "
+          f"comparés en {duree:.2f}s (lecture {duree_lecture:.2f}s)")
+    for table, comptes in resume(diff).items():
+        print(f"  {table} : " + (", ".join(f"{n} {t}" for t, n in comptes.items()) or "aucun écart"))
+    print(f"Écarts dans {args.sortie}/")
@@ -0,0 +1,204 @@
+import csv
+import os
+import queue
+import threading
+import time
+
+# Écrivain unique pour les sorties de classification (classification.csv, inconnus.csv, log.txt).
+# Les workers déposent leurs lignes dans une file et retournent immédiatement aux appels API ;
+# un seul thread garde les fichiers ouverts, regroupe les lignes et les écrit par paquets.
+#
+#   ecrivain = EcrivainGroupe()
+#   ecrivain.ajouter_sortie("classification", "classification.csv")
+#   ecrivain.ajouter_sortie("log", "log.txt", format="texte")
+#   ecrivain.ecrire("classification", [[...], [...]])
+#   ecrivain.synchroniser()   # avant de relire un fichier : tout est écrit et fsyncé
+#   ecrivain.fermer()
+
+TAILLE_MAX = 500           # lignes en attente avant écriture forcée
+DELAI_MAX = 2.0            # secondes max qu'une ligne reste en mémoire
+INTERVALLE_CHECKPOINT = 30.0  # secondes entre deux fsync
+
+
+class EcrivainGroupe:
+    def __init__(self, taille_max=TAILLE_MAX, delai_max=DELAI_MAX, intervalle_checkpoint=INTERVALLE_CHECKPOINT):
+        self.taille_max = taille_max
+        self.delai_max = delai_max
+        self.intervalle_checkpoint = intervalle_checkpoint
+        self.file = queue.Queue()
+        self.sorties = {}  # nom -> (fichier ouvert, writer csv ou None)
+        self.tampons = {}
+        self.en_attente = 0
+        self.premiere_attente = None
+        self.dernier_checkpoint = time.time()
+        self.erreur = None
+        self.stats = {"lignes": 0, "ecritures": 0, "checkpoints": 0}
+        self.thread = threading.Thread(target=self._boucle, name="ecrivain-sorties", daemon=True)
+        self.thread.start()
+
+    # ────────────── CÔTÉ WORKERS ──────────────
+
+    def ajouter_sortie(self, nom, chemin, format="csv", entete=None):
+        # entete : réécrit le fichier avec cette ligne d'en-tête (sinon ajout à la suite)
+        self._attendre(("sortie", (nom, chemin, format, entete)))
+
+    def ecrire(self, nom, lignes):
+        # lignes : listes de valeurs (csv) ou chaînes (texte). Non bloquant.
+        self._verifier()
+        if lignes:
+            self.file.put(("lignes", (nom, list(lignes))))
+
+    def synchroniser(self):
+        # Bloque jusqu'à ce que tout ce qui a été déposé soit écrit et fsyncé
+        self._attendre(("sync", None))
+
+    def fermer(self):
+        self._attendre(("fin", None))
+        self.thread.join()
+        print(f"Écrivain : {self.stats['lignes']} ligne(s) en {self.stats['ecritures']} écriture(s), "
+              f"{self.stats['checkpoints']} checkpoint(s)")
+
+    def _attendre(self, message):
+        self._verifier()
+        fait = threading.Event()
+        self.file.put(message + (fait,))
+        fait.wait()
+        self._verifier()
+
+    def _verifier(self):
+        if self.erreur is not None:
+            raise RuntimeError("Échec de l'écrivain des sorties") from self.erreur
+
+    # ────────────── THREAD ÉCRIVAIN ──────────────
+
+    def _boucle(self):
+        while True:
+            delai = None
+            if self.premiere_attente is not None:
+                delai = max(0.0, self.premiere_attente + self.delai_max - time.time())
+            try:
+                type_message, contenu, *fait = self.file.get(timeout=delai)
+            except queue.Empty:
+                type_message, contenu, fait = "delai", None, []
+            try:
+                if type_message == "lignes":
+                    self._tamponner(*contenu)
+                elif type_message == "sortie":
+                    self._ouvrir(*contenu)
+                elif type_message in ("sync", "fin"):
+                    self._vider()
+                    self._checkpoint()
+                    if type_message == "fin":
+                        for f, _ in self.sorties.values():
+                            f.close()
+                        self.sorties = {}
+                elif type_message == "delai":
+                    self._vider()
+                if self.en_attente >= self.taille_max:
+                    self._vider()
+                if time.time() - self.dernier_checkpoint >= self.intervalle_checkpoint:
+                    self._vider()
+                    self._checkpoint()
+            except Exception as e:
+                # L'erreur est relancée chez les workers au prochain appel
+                self.erreur = e
+            finally:
+                for evenement in fait:
+                    evenement.set()
+            if type_message == "fin":
+                return
+
+    def _ouvrir(self, nom, chemin, format, entete):
+        if nom in self.sorties:
+            self._vider()
+            self.sorties.pop(nom)[0].close()
+        options = {"newline": ""} if format == "csv" else {}
+        encodage = "utf-8-sig" if format == "csv" else "utf-8"
+        if entete is not None:
+            with open(chemin, "w", encoding=encodage, **options) as f:
+                csv.writer(f).writerow(entete) if format == "csv" else f.write(entete)
+        # Toujours en ajout (O_APPEND) : une réécriture externe du fichier ne laisse pas de trou
+        f = open(chemin, "a", encoding=encodage, **options)
+        writer = csv.writer(f) if format == "csv" else None
+        self.sorties[nom] = (f, writer)
+        self.tampons[nom] = []
+
+    def _tamponner(self, nom, lignes):
+        if nom not in self.sorties:
+            raise KeyError(f"Sortie inconnue : {nom}")
+        self.tampons[nom].extend(lignes)
+        self.en_attente += len(lignes)
+        if self.premiere_attente is None:
+            self.premiere_attente = time.time()
+
+    def _vider(self):
+        # Une écriture groupée par sortie, un flush : les données passent à l'OS
+        for nom, lignes in self.tampons.items():
+            if not lignes:
+                continue
+            f, writer = self.sorties[nom]
+            if writer is not None:
+                writer.writerows(lignes)
+            else:
+                f.write("".join(lignes))
+            f.flush()
+            self.stats["lignes"] += len(lignes)
+            self.stats["ecritures"] += 1
+            self.tampons[nom] = []
+        self.en_attente = 0
+        self.premiere_attente = None
+
+    def _checkpoint(self):
+        # fsync : ce qui est écrit survit à une coupure de la machine
+        for f, _ in self.sorties.values():
+            os.fsync(f.fileno())
+        self.dernier_checkpoint = time.time()
+        self.stats["checkpoints"] += 1
+
+
+if __name__ == "__main__":
+    import argparse
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
+
+    parser = argparse.ArgumentParser(description="Compare l'écriture par batch sous verrou et l'écrivain groupé")
+    parser.add_argument("--batches", type=int, default=2000)
+    parser.add_argument("--lignes", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    lignes = [["DESIGNATION", "[('1', 'gpairo')]", "Mécanique", "Transmission", "Roulements", "Roulement"]] * args.lignes
+    dossier = tempfile.mkdtemp()
+
+    verrou = threading.Lock()
+
+    def par_verrou(i):
+        with verrou:
+            with open(os.path.join(dossier, "verrou.csv"), "a", newline="", encoding="utf-8-sig") as f:
+                csv.writer(f).writerows(lignes)
+        with verrou:
+            with open(os.path.join(dossier, "verrou.log"), "a", encoding="utf-8") as f:
+                f.write("".join(f"{l[0]} ➜ [{l[2]}]\n" for l in lignes))
+
+    debut = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        list(executor.map(par_verrou, range(args.batches)))
+    duree_verrou = time.perf_counter() - debut
+
+    debut = time.perf_counter()
+    ecrivain = EcrivainGroupe()
+    ecrivain.ajouter_sortie("csv", os.path.join(dossier, "groupe.csv"))
+    ecrivain.ajouter_sortie("log", os.path.join(dossier, "groupe.log"), format="texte")
+
+    def par_ecrivain(i):
+        ecrivain.ecrire("csv", lignes)
+        ecrivain.ecrire("log", [f"{l[0]} ➜ [{l[2]}]\n" for l in lignes])
+
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        list(executor.map(par_ecrivain, range(args.batches)))
+    duree_workers = time.perf_counter() - debut
+    ecrivain.fermer()
+    duree_groupe = time.perf_counter() - debut
+
+    print(f"Verrou + open/close par batch : {duree_verrou:.2f}s")
+    print(f"Écrivain groupé : workers libérés en {duree_workers:.2f}s, tout écrit et fsyncé en {duree_groupe:.2f}s")
@@ -0,0 +1,171 @@
+import argparse
+import math
+import re
+
+import pandas as pd
+
+from classification_llm import construire_prompt, MAX_TOKENS, MAX_REPRISES
+from filtrage_designations import separer_non_identifiables
+
+try:
+    import tiktoken
+except ImportError:  # tokenizer optionnel, approximation sinon
+    tiktoken = None
+
+# Estimation à blanc d'un run de classification : aucun appel API. Les prompts réels
+# (construire_prompt) sont tokenisés sur un échantillon de groupes, puis batches, tokens,
+# durée et volume de retraitement sont projetés sur tout le fichier pour chaque
+# combinaison taille de batch / nombre de workers, sous le budget d'appels de la clé.
+
+# Retraitements de Classification.py : retraiter_inconnus(3, 50) puis retraiter_inconnus(3, 30)
+RETRAITEMENTS = [50, 50, 50, 30, 30, 30]
+PAUSE_BATCH = 3.5  # time.sleep de traiter_batch, le worker reste occupé
+
+_RE_MORCEAUX = re.compile(r"[^\W\d_]+|\d{1,3}|\s+|[^\w\s]", re.UNICODE)
+_encodage = None
+
+
+def compter_tokens(texte):
+    # cl100k_base (tiktoken) est proche du tokenizer BPE de Llama 3 ; sans tiktoken,
+    # approximation : ~4 caractères par token pour les mots, un par groupe de 3 chiffres
+    # et par ponctuation, accents comptés en plus.
+    global _encodage
+    if tiktoken is not None:
+        if _encodage is None:
+            _encodage = tiktoken.get_encoding("cl100k_base")
+        return len(_encodage.encode(texte))
+    total = 0
+    for morceau in _RE_MORCEAUX.findall(texte):
+        if morceau.isspace():
+            total += morceau.count("\n")
+        elif morceau[0].isalpha():
+            total += math.ceil(len(morceau) / 4) + sum(1 for c in morceau if ord(c) > 127)
+        else:
+            total += 1
+    return total
+
+
+def _reponse(designation, paires, famille, sous_famille, agregat):
+    return (f"DESIGNATION: {designation}\nPAIRES_ID_BASE: {paires}\nFAMILLE: {famille}\n"
+            f"SOUS_FAMILLE: {sous_famille}\nAGREGAT: {agregat}\nNOM: {designation}\n\n")
+
+
+def mesurer(groupes, echantillon=500, referentiel="Referentiel Central.csv", reponses=None):
+    # Tokens fixes par batch (consignes), tokens d'entrée et de sortie par groupe
+    ech = groupes.sample(min(echantillon, len(groupes)), random_state=0)
+    items = list(zip(ech["DESI_ARTI"].astype(str), ech["PAIRES_ID_BASE"].astype(str)))
+    fixe = compter_tokens(construire_prompt([]))
+    entree = [compter_tokens(construire_prompt([item])) - fixe for item in items]
+
+    # Sortie : réponses réelles si un classification.csv existe, sinon catégories du référentiel
+    if reponses is not None:
+        rep = pd.read_csv(reponses, encoding="utf-8-sig", dtype=str).sample(len(items), replace=True, random_state=0)
+        categories = zip(rep["famille"], rep["sous famille"], rep["agregat"])
+    else:
+        ref = pd.read_csv(referentiel, encoding="utf-8-sig", dtype=str).sample(len(items), replace=True, random_state=0)
+        categories = zip(ref["FAMILLE"], ref["SOUS_FAMILLE"], ref["AGREGAT"])
+    sortie = [compter_tokens(_reponse(d, p, f, sf, ag)) for (d, p), (f, sf, ag) in zip(items, categories)]
+    return {"tokens_fixes_batch": fixe, "tokens_entree_groupe": sum(entree) / len(entree),
+            "tokens_sortie_groupe": sum(sortie) / len(sortie), "echantillon": len(items)}
+
+
+def projeter(nb_groupes, mesures, batch_size, workers, appels_par_minute=60, latence_base=1.0,
+             tokens_sortie_par_s=60.0, taux_inconnus=0.10, max_tokens=MAX_TOKENS, retraitements=RETRAITEMENTS,
+             prix_entree=0.0, prix_sortie=0.0, pause_batch=PAUSE_BATCH, max_reprises=MAX_REPRISES):
+    sortie_groupe = mesures["tokens_sortie_groupe"]
+    capacite = max_tokens / sortie_groupe  # groupes servis par une réponse avant troncature
+
+    def passe(restants, taille):
+        lots = math.ceil(restants / taille)
+        taille = restants / lots
+        # Réponse tronquée par max_tokens : le reste du lot est redemandé dans le même lot
+        # (jusqu'à max_reprises appels de plus, prompt réduit aux groupes manquants) ; ce qui
+        # manque encore ensuite revient « inconnue » et part en retraitement
+        appels, t_in, t_out, a_servir = 0, 0.0, 0.0, taille
+        for _ in range(max_reprises + 1):
+            if a_servir <= 0:
+                break
+            appels += 1
+            t_in += mesures["tokens_fixes_batch"] + a_servir * mesures["tokens_entree_groupe"]
+            t_out += min(a_servir * sortie_groupe, max_tokens)
+            a_servir -= min(a_servir, capacite)
+        servis = 1 - a_servir / taille
+        echecs = restants * (1 - (1 - taux_inconnus) * servis)
+        return lots, lots * appels, echecs, lots * t_in, lots * t_out
+
+    totaux = {"appels": 0, "tokens_entree": 0.0, "tokens_sortie": 0.0, "temps_appels_s": 0.0}
+    restants = nb_groupes
+    appels_principaux, reprises = 0, 0
+    for numero, taille in enumerate([batch_size] + list(retraitements)):
+        if restants < 1:
+            break
+        lots, appels, echecs, t_in, t_out = passe(restants, taille)
+        if numero == 0:
+            appels_principaux = lots
+        reprises += appels - lots
+        totaux["appels"] += appels
+        totaux["tokens_entree"] += t_in
+        totaux["tokens_sortie"] += t_out
+        # Pause de traiter_batch une fois par lot, latence par appel, génération au débit de sortie
+        totaux["temps_appels_s"] += appels * latence_base + t_out / tokens_sortie_par_s + lots * pause_batch
+        restants = echecs
+
+    # Débit : limité soit par les workers (durée d'un appel + pause), soit par le budget de la clé
+    duree_moyenne = totaux["temps_appels_s"] / totaux["appels"]
+    debit = min(workers / duree_moyenne, appels_par_minute / 60 if appels_par_minute else float("inf"))
+    duree = totaux["appels"] / debit
+    return {
+        "batch_size": batch_size, "workers": workers,
+        "appels_principaux": appels_principaux, "appels_reprise": reprises,
+        "appels_retraitement": totaux["appels"] - appels_principaux - reprises,
+        "tokens_entree": int(totaux["tokens_entree"]), "tokens_sortie": int(totaux["tokens_sortie"]),
+        "reponse_tronquee": batch_size > capacite, "inconnus_finaux": int(round(restants)),
+        "duree_h": round(duree / 3600, 2), "limite_par": "budget" if debit < workers / duree_moyenne else "workers",
+        "cout": round(totaux["tokens_entree"] * prix_entree / 1e6 + totaux["tokens_sortie"] * prix_sortie / 1e6, 2),
+    }
+
+
+def estimer(fichier="groupement_resultat.csv", batch_sizes=(10, 14, 20, 30, 50), workers=(2, 4, 8), echantillon=500,
+            reponses=None, **parametres):
+    groupes = pd.read_csv(fichier, encoding="utf-8-sig", dtype=str)
+    groupes, rejetees = separer_non_identifiables(groupes, "DESI_ARTI")
+    mesures = mesurer(groupes, echantillon, reponses=reponses)
+    lignes = [projeter(len(groupes), mesures, b, w, **parametres) for b in batch_sizes for w in workers]
+    # Configurations qui laissent le moins de groupes non classés d'abord (troncature au-delà de
+    # ce que les reprises récupèrent), puis les plus rapides
+    return mesures, len(groupes), pd.DataFrame(lignes).sort_values(["inconnus_finaux", "duree_h", "tokens_entree"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estimation à blanc (batches, tokens, durée) d'un run de classification")
+    parser.add_argument("--fichier", default="groupement_resultat.csv")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[10, 14, 20, 30, 50])
+    parser.add_argument("--workers", type=int, nargs="+", default=[2, 4, 8])
+    parser.add_argument("--echantillon", type=int, default=500)
+    parser.add_argument("--reponses", help="classification.csv d'un run précédent pour mesurer la sortie réelle")
+    parser.add_argument("--appels-par-minute", type=float, default=60, help="budget de la clé API")
+    parser.add_argument("--latence-base", type=float, default=1.0, help="secondes par appel hors génération")
+    parser.add_argument("--tokens-sortie-par-s", type=float, default=60.0)
+    parser.add_argument("--taux-inconnus", type=float, default=0.10, help="part de groupes revenant « inconnue »")
+    parser.add_argument("--prix-entree", type=float, default=0.0, help="prix par million de tokens d'entrée")
+    parser.add_argument("--prix-sortie", type=float, default=0.0, help="prix par million de tokens de sortie")
+    args = parser.parse_args()
+
+    mesures, nb_groupes, projections = estimer(
+        args.fichier, args.batch_sizes, args.workers, args.echantillon, args.reponses,
+        appels_par_minute=args.appels_par_minute, latence_base=args.latence_base,
+        tokens_sortie_par_s=args.tokens_sortie_par_s, taux_inconnus=args.taux_inconnus,
+        prix_entree=args.prix_entree, prix_sortie=args.prix_sortie)
+
+    print(f"Tokenizer : {'tiktoken cl100k_base' if tiktoken else 'approximation (tiktoken absent)'}")
+    print(f"{nb_groupes} groupe(s) à classer, échantillon de {mesures['echantillon']}")
+    print(f"Consignes : {mesures['tokens_fixes_batch']} tokens par batch ; par groupe : "
+          f"{mesures['tokens_entree_groupe']:.1f} en entrée, {mesures['tokens_sortie_groupe']:.1f} en sortie")
+    print(f"max_tokens={MAX_TOKENS} : au plus {int(MAX_TOKENS // mesures['tokens_sortie_groupe'])} groupe(s) par réponse, "
+          f"le reste redemandé dans le même lot (jusqu'à {MAX_REPRISES} reprise(s))")
+    print(projections.to_string(index=False))
+    meilleure = projections.head(1)
+    if not meilleure.empty:
+        m = meilleure.iloc[0]
+        print(f"➡️ Conseillé : batch_size={m['batch_size']}, workers={m['workers']} "
+              f"(~{m['duree_h']} h, {m['tokens_entree'] + m['tokens_sortie']} tokens)")
@@ -0,0 +1,302 @@
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pandas as pd
+
+from canonicalisation import cle_canonique
+from classification_llm import (nettoyer_et_classer_batch, corriger_batch, generer_exemples,
+                                TEMPERATURE, MAX_TOKENS, MAX_TOKENS_CORRECTION)
+from estimation_classification import compter_tokens
+
+# Banc d'évaluation des paramètres de Classification.py (taille de batch, workers,
+# température, max_tokens) sur un jeu de référence étiqueté tiré de Referentiel Central.csv.
+# Les prompts et parseurs sont ceux du pipeline (classification_llm) ; le LLM est soit
+# un stub local, soit un rejeu de réponses enregistrées (un run réel avec --enregistrer).
+
+FICHIER_REFERENCE = "Referentiel Central.csv"
+FICHIER_REPONSES = "reponses_enregistrees.jsonl"
+
+
+def jeu_de_reference(taille=300, fichier=FICHIER_REFERENCE, graine=0):
+    # Échantillon stratifié par famille : toutes les familles sont représentées
+    ref = pd.read_csv(fichier, encoding="utf-8-sig", dtype=str).dropna(
+        subset=["NOM PRODUIT", "FAMILLE", "SOUS_FAMILLE", "AGREGAT"])
+    ref = ref.drop_duplicates("NOM PRODUIT")
+    # Au moins un produit par famille, le reste au prorata
+    premiers = ref.groupby("FAMILLE").sample(1, random_state=graine)
+    reste = ref.drop(premiers.index).sample(max(0, taille - len(premiers)), random_state=graine)
+    jeu = pd.concat([premiers, reste]).sample(frac=1, random_state=graine).head(taille).reset_index(drop=True)
+    jeu["paires"] = [f"[({i}, 'reference')]" for i in range(len(jeu))]
+    return jeu
+
+
+# ────────────── LLM LOCAUX ──────────────
+
+class _Completions:
+    def __init__(self, repondre):
+        self.create = repondre
+
+
+def _morceaux(blocs, tronque, attente=None, coupure=None):
+    # Réponse en flux au format Together (choices[0].delta.content, finish_reason)
+    for i, bloc in enumerate(blocs):
+        if coupure is not None and i == coupure:
+            raise ConnectionError("connexion interrompue (simulée)")
+        if attente:
+            time.sleep(attente(bloc))
+        fin = ("length" if tronque else "stop") if i == len(blocs) - 1 else None
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=bloc), finish_reason=fin)])
+
+
+class LLMSimule:
+    # Stub au format du client Together. Répond à partir du jeu de référence avec un taux
+    # d'erreur qui croît avec la température et la position dans le batch, tronque la
+    # réponse à max_tokens et attend une latence proportionnelle aux tokens générés.
+    # taux_coupure : part des réponses en flux interrompues au milieu.
+    def __init__(self, jeu, erreur_base=0.03, effet_temperature=0.15, effet_position=0.10,
+                 latence_base=0.02, tokens_par_s=20000.0, taux_coupure=0.0):
+        self.reference = {r["NOM PRODUIT"].strip().lower(): r for _, r in jeu.iterrows()}
+        self.par_cle = {}
+        self.familles = sorted(jeu["FAMILLE"].unique())
+        self.sous_familles = sorted(jeu["SOUS_FAMILLE"].unique())
+        self.agregats = sorted(jeu["AGREGAT"].unique())
+        self.erreur_base, self.effet_temperature, self.effet_position = erreur_base, effet_temperature, effet_position
+        self.latence_base, self.tokens_par_s = latence_base, tokens_par_s
+        self.taux_coupure = taux_coupure
+        self.verrou = threading.Lock()
+        self.tokens_entree = self.tokens_sortie = self.appels = 0
+        self.chat = SimpleNamespace(completions=_Completions(self._repondre))
+
+    def _erreur(self, alea, position, total, temperature):
+        p = self.erreur_base + self.effet_temperature * temperature + self.effet_position * position / max(total, 1)
+        return alea.random() < p
+
+    def _repondre(self, model, messages, temperature, max_tokens, stream=False):
+        prompt = messages[0]["content"]
+        alea = random.Random(hashlib.sha1(f"{prompt}{temperature}".encode("utf-8")).digest())
+        if "sous famille actuelle" in prompt:
+            blocs = self._corriger(prompt, alea, temperature)
+        else:
+            blocs = self._classer(prompt, alea, temperature)
+
+        # Troncature à max_tokens, comme l'API
+        sortie, tokens = [], 0
+        for bloc in blocs:
+            n = compter_tokens(bloc)
+            if tokens + n > max_tokens:
+                break
+            sortie.append(bloc)
+            tokens += n
+        tronque = len(sortie) < len(blocs)
+        coupure = alea.randrange(len(sortie)) if sortie and alea.random() < self.taux_coupure else None
+        emis = sortie[:coupure] if coupure is not None else sortie
+        with self.verrou:
+            self.appels += 1
+            self.tokens_entree += compter_tokens(prompt)
+            self.tokens_sortie += sum(compter_tokens(b) for b in emis)
+        time.sleep(self.latence_base)
+        if stream:
+            return _morceaux(sortie, tronque, lambda bloc: compter_tokens(bloc) / self.tokens_par_s, coupure)
+        time.sleep(tokens / self.tokens_par_s)
+        if coupure is not None:
+            raise ConnectionError("connexion interrompue (simulée)")
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="".join(sortie)),
+                                                        finish_reason="length" if tronque else "stop")])
+
+    def _classer(self, prompt, alea, temperature):
+        items = re.findall(r"\nPAIRES_ID_BASE : (.*)\nDESIGNATION : (.*)\n", prompt)
+        blocs = []
+        for position, (paires, designation) in enumerate(items):
+            ref = self.reference.get(designation.strip())
+            if ref is None:
+                famille, sous_famille, agregat = "inconnue", "inconnue", "inconnu"
+            elif self._erreur(alea, position, len(items), temperature):
+                famille = alea.choice(self.familles + ["inconnue"])
+                sous_famille, agregat = alea.choice(self.sous_familles), alea.choice(self.agregats)
+            else:
+                famille, sous_famille, agregat = ref["FAMILLE"], ref["SOUS_FAMILLE"], ref["AGREGAT"]
+            blocs.append(f"DESIGNATION: {designation}\nPAIRES_ID_BASE: {paires}\nFAMILLE: {famille}\n"
+                         f"SOUS_FAMILLE: {sous_famille}\nAGREGAT: {agregat}\nNOM: {designation}\n\n")
+        return blocs
+
+    def _corriger(self, prompt, alea, temperature):
+        items = re.findall(r"\nclé : (.*)\nsous famille actuelle : (.*)", prompt)
+        blocs = []
+        for position, (cle, _) in enumerate(items):
+            sous_famille, agregat = self.par_cle.get(cle.strip(), ("inconnue", "inconnu"))
+            if self._erreur(alea, position, len(items), temperature):
+                sous_famille, agregat = alea.choice(self.sous_familles), alea.choice(self.agregats)
+            blocs.append(f"- clé : {cle}\n- sous famille corrigée : {sous_famille}\n- agregat corrigé : {agregat}\n\n")
+        return blocs
+
+
+class ReponsesEnregistrees:
+    # Rejoue des réponses enregistrées (clé : modèle, prompt, température, max_tokens).
+    # Avec un client réel, les réponses manquantes sont demandées puis ajoutées au fichier.
+    def __init__(self, fichier=FICHIER_REPONSES, client=None):
+        self.fichier = fichier
+        self.client = client
+        self.reponses = {}
+        self.verrou = threading.Lock()
+        self.tokens_entree = self.tokens_sortie = self.appels = 0
+        if os.path.exists(fichier):
+            with open(fichier, "r", encoding="utf-8") as f:
+                for ligne in f:
+                    entree = json.loads(ligne)
+                    self.reponses[entree["cle"]] = (entree["reponse"], entree.get("fin", "stop"))
+        self.chat = SimpleNamespace(completions=_Completions(self._repondre))
+
+    def _repondre(self, model, messages, temperature, max_tokens, stream=False):
+        prompt = messages[0]["content"]
+        cle = hashlib.sha1(json.dumps([model, prompt, temperature, max_tokens]).encode("utf-8")).hexdigest()
+        if cle not in self.reponses:
+            if self.client is None:
+                raise KeyError(f"Réponse non enregistrée pour ce prompt ({cle[:10]})")
+            completion = self.client.chat.completions.create(model=model, messages=messages,
+                                                             temperature=temperature, max_tokens=max_tokens)
+            reponse, fin = completion.choices[0].message.content, completion.choices[0].finish_reason
+            with self.verrou:
+                self.reponses[cle] = (reponse, fin)
+                with open(self.fichier, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"cle": cle, "reponse": reponse, "fin": fin}, ensure_ascii=False) + "\n")
+        reponse, fin = self.reponses[cle]
+        with self.verrou:
+            self.appels += 1
+            self.tokens_entree += compter_tokens(prompt)
+            self.tokens_sortie += compter_tokens(reponse)
+        if stream:
+            return _morceaux([reponse], fin == "length")
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=reponse), finish_reason=fin)])
+
+
+# ────────────── ÉVALUATION ──────────────
+
+def _accord(predit, attendu):
+    # Comparaison après canonicalisation (accents, pluriels, synonymes)
+    return pd.Series([cle_canonique(p) == cle_canonique(a) for p, a in zip(predit, attendu)]).mean().item()
+
+
+def _compteurs(client):
+    return client.appels, client.tokens_entree, client.tokens_sortie
+
+
+def evaluer_classification(jeu, client, batch_size=50, workers=4, temperature=TEMPERATURE, max_tokens=MAX_TOKENS):
+    items = list(zip(jeu["NOM PRODUIT"].str.strip().str.lower(), jeu["paires"]))
+    lots = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+    avant = _compteurs(client)
+    debut = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        resultats = [r for lot in executor.map(
+            lambda args: nettoyer_et_classer_batch(args[1], batch_id=args[0], client=client,
+                                                   temperature=temperature, max_tokens=max_tokens),
+            enumerate(lots)) for r in lot]
+    duree = time.perf_counter() - debut
+    appels, t_in, t_out = (a - b for a, b in zip(_compteurs(client), avant))
+
+    predit = pd.DataFrame(resultats).set_index(pd.Index([str(p) for _, p in items]))
+    attendu = jeu.set_index("paires")
+    inconnus = predit["famille"].isin(["inconnue", "inconnu", ""])
+    return {"etape": "classification", "batch_size": batch_size, "workers": workers, "temperature": temperature,
+            "max_tokens": max_tokens, "items_par_s": round(len(items) / duree, 1), "appels": appels,
+            "tokens_par_item": round((t_in + t_out) / len(items), 1), "taux_inconnus": round(inconnus.mean().item(), 3),
+            "accord_famille": round(_accord(predit["famille"], attendu["FAMILLE"]), 3),
+            "accord_sous_famille": round(_accord(predit["sous_famille"], attendu["SOUS_FAMILLE"]), 3),
+            "accord_agregat": round(_accord(predit["agregat"], attendu["AGREGAT"]), 3)}
+
+
+def evaluer_correction(jeu, client, batch_size=100, workers=1, temperature=TEMPERATURE,
+                       max_tokens=MAX_TOKENS_CORRECTION, graine=0):
+    # Entrée : couples (sous famille, agregat) de référence, dont une partie inversés ou
+    # remplacés par l'agrégat, comme les erreurs que la correction doit rattraper.
+    couples = jeu[["SOUS_FAMILLE", "AGREGAT"]].drop_duplicates().reset_index(drop=True)
+    couples["clé"] = [f"K{i}" for i in range(len(couples))]
+    alea = random.Random(graine)
+    entrees = []
+    for cle, sf, ag in zip(couples["clé"], couples["SOUS_FAMILLE"], couples["AGREGAT"]):
+        tirage = alea.random()
+        description = f"{ag} {sf}" if tirage < 0.2 else (f"{ag} {ag}" if tirage < 0.3 else f"{sf} {ag}")
+        entrees.append((description.lower(), cle))
+    if isinstance(client, LLMSimule):
+        client.par_cle = {c: (sf, ag) for c, sf, ag in zip(couples["clé"], couples["SOUS_FAMILLE"], couples["AGREGAT"])}
+
+    lots = [entrees[i:i + batch_size] for i in range(0, len(entrees), batch_size)]
+    avant = _compteurs(client)
+    debut = time.perf_counter()
+    resultats = []
+    # Comme Classification.py : les exemples injectés viennent des batches précédents
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for i in range(0, len(lots), workers):
+            exemples = generer_exemples(resultats)
+            for lot in executor.map(lambda l: corriger_batch(l, exemples, client=client, temperature=temperature,
+                                                              max_tokens=max_tokens), lots[i:i + workers]):
+                resultats.extend(lot)
+    duree = time.perf_counter() - debut
+    appels, t_in, t_out = (a - b for a, b in zip(_compteurs(client), avant))
+
+    predit = pd.DataFrame(resultats, columns=["clé", "sous_famille_corrigee", "agregat_corrige"]).drop_duplicates("clé")
+    compare = couples.merge(predit, on="clé", how="left").fillna("")
+    return {"etape": "correction", "batch_size": batch_size, "workers": workers, "temperature": temperature,
+            "max_tokens": max_tokens, "items_par_s": round(len(entrees) / duree, 1), "appels": appels,
+            "tokens_par_item": round((t_in + t_out) / len(entrees), 1),
+            "taux_inconnus": round((compare["sous_famille_corrigee"] == "").mean().item(), 3),
+            "accord_sous_famille": round(_accord(compare["sous_famille_corrigee"], compare["SOUS_FAMILLE"]), 3),
+            "accord_agregat": round(_accord(compare["agregat_corrige"], compare["AGREGAT"]), 3)}
+
+
+def balayer(jeu, client, etape="classification", batch_sizes=(30, 50, 100), workers=(1, 4), temperatures=(0.0, 0.3),
+            max_tokens=(1000, 5000)):
+    evaluer = evaluer_classification if etape == "classification" else evaluer_correction
+    lignes = []
+    for b, w, t, m in itertools.product(batch_sizes, workers, temperatures, max_tokens):
+        ligne = evaluer(jeu, client, batch_size=b, workers=w, temperature=t, max_tokens=m)
+        print(ligne)
+        lignes.append(ligne)
+    return pd.DataFrame(lignes)
+
+
+def recommander(resultats, tolerance=0.02):
+    # Configuration la plus rapide dont l'accord reste à moins de `tolerance` du meilleur. Un inconnu
+    # compte déjà comme désaccord : taux_inconnus est rapporté à part, pas retranché une seconde fois.
+    colonnes = [c for c in resultats.columns if c.startswith("accord_")]
+    resultats = resultats.assign(accord=resultats[colonnes].mean(axis=1).round(3))
+    retenues = resultats[resultats["accord"] >= resultats["accord"].max() - tolerance]
+    return retenues.sort_values("items_par_s", ascending=False).iloc[0]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Balayage des paramètres de classification sur un jeu de référence")
+    parser.add_argument("--etape", choices=["classification", "correction"], default="classification")
+    parser.add_argument("--taille", type=int, default=300, help="nombre de produits du jeu de référence")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[30, 50, 100])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--temperatures", type=float, nargs="+", default=[0.0, 0.3])
+    parser.add_argument("--max-tokens", type=int, nargs="+", default=[1000, 5000])
+    parser.add_argument("--llm", choices=["simule", "enregistre"], default="simule",
+                        help="stub local, ou rejeu de reponses_enregistrees.jsonl")
+    parser.add_argument("--enregistrer", action="store_true",
+                        help="avec --llm enregistre : appeler l'API (TOGETHER_API_KEY) pour les prompts manquants")
+    parser.add_argument("--tolerance", type=float, default=0.02)
+    parser.add_argument("--taux-coupure", type=float, default=0.0,
+                        help="LLM simulé : part des réponses en flux coupées au milieu")
+    args = parser.parse_args()
+
+    jeu = jeu_de_reference(args.taille)
+    if args.llm == "simule":
+        client = LLMSimule(jeu, taux_coupure=args.taux_coupure)
+    else:
+        from classification_llm import client_par_defaut
+        client = ReponsesEnregistrees(client=client_par_defaut() if args.enregistrer else None)
+
+    resultats = balayer(jeu, client, args.etape, args.batch_sizes, args.workers, args.temperatures, args.max_tokens)
+    resultats.to_csv(f"balayage_{args.etape}.csv", index=False, encoding="utf-8-sig")
+    print(resultats.to_string(index=False))
+    print(f"➡️ Conseillé : {recommander(resultats, args.tolerance).to_dict()}")
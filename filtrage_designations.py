@@ -0,0 +1,112 @@
+import math
+
+import pandas as pd
+
+from profilage import profiler_etape
+
+# Pré-filtre des désignations non classables (« 0 », numéros, codes articles seuls) :
+# elles partent directement dans « Non identifiable », le libellé déjà exclu par app.py,
+# au lieu d'être envoyées au LLM puis retraitées par les deux passes de retraiter_inconnus.
+
+LIBELLE_NON_IDENTIFIABLE = "Non identifiable"
+
+VALEURS_POUBELLE = {
+    "", "0", "00", "nan", "none", "null", "n/a", "na", "-", "--", "?", "??", ".", "x", "xx", "xxx",
+    "test", "divers", "article", "articles", "inconnu", "inconnue", "a definir", "à définir", "sans",
+    "sans designation", "sans désignation", "neant", "néant", "voir", "idem",
+}
+
+# Termes courts qui sont de vraies pièces (té de plomberie)
+MOTS_COURTS = {"te", "té", "t"}
+
+# Valeur + unité (« 40 ah », « 2000w », « d16/380v », « 100 kva ») : caractéristique d'une pièce
+# (batterie, résistance, transformateur), jamais un code article seul
+UNITES = r"(?:k?va|kw|w|mah|ah|vac|vdc|v|ma|a|khz|hz|bars?|mm|cm|tr/min|rpm)"
+MOTIF_UNITE = rf"\d(?:[.,]\d+)?\s?{UNITES}(?![^\W_])"
+
+# Score < SEUIL_LIMITE : rejeté ; entre les deux : douteux mais laissé au LLM
+SEUIL = 0.5
+SEUIL_LIMITE = 0.25
+
+
+def evaluer(designations):
+    # Score vectorisé : part de lettres, longueur du plus long mot alphabétique,
+    # motifs de code (un seul bloc mêlant chiffres et lettres sans vrai mot), valeurs connues.
+    # Une valeur avec unité suffit à garder la désignation.
+    textes = designations.astype("string").fillna("").str.strip().str.lower()
+    # Lettres espacées (« r e s s o r t ») : recollées avant l'évaluation
+    espacees = textes.str.fullmatch(r"(?:[^\W\d_] ){3,}[^\W\d_]")
+    textes = textes.mask(espacees.fillna(False).astype(bool), textes.str.replace(" ", "", regex=False))
+    longueur = textes.str.len()
+    lettres = textes.str.count(r"[^\W\d_]")
+    plus_long_mot = textes.str.findall(r"[^\W\d_]+").map(lambda mots: max(map(len, mots), default=0))
+    premier_mot = textes.str.extract(r"^([^\W\d_]+)", expand=False).fillna("")
+    mot_court_connu = premier_mot.isin(MOTS_COURTS)
+    unite = textes.str.contains(MOTIF_UNITE).fillna(False).astype(bool)
+
+    poubelle = textes.isin(VALEURS_POUBELLE)
+    sans_lettres = lettres == 0
+    code = (~textes.str.contains(r"\s") & textes.str.contains(r"\d") & (plus_long_mot < 3)) & ~mot_court_connu & ~unite
+    trop_court = (lettres < 2) & ~mot_court_connu & ~unite
+
+    ratio = (lettres / longueur.where(longueur > 0, 1)).astype(float)
+    score = 0.6 * (plus_long_mot.clip(upper=4) / 4) + 0.4 * ratio
+    score = score.where(~mot_court_connu, 1.0).where(~unite, score.clip(lower=SEUIL))
+    score = score.where(~(poubelle | sans_lettres | code | trop_court), 0.0)
+
+    motif = (pd.Series("", index=designations.index).mask(score < SEUIL, "score_limite")
+             .mask(score < SEUIL_LIMITE, "score_faible"))
+    for nom, masque in [("trop_court", trop_court), ("code", code), ("sans_lettres", sans_lettres),
+                        ("valeur_poubelle", poubelle)]:
+        motif = motif.mask(masque.fillna(False).astype(bool), nom)
+
+    return pd.DataFrame({
+        "designation": designations,
+        "lettres": lettres,
+        "plus_long_mot": plus_long_mot,
+        "score": score.round(3),
+        "motif": motif,
+        "non_identifiable": score < SEUIL_LIMITE,
+    }, index=designations.index)
+
+
+@profiler_etape("filtrage")
+def separer_non_identifiables(df, colonne="DESI_ARTI"):
+    evaluation = evaluer(df[colonne])
+    masque = evaluation["non_identifiable"].to_numpy()
+    rejetees = df[masque].assign(motif=evaluation.loc[masque, "motif"].to_numpy())
+    print(f"Filtre : {masque.sum()} désignation(s) non identifiable(s) sur {len(df)}, "
+          f"{rejetees['motif'].value_counts().to_dict()}")
+    return df[~masque].copy(), rejetees
+
+
+def appels_evites(nb_total, nb_rejetees, batch_size=50, retraitements=((3, 50), (3, 30))):
+    # Passe principale : batches en moins. Retraitements : les désignations non classables
+    # reviennent toujours « inconnue », donc repassent à chaque tentative des deux runs
+    # de retraiter_inconnus (3 tentatives par 50, puis 3 par 30).
+    principal = math.ceil(nb_total / batch_size) - math.ceil((nb_total - nb_rejetees) / batch_size)
+    retraitement = sum(tentatives * math.ceil(nb_rejetees / taille) for tentatives, taille in retraitements)
+    return {"passe_principale": principal, "retraitements": retraitement, "total": principal + retraitement}
+
+
+if __name__ == "__main__":
+    import sys
+
+    from prenormalisation import prenormaliser
+
+    fichiers = sys.argv[1:] or ["dataset_gpairo.xlsx", "dataset_webpdrmif.csv"]
+    df = pd.concat([pd.read_excel(f) if f.endswith(".xlsx") else pd.read_csv(f, encoding="utf-8-sig")
+                    for f in fichiers], ignore_index=True)
+
+    # Même regroupement que Classification.py : une ligne (un prompt) par désignation pré-normalisée
+    brutes = df["DESI_ARTI"].astype(str).str.strip().str.lower()
+    normalisees = prenormaliser(df["DESI_ARTI"])["designation_normalisee"].fillna(brutes)
+    groupes = pd.DataFrame({"DESI_ARTI": normalisees.unique()})
+
+    _, rejetees = separer_non_identifiables(groupes)
+    appels = appels_evites(len(groupes), len(rejetees))
+    lignes = int(normalisees.isin(rejetees["DESI_ARTI"]).sum())
+    print(f"{len(groupes)} groupe(s), {len(rejetees)} non identifiable(s) ({lignes} ligne(s) produit)")
+    print(f"Appels API évités : {appels['passe_principale']} en passe principale, "
+          f"jusqu'à {appels['retraitements']} en retraitement, {appels['total']} au total")
+    rejetees.to_csv("non_identifiables.csv", index=False, encoding="utf-8-sig")
@@ -0,0 +1,242 @@
+import ast
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from classification_llm import reussi
+from filtrage_designations import separer_non_identifiables, LIBELLE_NON_IDENTIFIABLE
+from preparation_donnees import nettoyer_desi_arti, grouper_designations
+from prenormalisation import prenormaliser
+from regroupement_proches import regrouper_proches
+
+# Jobs de classification lancés depuis l'application : un extrait (ID, BASE, DESI_ARTI) passe par
+# les mêmes étapes que Classification.py (nettoyage, pré-normalisation, quasi-doublons,
+# regroupement, filtre des non identifiables, LLM par lots) dans des threads hors du script
+# Streamlit. L'avancement est lu par les pages à chaque rafraîchissement ; chaque job écrit
+# dans jobs/<id>/ son entrée, son état (etat.json) et son résultat (resultat.csv).
+#
+# REFERENTIEL_LLM=simule : LLM simulé (latence fixe), pour essayer la page sans clé API.
+
+DOSSIER_JOBS = os.environ.get("REFERENTIEL_JOBS", "jobs")
+JOBS_SIMULTANES = 2
+WORKERS_PAR_JOB = 4
+TAILLE_LOT = 50
+MAX_RETENTATIVES = 1
+COLONNES_REQUISES = ["ID", "BASE", "DESI_ARTI"]
+COLONNES_RESULTAT = ["ID", "BASE", "DESI_ARTI", "FAMILLE", "SOUS_FAMILLE", "AGREGAT", "NOM PRODUIT"]
+
+
+def classer_par_defaut():
+    if os.environ.get("REFERENTIEL_LLM") == "simule":
+        from classification_shards import classer_simule
+        return classer_simule(latence=1.0)
+    from classification_llm import nettoyer_et_classer_batch
+    return nettoyer_et_classer_batch
+
+
+class Job:
+    def __init__(self, id_job, nom, dossier):
+        self.id = id_job
+        self.nom = nom
+        self.dossier = dossier
+        self.statut = "en attente"
+        self.etape = ""
+        self.soumis = time.time()
+        self.debut = self.fin = None
+        self.lignes = self.groupes = self.non_identifiables = 0
+        self.lots_total = self.lots_faits = self.groupes_faits = self.inconnus = 0
+        self.erreur = None
+        self.verrou = threading.Lock()
+
+    def instantane(self):
+        with self.verrou:
+            etat = {k: v for k, v in vars(self).items() if k not in ("verrou", "dossier")}
+        duree = (etat["fin"] or time.time()) - etat["debut"] if etat["debut"] else 0
+        etat["duree_s"] = round(duree, 1)
+        etat["groupes_par_s"] = round(etat["groupes_faits"] / duree, 1) if duree else 0.0
+        return etat
+
+    def mettre_a_jour(self, **champs):
+        with self.verrou:
+            for cle, valeur in champs.items():
+                setattr(self, cle, valeur)
+
+    def sauvegarder(self):
+        with open(os.path.join(self.dossier, "etat.json"), "w", encoding="utf-8") as f:
+            json.dump(self.instantane(), f, ensure_ascii=False, indent=2)
+
+    @property
+    def fichier_resultat(self):
+        return os.path.join(self.dossier, "resultat.csv")
+
+
+class GestionnaireJobs:
+    # Un seul gestionnaire par process (st.cache_resource) : les jobs tournent dans son pool,
+    # partagé par toutes les sessions ; une session ne fait que lire les états.
+    def __init__(self, dossier=DOSSIER_JOBS, jobs_simultanes=JOBS_SIMULTANES, classer=None,
+                 workers=WORKERS_PAR_JOB, taille_lot=TAILLE_LOT):
+        self.dossier = dossier
+        self.classer = classer or classer_par_defaut()
+        self.workers, self.taille_lot = workers, taille_lot
+        self.executor = ThreadPoolExecutor(max_workers=jobs_simultanes, thread_name_prefix="job-classification")
+        self.jobs = {}
+        self.resultats = {}
+        self.verrou = threading.Lock()
+        os.makedirs(dossier, exist_ok=True)
+        self._recharger()
+
+    def _recharger(self):
+        # Jobs des runs précédents ; ceux qui tournaient à l'arrêt du process sont marqués interrompus
+        for id_job in sorted(os.listdir(self.dossier)):
+            chemin = os.path.join(self.dossier, id_job, "etat.json")
+            if not os.path.exists(chemin):
+                continue
+            with open(chemin, "r", encoding="utf-8") as f:
+                etat = json.load(f)
+            job = Job(id_job, etat.get("nom", ""), os.path.join(self.dossier, id_job))
+            job.mettre_a_jour(**{k: v for k, v in etat.items() if k in vars(job) and k not in ("id", "nom")})
+            if job.statut in ("en attente", "en cours"):
+                job.mettre_a_jour(statut="interrompu")
+            self.jobs[id_job] = job
+
+    def soumettre(self, df, nom=""):
+        df = df.rename(columns=lambda c: str(c).strip().upper())
+        manquantes = [c for c in COLONNES_REQUISES if c not in df.columns]
+        if manquantes:
+            raise ValueError(f"Colonne(s) manquante(s) : {', '.join(manquantes)} (attendu : {', '.join(COLONNES_REQUISES)})")
+        id_job = time.strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+        job = Job(id_job, nom, os.path.join(self.dossier, id_job))
+        os.makedirs(job.dossier)
+        df = df[COLONNES_REQUISES]
+        df.to_csv(os.path.join(job.dossier, "entree.csv"), index=False, encoding="utf-8-sig")
+        job.mettre_a_jour(lignes=len(df))
+        job.sauvegarder()
+        with self.verrou:
+            self.jobs[id_job] = job
+        self.executor.submit(self._executer, job, df)
+        return id_job
+
+    def liste(self):
+        with self.verrou:
+            jobs = list(self.jobs.values())
+        return sorted((j.instantane() for j in jobs), key=lambda e: e["soumis"], reverse=True)
+
+    def etat(self, id_job):
+        return self.jobs[id_job].instantane()
+
+    def resultat(self, id_job):
+        # Relu seulement si resultat.csv a changé : la page jobs le réaffiche à chaque rerun
+        job = self.jobs[id_job]
+        if not os.path.exists(job.fichier_resultat):
+            return None
+        cle = (id_job, os.path.getmtime(job.fichier_resultat))
+        with self.verrou:
+            df = self.resultats.get(cle)
+        if df is None:
+            df = pd.read_csv(job.fichier_resultat, encoding="utf-8-sig", dtype=str, keep_default_na=False)
+            with self.verrou:
+                self.resultats = {k: v for k, v in self.resultats.items() if k[0] != id_job}
+                self.resultats[cle] = df
+        return df
+
+    # ────────────── EXÉCUTION ──────────────
+
+    def _executer(self, job, df):
+        job.mettre_a_jour(statut="en cours", debut=time.time(), etape="préparation")
+        job.sauvegarder()
+        try:
+            groupes, rejetees = self._preparer(df)
+            job.mettre_a_jour(groupes=len(groupes), non_identifiables=len(rejetees), etape="classification")
+            resultats = self._classer(job, list(zip(groupes["DESI_ARTI"], groupes["PAIRES_ID_BASE"])))
+            resultats += [{"paires_id_base": p, "famille": LIBELLE_NON_IDENTIFIABLE,
+                           "sous_famille": LIBELLE_NON_IDENTIFIABLE, "agregat": LIBELLE_NON_IDENTIFIABLE, "nom": d}
+                          for d, p in zip(rejetees["DESI_ARTI"], rejetees["PAIRES_ID_BASE"])]
+            job.mettre_a_jour(etape="dégroupage")
+            self._degrouper(df, resultats).to_csv(job.fichier_resultat, index=False, encoding="utf-8-sig")
+            job.mettre_a_jour(statut="terminé", etape="", fin=time.time())
+        except Exception as e:
+            job.mettre_a_jour(statut="échec", erreur=f"{type(e).__name__}: {e}", fin=time.time())
+        job.sauvegarder()
+
+    def _preparer(self, df):
+        # Étapes locales de Classification.py, sans fichiers intermédiaires
+        df = df.copy()
+        df["DESI_ARTI"] = df["DESI_ARTI"].map(nettoyer_desi_arti)
+        df = df[df["DESI_ARTI"].notna() & (df["DESI_ARTI"].astype(str).str.strip() != "")]
+        brutes = df["DESI_ARTI"].astype(str).str.strip().str.lower()
+        df["DESI_ARTI"] = prenormaliser(df["DESI_ARTI"])["designation_normalisee"].fillna(brutes)
+        proches = regrouper_proches(df["DESI_ARTI"])
+        df["DESI_ARTI"] = df["DESI_ARTI"].map(dict(zip(proches["designation"], proches["representant"])))
+        groupes = grouper_designations(df)
+        groupes["PAIRES_ID_BASE"] = groupes["PAIRES_ID_BASE"].astype(str)
+        return separer_non_identifiables(groupes, "DESI_ARTI")
+
+    def _classer(self, job, a_traiter):
+        # Lots en parallèle ; les inconnus repassent une fois (MAX_RETENTATIVES)
+        resultats = {}
+
+        def traiter(args):
+            numero, lot = args
+            lot_resultats = self.classer(lot, batch_id=f"{job.id}-{numero}")
+            ok = [r for r in lot_resultats if reussi(r)]
+            for r in lot_resultats:
+                resultats[str(r["paires_id_base"]).strip()] = r
+            with job.verrou:
+                job.lots_faits += 1
+                job.groupes_faits += len(ok)
+            return [(d, p) for d, p in lot if str(p).strip() not in {str(r["paires_id_base"]).strip() for r in ok}]
+
+        for _ in range(MAX_RETENTATIVES + 1):
+            if not a_traiter:
+                break
+            lots = [a_traiter[i:i + self.taille_lot] for i in range(0, len(a_traiter), self.taille_lot)]
+            with job.verrou:
+                job.lots_total += len(lots)
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                a_traiter = [echec for echecs in executor.map(traiter, enumerate(lots)) for echec in echecs]
+            job.mettre_a_jour(inconnus=len(a_traiter))
+            job.sauvegarder()
+        return list(resultats.values())
+
+    def _degrouper(self, df, resultats):
+        # Une ligne par (ID, BASE) de l'extrait, avec sa désignation d'origine
+        lignes = [(id_val, base_val, r["famille"], r["sous_famille"], r["agregat"], r["nom"])
+                  for r in resultats for id_val, base_val in ast.literal_eval(str(r["paires_id_base"]))]
+        classes = pd.DataFrame(lignes, columns=["ID", "BASE", "FAMILLE", "SOUS_FAMILLE", "AGREGAT", "NOM PRODUIT"])
+        classes = classes.drop_duplicates(["ID", "BASE"])
+        return df.merge(classes, on=["ID", "BASE"], how="left")[COLONNES_RESULTAT]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    # python jobs_classification.py extrait.csv : exécute un job sans l'application, avec l'avancement
+    parser = argparse.ArgumentParser(description="Job de classification d'un extrait (ID, BASE, DESI_ARTI)")
+    parser.add_argument("fichier")
+    parser.add_argument("--simule", action="store_true", help="LLM simulé")
+    args = parser.parse_args()
+    if args.simule:
+        os.environ["REFERENTIEL_LLM"] = "simule"
+
+    extrait = (pd.read_excel(args.fichier) if args.fichier.endswith(".xlsx")
+               else pd.read_csv(args.fichier, encoding="utf-8-sig"))
+    gestionnaire = GestionnaireJobs()
+    id_job = gestionnaire.soumettre(extrait, os.path.basename(args.fichier))
+    while True:
+        etat = gestionnaire.etat(id_job)
+        print(f"[{id_job}] {etat['statut']} {etat['etape']} : lots {etat['lots_faits']}/{etat['lots_total']}, "
+              f"{etat['groupes_faits']}/{etat['groupes']} groupes, {etat['groupes_par_s']}/s, "
+              f"{etat['inconnus']} inconnu(s)")
+        if etat["statut"] in ("terminé", "échec"):
+            break
+        time.sleep(2)
+    if etat["erreur"]:
+        print(etat["erreur"])
+    else:
+        print(f"Résultat : {gestionnaire.jobs[id_job].fichier_resultat}")
+    gestionnaire.executor.shutdown()
@@ -0,0 +1,80 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+# Démarrage à froid et premier rendu de chaque page de app.py, via streamlit.testing (AppTest).
+# Chaque mesure tourne dans un process neuf où seul Streamlit est déjà importé, comme dans le
+# serveur : le premier run de la page paie les imports du script et la lecture des données
+# (rendu à froid), un second run dans le même process mesure le réaffichage (caches chauds).
+# Pas de pandas ni d'autre import lourd en tête de ce module : il fausserait le froid.
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+PAGES = ["accueil", "gpairo", "webpdrmif", "jobs", "diff"]
+MODULES_SUIVIS = ["pandas", "plotly.express", "plotly.graph_objects", "duckdb", "pyarrow", "openpyxl",
+                  "jobs_classification", "diff_referentiel"]
+DELAI_MAX_S = 300
+
+
+def _rss_max_mo():
+    try:
+        with open("/proc/self/status", "r") as f:
+            for ligne in f:
+                if ligne.startswith("VmHWM:"):
+                    return round(int(ligne.split()[1]) / 1024, 1)
+    except OSError:
+        return None
+
+
+def mesurer_page(page, app=APP):
+    # Exécuté dans le process de mesure
+    from streamlit.testing.v1 import AppTest
+
+    def rendre():
+        test = AppTest.from_file(app, default_timeout=DELAI_MAX_S)
+        test.session_state["page"] = page
+        debut = time.perf_counter()
+        test.run()
+        return time.perf_counter() - debut, test
+
+    deja_importes = set(sys.modules)
+    froid, test = rendre()
+    importes = [m for m in MODULES_SUIVIS if m in sys.modules and m not in deja_importes]
+    chaud, _ = rendre()
+    return {"page": page, "froid_s": round(froid, 3), "chaud_s": round(chaud, 3), "pic_rss_mo": _rss_max_mo(),
+            "elements": len(list(test.main)), "modules": importes,
+            "erreurs": [str(e.value) for e in test.exception]}
+
+
+def mesurer_pages(pages=PAGES, repetitions=3):
+    # Médiane de `repetitions` process neufs par page
+    resultats = []
+    for page in pages:
+        mesures = []
+        for _ in range(repetitions):
+            sortie = subprocess.run([sys.executable, os.path.abspath(__file__), "--process", page],
+                                    capture_output=True, text=True, check=True, cwd=os.path.dirname(APP)).stdout
+            mesures.append(json.loads(sortie.strip().splitlines()[-1]))
+        mediane = lambda cle: sorted(m[cle] for m in mesures)[len(mesures) // 2]
+        resultats.append({**mesures[0], "froid_s": mediane("froid_s"), "chaud_s": mediane("chaud_s"),
+                          "pic_rss_mo": mediane("pic_rss_mo"), "repetitions": repetitions})
+    return resultats
+
+
+if __name__ == "__main__":
+    import argparse
+
+    if len(sys.argv) > 2 and sys.argv[1] == "--process":
+        print(json.dumps(mesurer_page(sys.argv[2]), ensure_ascii=False))
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description="Démarrage à froid et premier rendu des pages de l'application")
+    parser.add_argument("--pages", nargs="+", choices=PAGES, default=PAGES)
+    parser.add_argument("--repetitions", type=int, default=3)
+    args = parser.parse_args()
+
+    for r in mesurer_pages(args.pages, args.repetitions):
+        print(f"{r['page']:<10} froid {r['froid_s']:6.2f}s  chaud {r['chaud_s']:6.2f}s  pic {r['pic_rss_mo']} Mo  "
+              f"{r['elements']} éléments  imports : {', '.join(r['modules']) or '-'}"
+              + (f"  ⚠️ {r['erreurs']}" if r["erreurs"] else ""))
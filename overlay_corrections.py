@@ -0,0 +1,243 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import pandas as pd
+
+FICHIER_OVERLAY = "corrections_overlay.jsonl"
+
+# Journal append-only des corrections (clé -> sous famille / agregat corrigés).
+# Chaque appel à ajouter() crée une version ; un rollback est lui-même une entrée du journal.
+# Les corrections ne sont jamais appliquées aux fichiers : elles sont superposées à la lecture.
+#
+# Format d'une ligne :
+#   {"type": "correction", "version": 3, "clé": "K…", "sous famille": "…", "agregat": "…", "source": "llm", "date": …}
+#   {"type": "rollback", "version": 5, "vers": 2, "date": …}
+#   {"type": "compaction", "version": 6, "date": …}
+#   {"type": "import", "version": 6, "source": "…", "empreinte": "sha1…", "date": …}
+#
+# Un import automatique (importer) ne remplace jamais une clé dont le dernier événement est une
+# correction manuelle ou un rollback, et n'est rejoué que si le contenu du fichier a changé.
+
+SOURCES_PROTEGEES = {"manuel", "rollback"}
+
+
+def empreinte_fichier(chemin):
+    h = hashlib.sha1()
+    with open(chemin, "rb") as f:
+        for bloc in iter(lambda: f.read(1 << 20), b""):
+            h.update(bloc)
+    return h.hexdigest()
+
+
+class OverlayCorrections:
+    def __init__(self, chemin=FICHIER_OVERLAY):
+        self.chemin = chemin
+        self.version = 0
+        self.version_min = 0  # versions antérieures absorbées par une compaction
+        self.index = {}  # clé -> (version, sous famille, agregat) actif
+        self._entrees = {}  # version -> liste d'entrées, pour reconstruire l'index après rollback
+        self._annulees = set()
+        self._etats_annulation = [(0, frozenset())]  # (version, versions annulées à cette version)
+        self.dernier_evenement = {}  # clé -> source de la dernière écriture, ou "rollback"
+        self.empreintes = {}  # source d'import -> empreinte du dernier fichier importé
+        self._charger()
+
+    def _charger(self):
+        if not os.path.exists(self.chemin):
+            return
+        with open(self.chemin, "r", encoding="utf-8") as f:
+            for ligne in f:
+                if ligne.strip():
+                    self._rejouer(json.loads(ligne))
+        self._reconstruire_index()
+
+    def _rejouer(self, entree):
+        version = entree["version"]
+        self.version = max(self.version, version)
+        if entree["type"] == "correction":
+            self._entrees.setdefault(version, []).append(entree)
+            self.dernier_evenement[entree["clé"]] = entree.get("origine", entree["source"])
+        elif entree["type"] == "rollback":
+            # Revenir à l'état exact de la version "vers" : ce qui était annulé à ce moment-là
+            # le reste, et tout ce qui a été écrit après est annulé.
+            avant = [annulees for v, annulees in self._etats_annulation if v <= entree["vers"]][-1]
+            annulees = set(avant) | {v for v in self._entrees if v > entree["vers"]}
+            for v in annulees ^ self._annulees:
+                for e in self._entrees[v]:
+                    self.dernier_evenement[e["clé"]] = "rollback"
+            self._annulees = annulees
+            self._etats_annulation.append((version, frozenset(self._annulees)))
+        elif entree["type"] == "import":
+            self.empreintes[entree["source"]] = entree["empreinte"]
+        elif entree["type"] == "compaction":
+            self.version_min = version
+            self._etats_annulation = [(version, frozenset())]
+
+    def _reconstruire_index(self):
+        self.index = {}
+        for version in sorted(v for v in self._entrees if v not in self._annulees):
+            for e in self._entrees[version]:
+                self.index[e["clé"]] = (version, e["sous famille"], e["agregat"])
+
+    def _ecrire(self, entrees):
+        with open(self.chemin, "a", encoding="utf-8") as f:
+            for e in entrees:
+                f.write(json.dumps(e, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    # ────────────── ÉCRITURE ──────────────
+
+    def ajouter(self, corrections, source="manuel"):
+        # corrections : itérable de (clé, sous famille, agregat). Coût proportionnel au nombre
+        # de corrections : une ligne de journal et une entrée d'index par correction.
+        version = self.version + 1
+        date = time.time()
+        entrees = [{"type": "correction", "version": version, "clé": str(cle),
+                    "sous famille": sous_famille, "agregat": agregat, "source": source, "date": date}
+                   for cle, sous_famille, agregat in corrections]
+        if not entrees:
+            return self.version
+        self._ecrire(entrees)
+        self.version = version
+        self._entrees[version] = entrees
+        for e in entrees:
+            self.index[e["clé"]] = (version, e["sous famille"], e["agregat"])
+            self.dernier_evenement[e["clé"]] = source
+        return version
+
+    def importer(self, df, col_sous_famille, col_agregat, col_cle="clé", source="import", empreinte=None):
+        # N'enregistre que les clés dont la correction diffère de l'overlay actif, sans toucher
+        # aux clés corrigées à la main ou rétablies par un rollback. Avec une empreinte, un
+        # fichier déjà importé tel quel n'est pas relu.
+        if empreinte is not None and self.empreintes.get(source) == empreinte:
+            print(f"Overlay : {source} inchangé depuis le dernier import, version {self.version} conservée")
+            return self.version
+        df = df[[col_cle, col_sous_famille, col_agregat]].dropna(subset=[col_cle])
+        df = df.astype({col_cle: str}).drop_duplicates(col_cle, keep="last")
+        df = df[~df[col_cle].map(self.dernier_evenement).isin(SOURCES_PROTEGEES)]
+        actuels = pd.DataFrame(
+            [(c, sf, ag) for c, (_, sf, ag) in self.index.items()],
+            columns=[col_cle, "_sf", "_ag"])
+        compare = df.merge(actuels, on=col_cle, how="left", indicator=True)
+
+        def egal(a, b):
+            return (a == b).fillna(False).astype(bool) | (a.isna() & b.isna())
+
+        inchangees = ((compare["_merge"] == "both") & egal(compare["_sf"], compare[col_sous_famille])
+                      & egal(compare["_ag"], compare[col_agregat]))
+        nouvelles = compare[~inchangees].astype(object)
+        nouvelles = nouvelles.where(nouvelles.notna(), None)
+        version = self.ajouter(zip(nouvelles[col_cle], nouvelles[col_sous_famille], nouvelles[col_agregat]), source)
+        print(f"Overlay : {len(nouvelles)} correction(s) nouvelle(s) ou modifiée(s) -> version {version}")
+        if empreinte is not None:
+            self._ecrire([{"type": "import", "version": version, "source": source, "empreinte": empreinte,
+                           "date": time.time()}])
+            self.empreintes[source] = empreinte
+        return version
+
+    def rollback(self, vers):
+        if vers < self.version_min:
+            raise ValueError(f"Version {vers} antérieure à la dernière compaction ({self.version_min})")
+        version = self.version + 1
+        self._ecrire([{"type": "rollback", "version": version, "vers": vers, "date": time.time()}])
+        self._rejouer({"type": "rollback", "version": version, "vers": vers})
+        self._reconstruire_index()
+        return version
+
+    def compacter(self):
+        # Réécrit le journal avec les seules corrections actives ; l'historique antérieur
+        # (et la possibilité d'y revenir) est abandonné.
+        version = self.version + 1
+        date = time.time()
+        # "origine" garde la protection des clés corrigées à la main ou rétablies par rollback
+        entrees = [{"type": "correction", "version": version, "clé": cle, "sous famille": sf,
+                    "agregat": ag, "source": "compaction", "origine": self.dernier_evenement.get(cle, "compaction"),
+                    "date": date}
+                   for cle, (_, sf, ag) in sorted(self.index.items())]
+        imports = [{"type": "import", "version": version, "source": source, "empreinte": empreinte, "date": date}
+                   for source, empreinte in sorted(self.empreintes.items())]
+        tmp = self.chemin + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            for e in entrees:
+                f.write(json.dumps(e, ensure_ascii=False) + "\n")
+            f.write(json.dumps({"type": "compaction", "version": version, "date": date}) + "\n")
+            for e in imports:
+                f.write(json.dumps(e, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.chemin)
+        self.version = self.version_min = version
+        self._entrees = {version: entrees}
+        self._annulees = set()
+        self._etats_annulation = [(version, frozenset())]
+        self.dernier_evenement = {e["clé"]: e["origine"] for e in entrees}
+        self._reconstruire_index()
+        return version
+
+    # ────────────── LECTURE ──────────────
+
+    def corrections(self):
+        return pd.DataFrame(
+            [(cle, sf, ag, v) for cle, (v, sf, ag) in self.index.items()],
+            columns=["clé", "sous_famille_corrigee_normalisee", "agregat_corrige_normalise", "version"])
+
+    def appliquer(self, df, col_cle="clé", col_sous_famille="sous famille", col_agregat="agregat"):
+        # Superposition à la lecture : deux map vectorisés sur la colonne clé
+        if not self.index:
+            return df
+        cles = df[col_cle].astype(str)
+        df = df.copy()
+        df[col_sous_famille] = cles.map({c: sf for c, (_, sf, _) in self.index.items()}).fillna(df[col_sous_famille])
+        df[col_agregat] = cles.map({c: ag for c, (_, _, ag) in self.index.items()}).fillna(df[col_agregat])
+        return df
+
+    def historique(self):
+        lignes = []
+        for version in sorted(self._entrees):
+            entrees = self._entrees[version]
+            lignes.append({"version": version, "corrections": len(entrees),
+                           "source": entrees[0]["source"], "annulée": version in self._annulees})
+        return pd.DataFrame(lignes)
+
+
+def lire_resultats(fichier="produits_groupes.csv", overlay=None):
+    overlay = overlay or OverlayCorrections()
+    df = pd.read_csv(fichier, encoding="utf-8-sig", dtype={"clé": str})
+    return overlay.appliquer(df)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Overlay versionné des corrections sous famille / agregat")
+    sous = parser.add_subparsers(dest="commande", required=True)
+    p = sous.add_parser("ajouter", help="enregistrer une correction manuelle")
+    p.add_argument("cle")
+    p.add_argument("sous_famille")
+    p.add_argument("agregat")
+    p = sous.add_parser("importer", help="importer un fichier de corrections (seules les différences sont ajoutées)")
+    p.add_argument("fichier")
+    p.add_argument("--col-sous-famille", default="sous_famille_corrigee_normalisee")
+    p.add_argument("--col-agregat", default="agregat_corrige_normalise")
+    p.add_argument("--encodage", default="utf-8-sig")
+    p = sous.add_parser("rollback", help="revenir à une version")
+    p.add_argument("version", type=int)
+    sous.add_parser("compacter", help="réécrire le journal avec les seules corrections actives")
+    sous.add_parser("historique", help="lister les versions")
+    args = parser.parse_args()
+
+    overlay = OverlayCorrections()
+    if args.commande == "ajouter":
+        print(f"Version {overlay.ajouter([(args.cle, args.sous_famille, args.agregat)])}")
+    elif args.commande == "importer":
+        overlay.importer(pd.read_csv(args.fichier, encoding=args.encodage, dtype={"clé": str}),
+                         args.col_sous_famille, args.col_agregat, source=os.path.basename(args.fichier),
+                         empreinte=empreinte_fichier(args.fichier))
+    elif args.commande == "rollback":
+        print(f"Rollback vers {args.version} -> version {overlay.rollback(args.version)}")
+    elif args.commande == "compacter":
+        print(f"Journal compacté -> version {overlay.compacter()}, {len(overlay.index)} correction(s) active(s)")
+    else:
+        print(overlay.historique().to_string(index=False))
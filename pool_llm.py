@@ -0,0 +1,384 @@
+import argparse
+import json
+import os
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+from classification_llm import MODELE
+
+# Pool de clients LLM : plusieurs endpoints (URL compatible OpenAI, clé, modèle), chacun avec
+# sa concurrence, son budget d'appels par minute et son état de santé. Chaque appel part vers
+# l'endpoint sain le moins chargé ; une erreur avant la réponse bascule sur un autre endpoint
+# et met le fautif en pause (backoff exponentiel, Retry-After sur 429).
+# Le pool s'utilise comme le client Together : pool.chat.completions.create(...).
+#
+# endpoints.json (les clés restent dans l'environnement) :
+# [{"nom": "together-1", "url": "https://api.together.xyz/v1", "cle_env": "TOGETHER_API_KEY_1",
+#   "modele": "meta-llama/Llama-3.3-70B-Instruct-Turbo-Free", "concurrence": 4, "appels_par_minute": 60}]
+# Sans fichier : un endpoint Together par clé TOGETHER_API_KEY, TOGETHER_API_KEY_1, _2…
+
+URL_TOGETHER = "https://api.together.xyz/v1"
+FICHIER_ENDPOINTS = os.environ.get("REFERENTIEL_ENDPOINTS", "endpoints.json")
+
+PAUSE_BASE = 2.0
+PAUSE_MAX = 60.0
+
+
+class ErreurEndpoint(Exception):
+    def __init__(self, message, statut=None, attente=None):
+        super().__init__(message)
+        self.statut = statut
+        self.attente = attente
+
+
+# ────────────── CLIENT HTTP (API COMPATIBLE OPENAI) ──────────────
+
+def _morceau(donnees):
+    choix = (donnees.get("choices") or [{}])[0]
+    delta = SimpleNamespace(content=(choix.get("delta") or {}).get("content"))
+    return SimpleNamespace(choices=[SimpleNamespace(delta=delta, finish_reason=choix.get("finish_reason"))])
+
+
+class ClientHTTP:
+    # /chat/completions d'une API compatible OpenAI (Together, vLLM, Ollama…), sans SDK
+    def __init__(self, url, cle="", timeout=120):
+        self.url = url.rstrip("/") + "/chat/completions"
+        self.cle = cle
+        self.timeout = timeout
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._creer))
+
+    def _creer(self, model, messages, temperature=None, max_tokens=None, stream=False):
+        corps = {"model": model, "messages": messages, "stream": stream}
+        if temperature is not None:
+            corps["temperature"] = temperature
+        if max_tokens is not None:
+            corps["max_tokens"] = max_tokens
+        requete = urllib.request.Request(self.url, data=json.dumps(corps).encode("utf-8"), method="POST",
+                                         headers={"Content-Type": "application/json",
+                                                  "Authorization": f"Bearer {self.cle}"})
+        # La connexion est ouverte ici : une panne est vue avant le premier morceau du flux
+        try:
+            reponse = urllib.request.urlopen(requete, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            attente = e.headers.get("Retry-After") if e.headers else None
+            raise ErreurEndpoint(f"HTTP {e.code}", e.code, float(attente) if attente else None) from e
+        except (urllib.error.URLError, OSError) as e:
+            raise ErreurEndpoint(f"connexion impossible : {e}") from e
+        if stream:
+            return self._flux(reponse)
+        with reponse:
+            donnees = json.loads(reponse.read().decode("utf-8"))
+        choix = donnees["choices"][0]
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=choix["message"]["content"]),
+                                                        finish_reason=choix.get("finish_reason"))])
+
+    def _flux(self, reponse):
+        # Server-sent events : « data: {...} » jusqu'à « data: [DONE] »
+        termine = False
+        with reponse:
+            try:
+                for ligne in reponse:
+                    ligne = ligne.decode("utf-8").strip()
+                    if not ligne.startswith("data:"):
+                        continue
+                    contenu = ligne[5:].strip()
+                    if contenu == "[DONE]":
+                        termine = True
+                        break
+                    yield _morceau(json.loads(contenu))
+            except (OSError, ValueError) as e:
+                raise ErreurEndpoint(f"flux interrompu : {e}") from e
+        if not termine:
+            raise ErreurEndpoint("flux interrompu avant [DONE]")
+
+
+# ────────────── POOL ──────────────
+
+class PointAcces:
+    def __init__(self, nom, client, modele=MODELE, concurrence=4, appels_par_minute=None):
+        self.nom = nom
+        self.client = client
+        self.modele = modele
+        self.concurrence = concurrence
+        self.appels_par_minute = appels_par_minute
+        self.en_cours = 0
+        self.departs = deque()  # départs de la dernière minute, pour le budget
+        self.echecs_consecutifs = 0
+        self.pause_jusqu_a = 0.0
+        self.appels = 0
+        self.echecs = 0
+
+    def charge(self):
+        return self.en_cours / self.concurrence
+
+    def delai(self, maintenant):
+        # Secondes avant de pouvoir recevoir un appel (0 : disponible), None : concurrence pleine
+        while self.departs and maintenant - self.departs[0] >= 60:
+            self.departs.popleft()
+        if self.en_cours >= self.concurrence:
+            return None
+        attente = max(0.0, self.pause_jusqu_a - maintenant)
+        if self.appels_par_minute and len(self.departs) >= self.appels_par_minute:
+            attente = max(attente, 60 - (maintenant - self.departs[0]))
+        return attente
+
+
+class PoolLLM:
+    def __init__(self, points, max_essais=None, pause_base=PAUSE_BASE, pause_max=PAUSE_MAX):
+        self.points = list(points)
+        self.max_essais = max_essais or 2 * len(self.points)
+        self.pause_base, self.pause_max = pause_base, pause_max
+        self.condition = threading.Condition()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._creer))
+
+    def _reserver(self, exclus):
+        with self.condition:
+            while True:
+                maintenant = time.monotonic()
+                delais = {p: p.delai(maintenant) for p in self.points if p not in exclus}
+                libres = [p for p, d in delais.items() if d == 0]
+                if libres:
+                    # Le moins chargé d'abord, puis le moins sollicité
+                    point = min(libres, key=lambda p: (p.charge(), p.appels))
+                    point.en_cours += 1
+                    point.appels += 1
+                    point.departs.append(maintenant)
+                    return point
+                attentes = [d for d in delais.values() if d]
+                self.condition.wait(timeout=min(attentes) if attentes else None)
+
+    def _liberer(self, point, erreur=None):
+        with self.condition:
+            point.en_cours -= 1
+            if erreur is None:
+                point.echecs_consecutifs = 0
+            else:
+                point.echecs += 1
+                point.echecs_consecutifs += 1
+                pause = min(self.pause_max, self.pause_base * 2 ** (point.echecs_consecutifs - 1))
+                if isinstance(erreur, ErreurEndpoint) and erreur.attente:
+                    pause = erreur.attente
+                point.pause_jusqu_a = time.monotonic() + pause
+            self.condition.notify_all()
+
+    def _suivre(self, point, flux):
+        # Le créneau de l'endpoint reste pris jusqu'à la fin du flux
+        erreur = None
+        try:
+            for morceau in flux:
+                yield morceau
+        except Exception as e:
+            erreur = e
+            raise
+        finally:
+            self._liberer(point, erreur)
+
+    def _creer(self, model=None, messages=None, temperature=None, max_tokens=None, stream=False):
+        # `model` est ignoré : chaque endpoint a son modèle
+        exclus = set()
+        derniere = None
+        for _ in range(self.max_essais):
+            if len(exclus) == len(self.points):
+                exclus = set()  # tous ont échoué une fois : nouvel essai après leur pause
+            point = self._reserver(exclus)
+            try:
+                reponse = point.client.chat.completions.create(model=point.modele, messages=messages,
+                                                               temperature=temperature, max_tokens=max_tokens,
+                                                               stream=stream)
+            except Exception as e:
+                self._liberer(point, e)
+                exclus.add(point)
+                derniere = e
+                print(f"[Pool] {point.nom} en échec ({e}), bascule")
+                continue
+            if stream:
+                return self._suivre(point, reponse)
+            self._liberer(point)
+            return reponse
+        raise derniere
+
+    def etat(self):
+        maintenant = time.monotonic()
+        with self.condition:
+            return [{"endpoint": p.nom, "modele": p.modele, "appels": p.appels, "echecs": p.echecs,
+                     "en_cours": p.en_cours, "sain": p.pause_jusqu_a <= maintenant} for p in self.points]
+
+
+def charger_pool(fichier=FICHIER_ENDPOINTS):
+    if os.path.exists(fichier):
+        with open(fichier, "r", encoding="utf-8") as f:
+            configuration = json.load(f)
+    else:
+        variables = ["TOGETHER_API_KEY"] + [f"TOGETHER_API_KEY_{i}" for i in range(1, 33)]
+        configuration = [{"nom": v.lower(), "cle_env": v} for v in variables if os.environ.get(v)]
+        if not configuration:
+            configuration = [{"nom": "together", "cle_env": "TOGETHER_API_KEY"}]
+    points = [PointAcces(c.get("nom", f"endpoint-{i}"),
+                         ClientHTTP(c.get("url", URL_TOGETHER), os.environ.get(c.get("cle_env", "TOGETHER_API_KEY"), "")),
+                         c.get("modele", MODELE), c.get("concurrence", 4), c.get("appels_par_minute"))
+              for i, c in enumerate(configuration)]
+    print(f"Pool LLM : {', '.join(p.nom for p in points)}")
+    return PoolLLM(points)
+
+
+# ────────────── SERVEURS DE TEST ──────────────
+
+def _reponse_simulee(prompt):
+    # Blocs au format attendu par les parseurs de classification_llm
+    items = re.findall(r"\nPAIRES_ID_BASE : (.*)\nDESIGNATION : (.*)\n", prompt)
+    if items:
+        blocs = []
+        for paires, designation in items:
+            mots = designation.split() or ["divers"]
+            blocs.append(f"DESIGNATION: {designation}\nPAIRES_ID_BASE: {paires}\nFAMILLE: mécanique\n"
+                         f"SOUS_FAMILLE: {mots[0]}s\nAGREGAT: {mots[-1]}s\nNOM: {designation}\n\n")
+        return blocs
+    cles = re.findall(r"\nclé : (.*)\nsous famille actuelle : (.*)", prompt)
+    return [f"- clé : {c}\n- sous famille corrigée : {d.split()[0] if d.split() else d}\n- agregat corrigé : {d}\n\n"
+            for c, d in cles]
+
+
+class ServeurSimule:
+    # Serveur local compatible OpenAI : latence, erreurs 500, 429 au-delà de `capacite`
+    # requêtes simultanées, coupures de flux, panne complète (arreter)
+    def __init__(self, latence=0.2, par_bloc=0.01, taux_erreur=0.0, taux_coupure=0.0, capacite=None, graine=0):
+        self.latence, self.par_bloc = latence, par_bloc
+        self.taux_erreur, self.taux_coupure, self.capacite = taux_erreur, taux_coupure, capacite
+        self.alea = random.Random(graine)
+        self.en_cours = 0
+        self.verrou = threading.Lock()
+        self.requetes = 0
+        serveur = self
+
+        class Gestionnaire(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                corps = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with serveur.verrou:
+                    serveur.requetes += 1
+                    serveur.en_cours += 1
+                    sature = serveur.capacite is not None and serveur.en_cours > serveur.capacite
+                    erreur = serveur.alea.random() < serveur.taux_erreur
+                    coupure = serveur.alea.random() < serveur.taux_coupure
+                try:
+                    if sature:
+                        self.send_response(429)
+                        self.send_header("Retry-After", "1")
+                        self.end_headers()
+                        return
+                    time.sleep(serveur.latence)
+                    if erreur:
+                        self.send_response(500)
+                        self.end_headers()
+                        return
+                    blocs = _reponse_simulee(corps["messages"][0]["content"])
+                    if not corps.get("stream"):
+                        time.sleep(serveur.par_bloc * len(blocs))
+                        self._json({"choices": [{"message": {"content": "".join(blocs)}, "finish_reason": "stop"}]})
+                        return
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/event-stream")
+                    self.end_headers()
+                    for i, bloc in enumerate(blocs):
+                        if coupure and i == len(blocs) // 2:
+                            return  # connexion fermée sans [DONE]
+                        time.sleep(serveur.par_bloc)
+                        fin = "stop" if i == len(blocs) - 1 else None
+                        self.wfile.write(f"data: {json.dumps({'choices': [{'delta': {'content': bloc}, 'finish_reason': fin}]})}\n\n".encode("utf-8"))
+                        self.wfile.flush()
+                    self.wfile.write(b"data: [DONE]\n\n")
+                finally:
+                    with serveur.verrou:
+                        serveur.en_cours -= 1
+
+            def _json(self, donnees):
+                contenu = json.dumps(donnees).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(contenu)))
+                self.end_headers()
+                self.wfile.write(contenu)
+
+        self.http = ThreadingHTTPServer(("127.0.0.1", 0), Gestionnaire)
+        self.http.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.http.server_address[1]}/v1"
+        threading.Thread(target=self.http.serve_forever, daemon=True).start()
+
+    def arreter(self):
+        self.http.shutdown()
+        self.http.server_close()
+
+
+# ────────────── BANC ──────────────
+
+def _executer(client, lots, workers):
+    from classification_llm import nettoyer_et_classer_batch
+    debut = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        resultats = [r for lot in executor.map(
+            lambda args: nettoyer_et_classer_batch(args[1], batch_id=args[0], client=client), enumerate(lots))
+            for r in lot]
+    duree = time.perf_counter() - debut
+    classes = sum(r["famille"] != "inconnue" for r in resultats)
+    return {"groupes": len(resultats), "classes": classes, "duree_s": round(duree, 2),
+            "groupes_par_s": round(len(resultats) / duree, 1)}
+
+
+def benchmark(nb_lots=60, taille_lot=20, workers=12, panne_apres=1.5):
+    import pandas as pd
+    designations = pd.read_csv("dataset_webpdrmif.csv", encoding="utf-8-sig")["DESI_ARTI"].astype(str)
+    designations = designations[designations.str.len() > 3].drop_duplicates().head(nb_lots * taille_lot)
+    items = [(d, f"[({i}, 'webpdrmif')]") for i, d in enumerate(designations)]
+    lots = [items[i:i + taille_lot] for i in range(0, len(items), taille_lot)]
+
+    def serveurs():
+        # A : rapide ; B : lent et instable (erreurs, coupures de flux) ; C : tombe en panne en cours de run
+        return {"A": ServeurSimule(latence=0.3, capacite=4, graine=1),
+                "B": ServeurSimule(latence=0.6, taux_erreur=0.2, taux_coupure=0.1, capacite=4, graine=2),
+                "C": ServeurSimule(latence=0.3, capacite=4, graine=3)}
+
+    lignes = []
+    s = serveurs()
+    seul = PoolLLM([PointAcces("A", ClientHTTP(s["A"].url), concurrence=4)])
+    lignes.append({"configuration": "1 endpoint (A)", **_executer(seul, lots, workers)})
+    for serveur in s.values():
+        serveur.arreter()
+
+    s = serveurs()
+    pool = PoolLLM([PointAcces(nom, ClientHTTP(serveur.url), concurrence=4) for nom, serveur in s.items()],
+                   pause_base=0.5)
+    threading.Timer(panne_apres, s["C"].arreter).start()
+    lignes.append({"configuration": f"pool A+B+C (C en panne à {panne_apres}s)", **_executer(pool, lots, workers)})
+    s["A"].arreter()
+    s["B"].arreter()
+    return pd.DataFrame(lignes), pd.DataFrame(pool.etat())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pool de clients LLM multi-endpoints")
+    sous = parser.add_subparsers(dest="commande", required=True)
+    p = sous.add_parser("etat", help="endpoints configurés (endpoints.json ou TOGETHER_API_KEY_<i>)")
+    p = sous.add_parser("bench", help="pool contre un endpoint seul, sur des serveurs locaux simulés")
+    p.add_argument("--lots", type=int, default=60)
+    p.add_argument("--taille-lot", type=int, default=20)
+    p.add_argument("--workers", type=int, default=12)
+    p.add_argument("--panne-apres", type=float, default=1.5)
+    args = parser.parse_args()
+
+    if args.commande == "etat":
+        for ligne in charger_pool().etat():
+            print(ligne)
+    else:
+        resultats, etat = benchmark(args.lots, args.taille_lot, args.workers, args.panne_apres)
+        print(resultats.to_string(index=False))
+        print(etat.to_string(index=False))
@@ -0,0 +1,175 @@
+import re
+from functools import lru_cache
+
+import pandas as pd
+
+from profilage import profiler_etape
+
+# Pré-normalisation locale des désignations, avant le LLM : tout le travail déterministe
+# demandé dans le prompt de nettoyer_et_classer_batch (dimensions, valeurs électriques,
+# références, marques, couleurs, tailles, abréviations, mots collés).
+# Les attributs retirés sont conservés dans des colonnes structurées.
+# Les traitements portent sur les désignations distinctes, puis sont appliqués en bloc avec map.
+
+ABREVIATIONS = {
+    "ar": "arrière", "arr": "arrière", "av": "avant",
+    "ext": "extérieur", "int": "intérieur",
+    "sup": "supérieur", "inf": "inférieur",
+    "gche": "gauche", "dte": "droite",
+    "synchro": "synchronisation", "elect": "électrique", "elec": "électrique",
+    "alt": "alternateur", "hydr": "hydraulique", "pneum": "pneumatique", "pnm": "pneumatique",
+    "p": "pour", "ss": "sans", "cpl": "complet", "compl": "complet",
+    "bv": "boîte de vitesses", "roult": "roulement", "rlt": "roulement",
+}
+
+MARQUES = [
+    "atlas", "atlas copco", "parker", "hyundai", "renault", "kerax", "iveco", "mercedes", "man",
+    "volvo", "scania", "daf", "peugeot", "partner", "tepee", "citroen", "toyota", "nissan",
+    "mitsubishi", "isuzu", "caterpillar", "cat", "komatsu", "bosch", "valeo", "skf", "fag", "nsk",
+    "timken", "schneider", "legrand", "siemens", "abb", "hager", "osram", "philips", "facom",
+    "stanley", "makita", "dewalt", "hilti", "festo", "danfoss", "grundfos", "zf", "dci", "sonacome",
+]
+
+COULEURS = ["blanc", "blanche", "noir", "noire", "rouge", "vert", "verte", "bleu", "bleue", "jaune",
+            "gris", "grise", "orange", "marron", "beige", "violet", "rose", "argent", "doré"]
+
+TAILLES = ["petit", "petite", "grand", "grande", "moyen", "moyenne", "mini", "maxi", "gm", "pm"]
+
+COLONNES_ATTRIBUTS = ["dimensions", "valeurs_electriques", "references", "marques", "couleurs", "tailles"]
+
+
+def _alternance(mots):
+    # Un seul motif pour tout le dictionnaire, mots les plus longs d'abord ("atlas copco" avant "atlas")
+    mots = sorted({m.lower() for m in mots}, key=len, reverse=True)
+    return re.compile(r"(?<![\w])(?:" + "|".join(re.escape(m) for m in mots) + r")(?![\w])")
+
+
+RE_MARQUES = _alternance(MARQUES)
+RE_COULEURS = _alternance(COULEURS)
+RE_TAILLES = _alternance(TAILLES)
+RE_ABREVIATIONS = re.compile(r"(?<![\w'])(" + "|".join(sorted(map(re.escape, ABREVIATIONS), key=len, reverse=True))
+                             + r")(?:\.|(?![\w']))")
+
+NOMBRE = r"\d+(?:[.,]\d+)?"
+RE_ELECTRIQUE = re.compile(
+    rf"(?<![\w]){NOMBRE}(?:\s*[-/]\s*{NOMBRE})?\s*(?:kva|kw|va|v|w|amp|a|mah|ah|hz|ma|kv)(?![\w])")
+RE_DIMENSIONS = re.compile(
+    rf"(?:ø|Ø|dia\.?|diam\.?|diametre|diamètre)\s*{NOMBRE}(?:\s*(?:mm|cm|m))?"       # Ø 20, diam 12mm
+    rf"|(?<![\w])m{NOMBRE}(?:\s*[x*]\s*{NOMBRE})*(?![\w])"                     # M8, M8X200
+    rf"|(?<![\w]){NOMBRE}(?:\s*[x*]\s*{NOMBRE})+(?:\s*(?:mm|cm|m))?(?![\w])"  # 10x20x5 mm
+    rf"|(?<![\w]){NOMBRE}\s*/\s*{NOMBRE}\s*(?:\"|''|pouces?|po)?"              # 3/4", 5/10
+    rf"|(?<![\w]){NOMBRE}\s*(?:mm|cm|m|ml|l|kg|g|bars?|pouces?|po|\"|''|°)(?![\w])")
+RE_REFERENCES = re.compile(
+    r"(?:(?<![\w])(?:ref|réf|reference|référence|rf|mod|type|n°)(?:\s*[.:]\s*|\s+|(?=\d))(?=[\w./-]*\d)[\w./-]+)"
+    r"|(?<![\w])(?=[\w./-]*\d)(?=[\w./-]*[a-z])[a-z0-9]+(?:[./-][a-z0-9]+)*(?![\w])"  # codes alphanumériques : 16s151, hd120
+    r"|(?<![\w])\d{3,}(?:[./-]\d+)*(?![\w])")                                          # références numériques : 750027
+RE_PARENTHESES = re.compile(r"\([^)]*\)")
+RE_PONCTUATION = re.compile(r"[^\w'\s]|_")
+RE_ESPACES = re.compile(r"\s+")
+
+# Mots collés : un mot absent du vocabulaire est coupé si ses deux moitiés sont fréquentes
+# ("ahuile" -> "a huile", "baguevilebrequin" -> "bague vilebrequin"). Pas de "de"/"en" :
+# ils coupent les mots en dé-/en- (decoupe, decompression, enduit). Les composés réguliers
+# (electrovalve, microfiltre, interface) et les suffixes (-ment) ne sont pas coupés.
+PREFIXES_COLLES = ["a", "à", "d'"]
+PREFIXES_COMPOSES = ("electro", "micro", "multi", "mini", "photo", "turbo", "anti", "inter", "contre",
+                     "mano", "auto", "semi", "thermo", "hydro", "super", "servo")
+SUFFIXES = ("ment", "ments")
+MIN_FREQUENCE_MOT = 20
+
+
+def reparer_encodage(texte):
+    # "Pompe Ã  eau" -> "Pompe à eau", "BUTÃ‰E" -> "BUTÉE" (UTF-8 relu en cp1252 / latin-1)
+    if "Ã" not in texte and "Â" not in texte and "â€" not in texte:
+        return texte
+    for encodage in ("cp1252", "latin-1"):
+        try:
+            return texte.encode(encodage).decode("utf-8")
+        except UnicodeError:
+            pass
+    # "à" dont l'espace insécable a été perdu
+    return texte.replace("Ã ", "à ").replace("Â", " ")
+
+
+def _joindre(series):
+    return series.map(lambda valeurs: " | ".join(dict.fromkeys(v.strip() for v in valeurs if v.strip())))
+
+
+def _extraire(textes, motif):
+    trouves = textes.str.findall(motif)
+    return _joindre(trouves), textes.str.replace(motif, " ", regex=True)
+
+
+def vocabulaire(textes, min_frequence=MIN_FREQUENCE_MOT):
+    mots = textes.str.split().explode().dropna()
+    frequences = mots.value_counts()
+    return set(frequences[(frequences >= min_frequence) & (frequences.index.str.len() >= 3)].index)
+
+
+def decoller(mot, vocab):
+    if mot in vocab or len(mot) < 6 or not mot.isalpha() or mot.startswith(PREFIXES_COMPOSES):
+        return mot
+    for prefixe in PREFIXES_COLLES:
+        if mot.startswith(prefixe) and mot[len(prefixe):] in vocab:
+            return f"{prefixe} {mot[len(prefixe):]}"
+    for i in range(4, len(mot) - 3):
+        if mot[:i] in vocab and mot[i:] in vocab and mot[i:] not in SUFFIXES:
+            return f"{mot[:i]} {mot[i:]}"
+    return mot
+
+
+@profiler_etape("prenormalisation")
+def prenormaliser(designations, vocab=None):
+    # designations : Series de désignations brutes. Retourne un DataFrame aligné sur l'index
+    # avec designation_normalisee + colonnes d'attributs.
+    uniques = pd.Series(designations.dropna().astype(str).unique())
+    textes = uniques.map(reparer_encodage).str.lower().str.replace("\xa0", " ")
+    textes = textes.str.replace(RE_ESPACES, " ", regex=True).str.strip()
+
+    resultat = pd.DataFrame({"designation": uniques})
+    # Ordre important : valeurs et dimensions avant les références, sinon "220v" passe pour un code
+    resultat["valeurs_electriques"], textes = _extraire(textes, RE_ELECTRIQUE)
+    resultat["dimensions"], textes = _extraire(textes, RE_DIMENSIONS)
+    resultat["references"], textes = _extraire(textes, RE_REFERENCES)
+    textes = textes.str.replace(RE_PARENTHESES, " ", regex=True)
+    resultat["marques"], textes = _extraire(textes, RE_MARQUES)
+    resultat["couleurs"], textes = _extraire(textes, RE_COULEURS)
+    resultat["tailles"], textes = _extraire(textes, RE_TAILLES)
+
+    textes = textes.str.replace(RE_ABREVIATIONS, lambda m: ABREVIATIONS[m.group(1)], regex=True)
+    textes = textes.str.replace(RE_PONCTUATION, " ", regex=True)
+    textes = textes.str.replace(r"(?<![\w])\d+(?![\w])", " ", regex=True)  # nombres isolés restants
+    textes = textes.str.replace(RE_ESPACES, " ", regex=True).str.strip()
+
+    vocab = vocab if vocab is not None else vocabulaire(textes)
+    decouper = lru_cache(maxsize=None)(lambda mot: decoller(mot, vocab))
+    textes = textes.str.replace(r"(?<![\w'])[^\W\d_]{6,}(?![\w])", lambda m: decouper(m.group(0)), regex=True)
+
+    # Une désignation entièrement technique (ex. une référence seule) reste telle quelle
+    brut = uniques.str.lower().str.strip()
+    resultat["designation_normalisee"] = textes.where(textes != "", brut)
+
+    table = resultat.set_index("designation")
+    alignes = table.reindex(designations.astype(str).values)
+    alignes.index = designations.index
+    return alignes[["designation_normalisee"] + COLONNES_ATTRIBUTS]
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    fichiers = sys.argv[1:] or ["dataset_webpdrmif.csv"]
+    df = pd.concat([pd.read_excel(f) if f.endswith(".xlsx") else pd.read_csv(f, encoding="utf-8-sig")
+                    for f in fichiers], ignore_index=True)
+    debut = time.perf_counter()
+    resultat = prenormaliser(df["DESI_ARTI"])
+    duree = time.perf_counter() - debut
+
+    brutes = df["DESI_ARTI"].astype(str).str.strip().str.lower()
+    print(f"{len(df)} désignations en {duree:.2f}s")
+    print(f"Désignations distinctes : {brutes.nunique()} -> {resultat['designation_normalisee'].nunique()}")
+    print(f"Longueur moyenne : {brutes.str.len().mean():.1f} -> {resultat['designation_normalisee'].str.len().mean():.1f} caractères")
+    for colonne in COLONNES_ATTRIBUTS:
+        print(f"  {colonne} : {(resultat[colonne] != '').sum()} désignation(s)")
+    pd.concat([df, resultat], axis=1).to_csv("designations_prenormalisees.csv", index=False, encoding="utf-8-sig")
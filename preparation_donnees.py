@@ -0,0 +1,75 @@
+import ast
+import csv
+import re
+
+import pandas as pd
+
+from profilage import profiler_etape
+
+# Étapes de préparation de Classification.py sans appel API : nettoyage de DESI_ARTI,
+# regroupement par désignation avant le LLM et dégroupage du résultat par (ID, BASE).
+
+
+def nettoyer_desi_arti(valeur):
+    if pd.isna(valeur):
+        return valeur
+    texte = str(valeur)
+    texte = texte.lstrip()  # Supprimer les espaces au début
+    texte = re.sub(r'^[^a-zA-Z0-9]+', '', texte)  # Supprimer les caractères spéciaux en début de chaîne
+    return texte
+
+
+@profiler_etape("nettoyage")
+def nettoyer_csv(input_file, output_file):
+    # Charger le CSV
+    df = pd.read_csv(input_file)
+
+    # Nettoyer uniquement la colonne DESI_ARTI
+    if 'DESI_ARTI' in df.columns:
+        df['DESI_ARTI'] = df['DESI_ARTI'].apply(nettoyer_desi_arti)
+    else:
+        print("Erreur : colonne 'DESI_ARTI' introuvable.")
+
+    # Sauvegarder le CSV nettoyé
+    df.to_csv(output_file, index=False)
+    print(f"Fichier nettoyé sauvegardé sous : {output_file}")
+
+
+@profiler_etape("regroupement")
+def grouper_designations(df):
+    # Une ligne par désignation avec la liste de ses couples (ID, BASE)
+    return df.groupby("DESI_ARTI").apply(
+        lambda group: list(zip(group["ID"], group["BASE"]))
+    ).reset_index(name="PAIRES_ID_BASE")
+
+
+@profiler_etape("degroupage")
+def degrouper_fichier(input_file_grouped, output_file_degrouped):
+    with open(input_file_grouped, "r", encoding="utf-8-sig") as f_in, \
+         open(output_file_degrouped, "w", newline="", encoding="utf-8-sig") as f_out:
+
+        reader = csv.DictReader(f_in)
+        fieldnames = ["ID", "BASE", "DESI_ARTI", "FAMILLE", "SOUS_FAMILLE", "AGREGAT", "NOM PRODUIT"]
+        writer = csv.DictWriter(f_out, fieldnames=fieldnames)
+        writer.writeheader()
+
+        for row in reader:
+            paires_str = row.get("PAIRES_ID_BASE", "[]")
+            try:
+                paires = ast.literal_eval(paires_str)
+            except Exception as e:
+                print(f"Erreur de conversion PAIRES_ID_BASE: {e}, ligne ignorée")
+                continue
+
+            for id_val, base_val in paires:
+                writer.writerow({
+                    "ID": id_val,
+                    "BASE": base_val,
+                    "DESI_ARTI": row.get("DESI_ARTI", ""),
+                    "FAMILLE": row.get("famille", ""),
+                    "SOUS_FAMILLE": row.get("sous famille", ""),
+                    "AGREGAT": row.get("agregat", ""),
+                    "NOM PRODUIT": row.get("nom produit", "")
+                })
+
+    print(f"Fichier dégroupé écrit dans {output_file_degrouped}")
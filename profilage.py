@@ -0,0 +1,275 @@
+import cProfile
+import functools
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import nullcontext
+from datetime import datetime
+
+# Profilage à la demande des étapes du pipeline et des threads workers.
+# Activé par REFERENTIEL_PROFILAGE=1 (hérité par les process shards / mesures) ou par
+# activer() derrière un flag --profiler. Inactif, une étape coûte un test de booléen.
+#
+# Par étape, dans profils/<horodatage>-<pid>/ :
+#   <etape>.txt        temps mur / CPU, top cProfile (étape + threads), allocations tracemalloc
+#   <etape>.prof       stats cProfile (snakeviz, pstats)
+#   <etape>.collapsed  piles échantillonnées de tous les threads, format flamegraph.pl / speedscope
+# cProfile mesure le temps mur : attentes de verrou (acquire, wait) et réseau (recv, read)
+# apparaissent comme telles. Les appels répétés d'une même étape sont cumulés.
+
+ACTIF = os.environ.get("REFERENTIEL_PROFILAGE", "") not in ("", "0")
+DOSSIER_PROFILS = os.environ.get("REFERENTIEL_PROFILS", "profils")
+
+INTERVALLE_ECHANTILLON = 0.005
+PROFONDEUR_TRACEMALLOC = 25
+NB_LIGNES_RAPPORT = 30
+
+_verrou = threading.Lock()
+_local = threading.local()
+_etape_courante = None
+_tracemalloc_utilisateurs = 0  # étapes qui ont besoin de tracemalloc ; arrêté quand on revient à 0
+_cumuls = {}
+_dossier_run = None
+
+
+def activer(dossier=None):
+    # Pour un flag --profiler : active aussi les process enfants lancés ensuite
+    global ACTIF, DOSSIER_PROFILS
+    ACTIF = True
+    os.environ["REFERENTIEL_PROFILAGE"] = "1"
+    if dossier:
+        DOSSIER_PROFILS = dossier
+        os.environ["REFERENTIEL_PROFILS"] = dossier
+
+
+def _dossier():
+    global _dossier_run
+    if _dossier_run is None:
+        _dossier_run = os.path.join(DOSSIER_PROFILS, f"{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}")
+        os.makedirs(_dossier_run, exist_ok=True)
+    return _dossier_run
+
+
+# ────────────── ÉCHANTILLONNAGE DES PILES ──────────────
+
+class Echantillonneur(threading.Thread):
+    # Relève la pile de chaque thread à intervalle fixe : « thread;fichier:fonction;... »
+    def __init__(self, intervalle=INTERVALLE_ECHANTILLON):
+        super().__init__(daemon=True, name="profilage-echantillonneur")
+        self.intervalle = intervalle
+        self.piles = Counter()
+        self.arret = threading.Event()
+
+    def run(self):
+        while not self.arret.wait(self.intervalle):
+            noms = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == self.ident:
+                    continue
+                pile = []
+                while frame is not None:
+                    code = frame.f_code
+                    pile.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                pile.append(noms.get(ident, str(ident)).replace(";", ","))
+                self.piles[";".join(reversed(pile))] += 1
+
+    def arreter(self):
+        self.arret.set()
+        self.join()
+        return self.piles
+
+
+# ────────────── ÉTAPES ──────────────
+
+def _demarrer_tracemalloc():
+    global _tracemalloc_utilisateurs
+    with _verrou:
+        if _tracemalloc_utilisateurs == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(PROFONDEUR_TRACEMALLOC)
+            _tracemalloc_utilisateurs = 1
+        elif _tracemalloc_utilisateurs:
+            _tracemalloc_utilisateurs += 1
+
+
+def _arreter_tracemalloc():
+    # Sans effet si tracemalloc a été lancé hors de ce module
+    global _tracemalloc_utilisateurs
+    with _verrou:
+        if _tracemalloc_utilisateurs:
+            _tracemalloc_utilisateurs -= 1
+            if _tracemalloc_utilisateurs == 0:
+                tracemalloc.stop()
+
+
+class _Etape:
+    # Une seule étape profilée à la fois dans le process : les workers s'y rattachent via
+    # _etape_courante, et depuis 3.12 un second cProfile actif lèverait ValueError. Une étape
+    # qui démarre dans un autre thread pendant ce temps (deux jobs en parallèle) s'exécute
+    # sans profilage.
+    def __init__(self, nom):
+        self.nom = nom
+        self.profils_threads = []
+        self.ignoree = False
+
+    def __enter__(self):
+        global _etape_courante
+        with _verrou:
+            if _etape_courante is not None:
+                self.ignoree = True
+                return self
+            _etape_courante = self
+        _local.profil_actif = True
+        _demarrer_tracemalloc()
+        tracemalloc.reset_peak()
+        self.instantane = tracemalloc.take_snapshot()
+        self.echantillonneur = Echantillonneur()
+        self.echantillonneur.start()
+        self.debut, self.debut_cpu = time.perf_counter(), time.process_time()
+        self.profil = cProfile.Profile()
+        self.profil.enable()
+        return self
+
+    def __exit__(self, *exc):
+        global _etape_courante
+        if self.ignoree:
+            return False
+        self.profil.disable()
+        duree, cpu = time.perf_counter() - self.debut, time.process_time() - self.debut_cpu
+        piles = self.echantillonneur.arreter()
+        pic = tracemalloc.get_traced_memory()[1]
+        allocations = tracemalloc.take_snapshot().compare_to(self.instantane, "lineno")
+        _arreter_tracemalloc()
+        _local.profil_actif = False
+        with _verrou:
+            _etape_courante = None
+        _ecrire_rapport(self.nom, duree, cpu, pic, allocations, piles, [self.profil] + self.profils_threads)
+        return False
+
+    def ajouter_thread(self, profil):
+        with _verrou:
+            self.profils_threads.append(profil)
+
+
+def etape(nom):
+    # with etape("regroupement"): ...  — étapes imbriquées : seule l'extérieure est profilée
+    if not ACTIF or getattr(_local, "profil_actif", False):
+        return nullcontext()
+    return _Etape(nom)
+
+
+def profiler_etape(nom):
+    # Décorateur : chaque appel de la fonction est profilé comme l'étape `nom`
+    def decorateur(fonction):
+        @functools.wraps(fonction)
+        def enveloppe(*args, **kwargs):
+            if not ACTIF:
+                return fonction(*args, **kwargs)
+            with etape(nom):
+                return fonction(*args, **kwargs)
+        return enveloppe
+    return decorateur
+
+
+# Depuis Python 3.12, cProfile repose sur sys.monitoring, global au process : le profil de
+# l'étape voit déjà tous les threads, et un second profil actif lèverait ValueError.
+PROFIL_PAR_THREAD = sys.version_info < (3, 12)
+
+
+def profiler_thread(fonction):
+    # Décorateur des fonctions exécutées dans les workers : avant 3.12, cProfile ne suit que
+    # le thread qui l'active, chaque appel a donc son profil, rattaché à l'étape en cours.
+    @functools.wraps(fonction)
+    def enveloppe(*args, **kwargs):
+        etape_en_cours = _etape_courante
+        if (not ACTIF or not PROFIL_PAR_THREAD or etape_en_cours is None
+                or getattr(_local, "profil_actif", False)):
+            return fonction(*args, **kwargs)
+        profil = cProfile.Profile()
+        try:
+            profil.enable()
+        except ValueError:  # un autre outil de profilage est déjà actif : appel non profilé
+            return fonction(*args, **kwargs)
+        _local.profil_actif = True
+        try:
+            return fonction(*args, **kwargs)
+        finally:
+            profil.disable()
+            _local.profil_actif = False
+            etape_en_cours.ajouter_thread(profil)
+    return enveloppe
+
+
+# ────────────── RAPPORTS ──────────────
+
+def _interne(statistique):
+    fichier = statistique.traceback[0].filename
+    return fichier.endswith(("tracemalloc.py", "profilage.py")) or "<frozen" in fichier
+
+
+def _ecrire_rapport(nom, duree, cpu, pic, allocations, piles, profils):
+    with _verrou:
+        cumul = _cumuls.setdefault(nom, {"appels": 0, "duree": 0.0, "cpu": 0.0, "pic": 0,
+                                         "stats": None, "piles": Counter()})
+        cumul["appels"] += 1
+        cumul["duree"] += duree
+        cumul["cpu"] += cpu
+        cumul["pic"] = max(cumul["pic"], pic)
+        cumul["piles"].update(piles)
+        for profil in profils:
+            if cumul["stats"] is None:
+                cumul["stats"] = pstats.Stats(profil)
+            else:
+                cumul["stats"].add(profil)
+
+        base = os.path.join(_dossier(), nom)
+        cumul["stats"].dump_stats(base + ".prof")
+        with open(base + ".collapsed", "w", encoding="utf-8") as f:
+            for pile, n in cumul["piles"].most_common():
+                f.write(f"{pile} {n}\n")
+
+        texte = io.StringIO()
+        texte.write(f"Étape : {nom} ({cumul['appels']} appel(s), {len(profils) - 1} appel(s) worker au dernier)\n")
+        texte.write(f"Temps mur : {cumul['duree']:.3f}s, CPU process : {cumul['cpu']:.3f}s "
+                    f"({cumul['cpu'] / cumul['duree']:.0%} du temps mur)\n" if cumul["duree"] else "")
+        texte.write(f"Pic mémoire Python (tracemalloc) : {cumul['pic'] / 1024 / 1024:.1f} Mo\n\n")
+        texte.write("── cProfile, temps cumulé (étape + threads workers) ──\n")
+        stats = cumul["stats"]
+        stats.stream = texte
+        stats.sort_stats("cumulative").print_stats(NB_LIGNES_RAPPORT)
+        texte.write("── cProfile, temps propre ──\n")
+        stats.sort_stats("tottime").print_stats(NB_LIGNES_RAPPORT)
+        texte.write("── Allocations nettes du dernier appel (tracemalloc) ──\n")
+        for statistique in [s for s in allocations if not _interne(s)][:NB_LIGNES_RAPPORT]:
+            texte.write(f"{statistique}\n")
+        texte.write("\n── Fonctions en cours les plus échantillonnées (tous threads) ──\n")
+        feuilles = Counter()
+        for pile, n in cumul["piles"].items():
+            feuilles[pile.rsplit(";", 1)[-1]] += n
+        total = sum(feuilles.values()) or 1
+        for feuille, n in feuilles.most_common(NB_LIGNES_RAPPORT):
+            texte.write(f"{n / total:6.1%}  {feuille}\n")
+        with open(base + ".txt", "w", encoding="utf-8") as f:
+            f.write(texte.getvalue())
+    print(f"🔬 Profil {nom} : {base}.txt ({duree:.2f}s)")
+
+
+if __name__ == "__main__":
+    import argparse
+    import runpy
+
+    # python profilage.py script.py [args…] : exécute un script avec le profilage actif
+    parser = argparse.ArgumentParser(description="Exécute un script avec le profilage des étapes actif")
+    parser.add_argument("script")
+    parser.add_argument("arguments", nargs=argparse.REMAINDER)
+    parser.add_argument("--dossier", default=None)
+    args = parser.parse_args()
+
+    activer(args.dossier)
+    sys.argv = [args.script] + args.arguments
+    runpy.run_path(args.script, run_name="__main__")
@@ -0,0 +1,201 @@
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from profilage import profiler_etape
+
+# Regroupement des quasi-doublons avant le LLM : fautes de frappe, ordre des mots, mots collés,
+# référence en fin de libellé. Shingles = trigrammes de caractères de chaque mot (indépendants
+# de l'ordre des mots), signatures MinHash, puis LSH par bandes : seules les désignations qui
+# partagent un seau sont comparées, et chaque paire candidate est vérifiée par son Jaccard exact.
+# Les shingles ignorant l'ordre des mots, une paire doit aussi avoir le même mot de tête (« connecteur
+# pour electrovanne » n'est pas une électrovanne) et les mêmes mots de liaison (« et » / « ou »).
+# Un représentant par groupe part au LLM, son résultat est repris par tous les membres.
+
+SEUIL = 0.8
+NB_PERMUTATIONS = 128
+TAILLE_SHINGLE = 3
+MAX_SEAU = 200  # au-delà, les membres d'un seau ne sont comparés qu'à son premier membre
+RAPPEL_CIBLE = 0.95
+PREMIER = (1 << 31) - 1
+DESIGNATIONS_PAR_BLOC = 4096
+# Mots courts qui changent le sens (porte logique et / ou, avec / sans joint)
+MOTS_LIAISON = {"et", "ou", "non", "sans", "avec"}
+
+
+def shingles(texte, k=TAILLE_SHINGLE):
+    grammes = set()
+    for mot in texte.split():
+        if len(mot) <= k:
+            grammes.add(mot)
+        else:
+            grammes.update(mot[i:i + k] for i in range(len(mot) - k + 1))
+    return grammes
+
+
+def bandes_lignes(seuil, nb_permutations=NB_PERMUTATIONS, rappel=RAPPEL_CIBLE):
+    # Le plus de lignes par bande (donc le moins de candidates) tel qu'une paire de Jaccard
+    # `seuil` partage encore un seau avec une probabilité 1 - (1 - s^r)^b >= `rappel`
+    for lignes in range(nb_permutations, 0, -1):
+        bandes = nb_permutations // lignes
+        if 1 - (1 - seuil ** lignes) ** bandes >= rappel:
+            return bandes, lignes
+    return nb_permutations, 1
+
+
+def signatures(ensembles, nb_permutations=NB_PERMUTATIONS, graine=0):
+    # MinHash vectorisé : h(x) = (a·x + b) mod p, minimum par désignation avec reduceat,
+    # par tranches de désignations pour borner la mémoire
+    alea = np.random.default_rng(graine)
+    a = alea.integers(1, PREMIER, nb_permutations, dtype=np.uint64)[:, None]
+    b = alea.integers(0, PREMIER, nb_permutations, dtype=np.uint64)[:, None]
+    resultat = np.empty((len(ensembles), nb_permutations), dtype=np.uint64)
+    for debut in range(0, len(ensembles), DESIGNATIONS_PAR_BLOC):
+        tranche = [e or {""} for e in ensembles[debut:debut + DESIGNATIONS_PAR_BLOC]]
+        tailles = np.fromiter(map(len, tranche), dtype=np.int64, count=len(tranche))
+        valeurs = np.fromiter((zlib.crc32(g.encode("utf-8")) % PREMIER for e in tranche for g in e),
+                              dtype=np.uint64, count=int(tailles.sum()))
+        debuts = np.concatenate(([0], np.cumsum(tailles)[:-1]))
+        resultat[debut:debut + len(tranche)] = np.minimum.reduceat((a * valeurs + b) % PREMIER, debuts, axis=1).T
+    return resultat
+
+
+def paires_candidates(sig, bandes, lignes):
+    # Clé de seau : combinaison linéaire des lignes de la bande (uint64, dépassement modulo 2^64),
+    # puis tri des clés ; seuls les seaux d'au moins deux membres produisent des paires.
+    # Retourne un tableau (n, 2) de paires distinctes i < j.
+    multiplicateurs = np.random.default_rng(1).integers(1, 1 << 63, lignes, dtype=np.uint64)
+    n = len(sig)
+    morceaux = []  # paire (i, j) codée i * n + j
+    for bande in range(bandes):
+        cles = (sig[:, bande * lignes:(bande + 1) * lignes] * multiplicateurs).sum(axis=1)
+        ordre = np.argsort(cles, kind="stable")
+        triees = cles[ordre]
+        debuts = np.concatenate(([0], np.flatnonzero(triees[1:] != triees[:-1]) + 1))
+        tailles = np.diff(np.concatenate((debuts, [n])))
+        # Seaux de même taille traités ensemble : une matrice (seaux, taille) de membres
+        for taille in np.unique(tailles[tailles > 1]):
+            membres = np.sort(ordre[debuts[tailles == taille][:, None] + np.arange(taille)], axis=1)
+            if taille > MAX_SEAU:
+                morceaux.append((membres[:, :1] * n + membres[:, 1:]).ravel())
+            else:
+                i, j = np.triu_indices(taille, 1)
+                morceaux.append((membres[:, i] * n + membres[:, j]).ravel())
+    codes = np.unique(np.concatenate(morceaux)) if morceaux else np.empty(0, dtype=np.int64)
+    return np.column_stack((codes // n, codes % n))
+
+
+def jaccard(x, y):
+    return len(x & y) / len(x | y) if x or y else 1.0
+
+
+def structure(texte):
+    # (mot de tête, mots de liaison) : comparés en plus du Jaccard
+    mots = texte.split()
+    return (mots[0] if mots else "", frozenset(MOTS_LIAISON.intersection(mots)))
+
+
+def meme_structure(x, y, seuil=SEUIL):
+    # Tête identique, collée au mot suivant (« filtreair ») ou à une faute de frappe près
+    (tete_x, liaison_x), (tete_y, liaison_y) = x, y
+    if liaison_x != liaison_y:
+        return False
+    return (tete_x == tete_y or tete_x.startswith(tete_y) or tete_y.startswith(tete_x)
+            or jaccard(shingles(tete_x), shingles(tete_y)) >= seuil)
+
+
+@profiler_etape("regroupement_proches")
+def regrouper_proches(designations, seuil=SEUIL, nb_permutations=NB_PERMUTATIONS):
+    # designations : Series (une ligne par produit). Retourne un DataFrame par désignation distincte :
+    # designation, representant, nb_lignes, taille_groupe.
+    # Groupes par centres, pas par composantes connexes : « filtre a air » ~ « filtre air » ~ « filtre
+    # gasoil » ne doit pas réunir air et gasoil. Les désignations sont prises de la plus fréquente à la
+    # moins fréquente ; une désignation libre devient représentant et prend ses voisines encore libres.
+    comptes = designations.dropna().astype(str).value_counts()
+    uniques = comptes.index.tolist()
+    ensembles = [shingles(d) for d in uniques]
+    structures = [structure(d) for d in uniques]
+    bandes, lignes = bandes_lignes(seuil, nb_permutations)
+    sig = signatures(ensembles, bandes * lignes)
+
+    candidates = paires_candidates(sig, bandes, lignes)
+    voisins = {}
+    for i, j in candidates.tolist():
+        if jaccard(ensembles[i], ensembles[j]) >= seuil and meme_structure(structures[i], structures[j], seuil):
+            voisins.setdefault(i, []).append(j)
+            voisins.setdefault(j, []).append(i)
+
+    # value_counts trie déjà par fréquence décroissante
+    centre = [-1] * len(uniques)
+    for i in range(len(uniques)):
+        if centre[i] != -1:
+            continue
+        centre[i] = i
+        for j in voisins.get(i, []):
+            if centre[j] == -1:
+                centre[j] = i
+
+    resultat = pd.DataFrame({"designation": uniques, "nb_lignes": comptes.values,
+                             "representant": [uniques[c] for c in centre]})
+    resultat["taille_groupe"] = resultat.groupby("representant")["designation"].transform("size")
+    print(f"Quasi-doublons (seuil {seuil}, {bandes} bandes × {lignes} lignes) : {len(uniques)} désignations, "
+          f"{len(candidates)} paires candidates, {sum(map(len, voisins.values())) // 2} retenues "
+          f"-> {resultat['representant'].nunique()} groupes")
+    return resultat
+
+
+def paires_exactes(ensembles, seuil):
+    # Référence quadratique, pour mesurer le rappel du LSH sur un échantillon
+    return {(i, j) for i in range(len(ensembles)) for j in range(i + 1, len(ensembles))
+            if jaccard(ensembles[i], ensembles[j]) >= seuil}
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    from prenormalisation import prenormaliser
+
+    parser = argparse.ArgumentParser(description="Regroupement des quasi-doublons de désignations (MinHash / LSH)")
+    parser.add_argument("fichiers", nargs="*", default=["dataset_gpairo.xlsx", "dataset_webpdrmif.csv"])
+    parser.add_argument("--seuil", type=float, default=SEUIL)
+    parser.add_argument("--brutes", action="store_true", help="sans pré-normalisation")
+    parser.add_argument("--rappel", type=int, default=0, metavar="N",
+                        help="compare le LSH au calcul exact sur N désignations")
+    parser.add_argument("--sortie", default="groupes_proches.csv")
+    args = parser.parse_args()
+
+    df = pd.concat([pd.read_excel(f) if f.endswith(".xlsx") else pd.read_csv(f, encoding="utf-8-sig")
+                    for f in args.fichiers], ignore_index=True)
+    designations = df["DESI_ARTI"].astype(str).str.strip().str.lower()
+    if not args.brutes:
+        designations = prenormaliser(df["DESI_ARTI"])["designation_normalisee"].fillna(designations)
+
+    debut = time.perf_counter()
+    groupes = regrouper_proches(designations, args.seuil)
+    duree = time.perf_counter() - debut
+    print(f"{len(groupes)} désignations distinctes -> {groupes['representant'].nunique()} représentants "
+          f"({1 - groupes['representant'].nunique() / len(groupes):.1%} d'appels LLM en moins) en {duree:.2f}s")
+    multiples = groupes[groupes["taille_groupe"] > 1].sort_values(["representant", "nb_lignes"], ascending=[True, False])
+    multiples.to_csv(args.sortie, index=False, encoding="utf-8-sig")
+    print(f"Groupes de plusieurs désignations : {args.sortie}")
+    exemples = multiples[multiples["representant"].isin(multiples["representant"].drop_duplicates().sample(
+        min(15, multiples["representant"].nunique()), random_state=0))]
+    for representant, membres in exemples.groupby("representant")["designation"]:
+        print(f"  {representant} <- {', '.join(m for m in membres.head(4) if m != representant)}")
+
+    if args.rappel:
+        echantillon = pd.Series(groupes["designation"].sample(min(args.rappel, len(groupes)), random_state=0).values)
+        ensembles = [shingles(d) for d in echantillon]
+        bandes, lignes = bandes_lignes(args.seuil)
+        debut = time.perf_counter()
+        exactes = paires_exactes(ensembles, args.seuil)
+        duree_exacte = time.perf_counter() - debut
+        debut = time.perf_counter()
+        candidates = paires_candidates(signatures(ensembles, bandes * lignes), bandes, lignes)
+        trouvees = {(i, j) for i, j in candidates.tolist() if jaccard(ensembles[i], ensembles[j]) >= args.seuil}
+        duree_lsh = time.perf_counter() - debut
+        print(f"Rappel sur {len(echantillon)} désignations : {len(trouvees)}/{len(exactes)} paires "
+              f"({len(trouvees) / max(len(exactes), 1):.1%}), exact {duree_exacte:.2f}s, LSH {duree_lsh:.2f}s "
+              f"({len(candidates)} candidates)")
@@ -0,0 +1,257 @@
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+# duckdb (backend optionnel) est importé à la création du premier MoteurDuckDB : app.py
+# importe ce module sur toutes ses pages, la plupart servies par MoteurPandas.
+
+DOSSIER_PARQUET = os.environ.get("REFERENTIEL_PARQUET", "parquet")
+
+TABLES = {
+    "referentiel": "Referentiel Central.csv",
+    "table_corr": "Table de correspondance.csv",
+    "gpairo": "Ref_Pieces de rechange_Gpairo.csv",
+    "webpdrmif": "Ref_Installations fixes_Mif.csv",
+}
+
+
+def exporter_parquet(tables=TABLES, dossier=DOSSIER_PARQUET):
+    os.makedirs(dossier, exist_ok=True)
+    for nom, fichier_csv in tables.items():
+        if not os.path.exists(fichier_csv):
+            print(f"⚠️ {fichier_csv} introuvable, table '{nom}' non exportée")
+            continue
+        df = pd.read_csv(fichier_csv, encoding="utf-8-sig")
+        df.columns = df.columns.str.strip()
+        # Écriture puis renommage : un lecteur ne voit jamais un fichier partiel
+        chemin = os.path.join(dossier, f"{nom}.parquet")
+        df.to_parquet(chemin + ".tmp", index=False)
+        os.replace(chemin + ".tmp", chemin)
+        print(f"✅ {nom} : {len(df)} lignes -> {chemin}")
+
+
+# Les deux moteurs exposent la même interface : app.py ne sait pas lequel il utilise.
+# `filtres` est un dict {colonne: valeur} d'égalités combinées en ET.
+
+class MoteurPandas:
+    def __init__(self):
+        self.tables = {}
+
+    def ajouter_table(self, nom, df, exclure=None):
+        for colonne, valeur in (exclure or {}).items():
+            if colonne in df.columns:
+                # NA (colonnes Arrow) : ligne gardée, comme IS DISTINCT FROM côté DuckDB
+                df = df[df[colonne].ne(valeur).fillna(True)]
+        self.tables[nom] = df
+
+    def _filtrer(self, table, filtres):
+        df = self.tables[table]
+        for colonne, valeur in (filtres or {}).items():
+            df = df[df[colonne] == valeur]
+        return df
+
+    def colonnes(self, table):
+        return list(self.tables[table].columns)
+
+    def nb_lignes(self, table, filtres=None):
+        return len(self._filtrer(table, filtres))
+
+    def nb_distincts(self, table, colonne, filtres=None):
+        return self._filtrer(table, filtres)[colonne].nunique()
+
+    def valeurs_distinctes(self, table, colonne, filtres=None):
+        return sorted(self._filtrer(table, filtres)[colonne].dropna().unique())
+
+    def compter(self, table, colonne, filtres=None, limite=None):
+        counts = self._filtrer(table, filtres)[colonne].value_counts()
+        if limite:
+            counts = counts.head(limite)
+        counts = counts.reset_index()
+        counts.columns = [colonne, "Nombre"]
+        return counts
+
+    def rechercher(self, table, colonne, terme):
+        df = self.tables[table]
+        return df[df[colonne].str.contains(terme, case=False, na=False, regex=False)]
+
+    def apercu(self, table, limite=50):
+        return self.tables[table].head(limite)
+
+    def regrouper(self, table, cle, valeur):
+        # {cle: [valeurs distinctes dans l'ordre d'apparition]}
+        df = self.tables[table][[cle, valeur]].dropna().drop_duplicates()
+        return df.groupby(cle, sort=False)[valeur].agg(list).to_dict()
+
+    def exporter_csv(self, table):
+        return self.tables[table].to_csv(index=False).encode("utf-8-sig")
+
+
+class MoteurDuckDB:
+    def __init__(self, dossier=DOSSIER_PARQUET, threads=None):
+        try:
+            import duckdb
+        except ImportError:
+            raise ImportError("duckdb n'est pas installé (pip install duckdb)")
+        self.dossier = dossier
+        self.con = duckdb.connect(database=":memory:")
+        if threads:
+            self.con.execute(f"SET threads = {int(threads)}")
+        self.tables = {}
+
+    def ajouter_table(self, nom, exclure=None, chemin=None):
+        # Vue sur le fichier Parquet : rien n'est chargé, DuckDB ne lit que les
+        # colonnes et row groups nécessaires à chaque requête.
+        chemin = chemin or os.path.join(self.dossier, f"{nom}.parquet")
+        if not os.path.exists(chemin):
+            raise FileNotFoundError(chemin)
+        colonnes = [c for (c,) in self.con.execute(
+            "SELECT name FROM parquet_schema(?) WHERE name != 'schema'", [chemin]).fetchall()]
+        conditions = [f"{_ident(c)} IS DISTINCT FROM {_litteral(v)}"
+                      for c, v in (exclure or {}).items() if c in colonnes]
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        self.con.execute(f"CREATE OR REPLACE VIEW {_ident(nom)} AS "
+                         f"SELECT * FROM read_parquet({_litteral(chemin)}){where}")
+        self.tables[nom] = colonnes
+
+    def _curseur(self):
+        # Un curseur par appel : la connexion est partagée entre les sessions Streamlit
+        return self.con.cursor()
+
+    def _where(self, filtres):
+        if not filtres:
+            return "", []
+        clauses = " AND ".join(f"{_ident(c)} = ?" for c in filtres)
+        return f" WHERE {clauses}", list(filtres.values())
+
+    def colonnes(self, table):
+        return list(self.tables[table])
+
+    def nb_lignes(self, table, filtres=None):
+        where, params = self._where(filtres)
+        return self._curseur().execute(f"SELECT count(*) FROM {_ident(table)}{where}", params).fetchone()[0]
+
+    def nb_distincts(self, table, colonne, filtres=None):
+        where, params = self._where(filtres)
+        return self._curseur().execute(
+            f"SELECT count(DISTINCT {_ident(colonne)}) FROM {_ident(table)}{where}", params).fetchone()[0]
+
+    def valeurs_distinctes(self, table, colonne, filtres=None):
+        where, params = self._where(filtres)
+        sql = (f"SELECT DISTINCT {_ident(colonne)} FROM {_ident(table)}{where}"
+               f"{' AND' if where else ' WHERE'} {_ident(colonne)} IS NOT NULL ORDER BY 1")
+        return [v for (v,) in self._curseur().execute(sql, params).fetchall()]
+
+    def compter(self, table, colonne, filtres=None, limite=None):
+        where, params = self._where(filtres)
+        sql = (f"SELECT {_ident(colonne)}, count(*) AS Nombre FROM {_ident(table)}{where}"
+               f" GROUP BY 1 HAVING {_ident(colonne)} IS NOT NULL ORDER BY Nombre DESC, 1")
+        if limite:
+            sql += f" LIMIT {int(limite)}"
+        return self._curseur().execute(sql, params).df()
+
+    def rechercher(self, table, colonne, terme):
+        return self._curseur().execute(
+            f"SELECT * FROM {_ident(table)} WHERE contains(lower({_ident(colonne)}), lower(?))",
+            [terme]).df()
+
+    def apercu(self, table, limite=50):
+        return self._curseur().execute(f"SELECT * FROM {_ident(table)} LIMIT {int(limite)}").df()
+
+    def regrouper(self, table, cle, valeur):
+        sql = (f"SELECT {_ident(cle)}, list(DISTINCT {_ident(valeur)} ORDER BY {_ident(valeur)})"
+               f" FROM {_ident(table)} WHERE {_ident(cle)} IS NOT NULL AND {_ident(valeur)} IS NOT NULL"
+               f" GROUP BY 1")
+        return dict(self._curseur().execute(sql).fetchall())
+
+    def exporter_csv(self, table):
+        with tempfile.TemporaryDirectory() as tmp:
+            chemin = os.path.join(tmp, "export.csv")
+            self._curseur().execute(f"COPY {_ident(table)} TO {_litteral(chemin)} (HEADER)")
+            with open(chemin, "rb") as f:
+                return b"\xef\xbb\xbf" + f.read()
+
+
+def _ident(nom):
+    return '"' + str(nom).replace('"', '""') + '"'
+
+
+def _litteral(valeur):
+    return "'" + str(valeur).replace("'", "''") + "'"
+
+
+# ────────────── BENCHMARK ──────────────
+
+def catalogue_synthetique(df, facteur):
+    # Réplique le catalogue en rendant chaque copie distincte (codes et noms)
+    copies = []
+    for i in range(facteur):
+        copie = df.copy()
+        if "CODE_PRODUIT" in copie.columns:
+            copie["CODE_PRODUIT"] = copie["CODE_PRODUIT"].astype(str) + f"-{i}"
+        if "NOM PRODUIT" in copie.columns:
+            copie["NOM PRODUIT"] = copie["NOM PRODUIT"].astype(str) + f" v{i}"
+        copies.append(copie)
+    return pd.concat(copies, ignore_index=True)
+
+
+def _interactions(moteur, table, terme):
+    # Séquence reproduisant une page résultat de app.py
+    sous_familles = moteur.valeurs_distinctes(table, "SOUS_FAMILLE")
+    sous_famille = sous_familles[len(sous_familles) // 2]
+    yield "métriques", lambda: (moteur.nb_lignes(table), moteur.nb_distincts(table, "SOUS_FAMILLE"),
+                                moteur.nb_distincts(table, "AGREGAT"), moteur.nb_distincts(table, "NOM PRODUIT"))
+    yield "selectbox sous-famille", lambda: moteur.valeurs_distinctes(table, "SOUS_FAMILLE")
+    yield "selectbox agrégat", lambda: moteur.valeurs_distinctes(table, "AGREGAT", {"SOUS_FAMILLE": sous_famille})
+    yield "value_counts agrégats", lambda: moteur.compter(table, "AGREGAT", {"SOUS_FAMILLE": sous_famille})
+    yield "top produits", lambda: moteur.compter(table, "NOM PRODUIT", {"SOUS_FAMILLE": sous_famille}, limite=20)
+    yield "recherche", lambda: moteur.rechercher(table, "NOM PRODUIT", terme)
+    yield "exploration groupby", lambda: moteur.regrouper(table, "AGREGAT", "NOM PRODUIT")
+
+
+def _chrono(fonction, repetitions):
+    durees = []
+    for _ in range(repetitions):
+        debut = time.perf_counter()
+        fonction()
+        durees.append(time.perf_counter() - debut)
+    return sorted(durees)[len(durees) // 2] * 1000  # médiane en ms
+
+
+def benchmark(fichier_csv=TABLES["referentiel"], facteurs=(1, 10), terme="filtre", repetitions=5):
+    resultats = []
+    with tempfile.TemporaryDirectory() as tmp:
+        df_base = pd.read_csv(fichier_csv, encoding="utf-8-sig")
+        df_base.columns = df_base.columns.str.strip()
+        for facteur in facteurs:
+            df = catalogue_synthetique(df_base, facteur) if facteur > 1 else df_base
+            csv_path = os.path.join(tmp, f"cat_x{facteur}.csv")
+            parquet_path = os.path.join(tmp, f"cat_x{facteur}.parquet")
+            df.to_csv(csv_path, index=False, encoding="utf-8-sig")
+            df.to_parquet(parquet_path, index=False)
+
+            # app.py actuel : relecture du CSV à chaque rerun
+            lecture_csv = _chrono(lambda: pd.read_csv(csv_path, encoding="utf-8-sig"), repetitions)
+
+            moteur_pd = MoteurPandas()
+            moteur_pd.ajouter_table("cat", pd.read_csv(csv_path, encoding="utf-8-sig"))
+            moteur_db = MoteurDuckDB()
+            moteur_db.ajouter_table("cat", chemin=parquet_path)
+
+            for (etape, f_pd), (_, f_db) in zip(_interactions(moteur_pd, "cat", terme),
+                                                _interactions(moteur_db, "cat", terme)):
+                resultats.append({"catalogue": f"x{facteur} ({len(df)} lignes)", "interaction": etape,
+                                  "pandas_ms": round(_chrono(f_pd, repetitions), 2),
+                                  "duckdb_ms": round(_chrono(f_db, repetitions), 2)})
+            resultats.append({"catalogue": f"x{facteur} ({len(df)} lignes)", "interaction": "lecture CSV (rerun)",
+                              "pandas_ms": round(lecture_csv, 2), "duckdb_ms": 0.0})
+    return pd.DataFrame(resultats)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        print(benchmark().to_string(index=False))
+    else:
+        exporter_parquet()
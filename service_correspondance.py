@@ -0,0 +1,225 @@
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+FICHIER_CORRESPONDANCE = "Table de correspondance.csv"
+FICHIER_REFERENTIEL = "Referentiel Central.csv"
+TAILLE_PAGE_MAX = 1000
+
+
+class IndexCorrespondance:
+    # Index construit une seule fois : (CODE ARTICLE, SOURCE) -> CODE_PRODUIT,
+    # CODE_PRODUIT -> hiérarchie, et l'index inverse CODE_PRODUIT -> articles.
+
+    def __init__(self, fichier_corr=FICHIER_CORRESPONDANCE, fichier_ref=FICHIER_REFERENTIEL):
+        debut = time.perf_counter()
+        corr = pd.read_csv(fichier_corr, encoding="utf-8-sig", dtype=str)
+        ref = pd.read_csv(fichier_ref, encoding="utf-8-sig", dtype=str)
+        corr.columns = corr.columns.str.strip()
+        ref.columns = ref.columns.str.strip()
+        for col in ["CODE PRODUIT", "CODE ARTICLE", "SOURCE"]:
+            corr[col] = corr[col].str.strip()
+        corr["SOURCE"] = corr["SOURCE"].str.lower()
+
+        # Les deux index partent des mêmes couples dédoublonnés : un article résolu vers un
+        # produit figure dans la liste de ce produit, et seulement dans celle-là
+        doublons = corr.duplicated(["CODE ARTICLE", "SOURCE"])
+        if doublons.any():
+            print(f"⚠️ {int(doublons.sum())} couple(s) (CODE ARTICLE, SOURCE) en double, première occurrence conservée")
+        corr_unique = corr[~doublons]
+
+        self.produit_par_article = dict(zip(
+            zip(corr_unique["CODE ARTICLE"], corr_unique["SOURCE"]),
+            corr_unique["CODE PRODUIT"]))
+        self.produits = {
+            code: {"CODE_PRODUIT": code, "NOM PRODUIT": nom, "FAMILLE": fam,
+                   "SOUS_FAMILLE": sous_fam, "AGREGAT": agr}
+            for code, nom, fam, sous_fam, agr in zip(
+                ref["CODE_PRODUIT"].str.strip(), ref["NOM PRODUIT"], ref["FAMILLE"],
+                ref["SOUS_FAMILLE"], ref["AGREGAT"])
+        }
+        tri = corr_unique.sort_values(["CODE PRODUIT", "SOURCE", "CODE ARTICLE"], kind="stable")
+        self.articles_par_produit = {
+            code: list(zip(groupe["CODE ARTICLE"], groupe["SOURCE"]))
+            for code, groupe in tri.groupby("CODE PRODUIT", sort=False)
+        }
+        print(f"✅ Index construit en {time.perf_counter() - debut:.2f}s : "
+              f"{len(self.produit_par_article)} articles, {len(self.produits)} produits")
+
+    def resoudre(self, code_article, source):
+        code_produit = self.produit_par_article.get((str(code_article).strip(), str(source).strip().lower()))
+        if code_produit is None:
+            return None
+        produit = self.produits.get(code_produit, {"CODE_PRODUIT": code_produit})
+        return {"CODE ARTICLE": str(code_article).strip(), "SOURCE": str(source).strip().lower(), **produit}
+
+    def resoudre_lot(self, requetes):
+        return [self.resoudre(r.get("article", ""), r.get("source", "")) for r in requetes]
+
+    def articles(self, code_produit, page=1, taille=100):
+        taille = max(1, min(int(taille), TAILLE_PAGE_MAX))
+        page = max(1, int(page))
+        articles = self.articles_par_produit.get(str(code_produit).strip(), [])
+        debut = (page - 1) * taille
+        return {
+            "CODE_PRODUIT": code_produit,
+            "total": len(articles),
+            "page": page,
+            "taille": taille,
+            "articles": [{"CODE ARTICLE": a, "SOURCE": s} for a, s in articles[debut:debut + taille]],
+        }
+
+
+# ────────────── SERVICE HTTP ──────────────
+# GET  /produit?article=15615&source=gpairo
+# POST /produits            {"articles": [{"article": "15615", "source": "gpairo"}, ...]}
+# GET  /articles?code_produit=CAC100100&page=1&taille=100
+# GET  /sante
+
+def creer_serveur(index, hote="127.0.0.1", port=8765):
+    class Gestionnaire(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive pour les clients en rafale
+        disable_nagle_algorithm = True  # sinon ~40 ms d'attente d'ACK par réponse en keep-alive
+
+        def _repondre(self, statut, contenu):
+            corps = json.dumps(contenu, ensure_ascii=False).encode("utf-8")
+            self.send_response(statut)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(corps)))
+            self.end_headers()
+            self.wfile.write(corps)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {k: v[0] for k, v in parse_qs(url.query).items()}
+            try:
+                if url.path == "/produit":
+                    resultat = index.resoudre(params.get("article", ""), params.get("source", ""))
+                    if resultat is None:
+                        self._repondre(404, {"erreur": "article inconnu"})
+                    else:
+                        self._repondre(200, resultat)
+                elif url.path == "/articles":
+                    self._repondre(200, index.articles(params.get("code_produit", ""),
+                                                       params.get("page", 1), params.get("taille", 100)))
+                elif url.path == "/sante":
+                    self._repondre(200, {"statut": "ok", "articles": len(index.produit_par_article)})
+                else:
+                    self._repondre(404, {"erreur": "route inconnue"})
+            except ValueError as e:
+                self._repondre(400, {"erreur": str(e)})
+
+        def do_POST(self):
+            if urlparse(self.path).path != "/produits":
+                self._repondre(404, {"erreur": "route inconnue"})
+                return
+            try:
+                longueur = int(self.headers.get("Content-Length", 0))
+                contenu = json.loads(self.rfile.read(longueur) or b"{}")
+                requetes = contenu["articles"] if isinstance(contenu, dict) else contenu
+                self._repondre(200, {"resultats": index.resoudre_lot(requetes)})
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                self._repondre(400, {"erreur": f"requête invalide : {e}"})
+
+        def log_message(self, format, *args):
+            pass  # pas de log par requête : il fausserait les mesures de latence
+
+    serveur = ThreadingHTTPServer((hote, port), Gestionnaire)
+    serveur.daemon_threads = True
+    return serveur
+
+
+# ────────────── GÉNÉRATEUR DE CHARGE ──────────────
+
+def generer_charge(hote, port, index, duree=10, concurrence=8, taille_lot=0):
+    # taille_lot = 0 : requêtes unitaires GET /produit ; sinon POST /produits par lots
+    cles = list(index.produit_par_article)
+    latences = []
+    erreurs = [0]
+    verrou = threading.Lock()
+    fin = time.perf_counter() + duree
+
+    def worker(graine):
+        aleatoire = random.Random(graine)
+        connexion = http.client.HTTPConnection(hote, port, timeout=10)
+        mesures = []
+        nb_erreurs = 0
+        while time.perf_counter() < fin:
+            debut = time.perf_counter()
+            try:
+                if taille_lot:
+                    lot = [{"article": a, "source": s} for a, s in aleatoire.sample(cles, taille_lot)]
+                    connexion.request("POST", "/produits", body=json.dumps(lot),
+                                      headers={"Content-Type": "application/json"})
+                else:
+                    article, source = aleatoire.choice(cles)
+                    connexion.request("GET", f"/produit?article={article}&source={source}")
+                reponse = connexion.getresponse()
+                reponse.read()
+                if reponse.status != 200:
+                    nb_erreurs += 1
+            except (OSError, http.client.HTTPException):
+                nb_erreurs += 1
+                connexion.close()
+                connexion = http.client.HTTPConnection(hote, port, timeout=10)
+            mesures.append(time.perf_counter() - debut)
+        connexion.close()
+        with verrou:
+            latences.extend(mesures)
+            erreurs[0] += nb_erreurs
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrence)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    latences.sort()
+    n = len(latences)
+    quantile = lambda q: round(latences[min(n - 1, int(q * n))] * 1000, 2) if n else None
+    return {
+        "mode": f"lot de {taille_lot}" if taille_lot else "unitaire",
+        "concurrence": concurrence,
+        "requetes": n,
+        "erreurs": erreurs[0],
+        "requetes_par_s": round(n / duree, 1),
+        "articles_par_s": round(n * max(taille_lot, 1) / duree, 1),
+        "p50_ms": quantile(0.50),
+        "p95_ms": quantile(0.95),
+        "p99_ms": quantile(0.99),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Service de correspondance CODE ARTICLE -> CODE_PRODUIT")
+    parser.add_argument("commande", choices=["serve", "charge"])
+    parser.add_argument("--hote", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--duree", type=float, default=10)
+    parser.add_argument("--concurrence", type=int, default=8)
+    parser.add_argument("--lot", type=int, default=0, help="taille des lots (0 = requêtes unitaires)")
+    parser.add_argument("--externe", action="store_true",
+                        help="charge : viser un service déjà lancé au lieu d'en démarrer un dans ce processus")
+    args = parser.parse_args()
+
+    index = IndexCorrespondance()
+    if args.commande == "serve":
+        serveur = creer_serveur(index, args.hote, args.port)
+        print(f"🚀 Service en écoute sur http://{args.hote}:{args.port}")
+        serveur.serve_forever()
+    else:
+        serveur = None
+        if not args.externe:
+            serveur = creer_serveur(index, args.hote, args.port)
+            threading.Thread(target=serveur.serve_forever, daemon=True).start()
+        print(json.dumps(generer_charge(args.hote, args.port, index, args.duree,
+                                        args.concurrence, args.lot), ensure_ascii=False, indent=2))
+        if serveur:
+            serveur.shutdown()
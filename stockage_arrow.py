@@ -0,0 +1,99 @@
+import json
+import os
+import shutil
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+# Dossier partagé par toutes les sessions de l'application
+DOSSIER_STORE = os.environ.get("REFERENTIEL_STORE", "store_arrow")
+FICHIER_COURANT = "COURANT"
+VERSIONS_CONSERVEES = 3
+
+# Tables publiées : nom logique -> fichier CSV produit par le pipeline
+TABLES = {
+    "referentiel": "Referentiel Central.csv",
+    "table_corr": "Table de correspondance.csv",
+    "gpairo": "Ref_Pieces de rechange_Gpairo.csv",
+    "webpdrmif": "Ref_Installations fixes_Mif.csv",
+}
+
+
+def publier(tables=TABLES, dossier=DOSSIER_STORE):
+    # Chaque publication est écrite dans un dossier temporaire, puis rendue visible
+    # en remplaçant atomiquement le pointeur COURANT : une session ne voit jamais
+    # une version à moitié écrite.
+    version = time.strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}"
+    dossier_tmp = os.path.join(dossier, f".{version}.tmp")
+    os.makedirs(dossier_tmp)
+
+    manifeste = {"version": version, "tables": {}}
+    for nom, fichier_csv in tables.items():
+        if not os.path.exists(fichier_csv):
+            print(f"⚠️ {fichier_csv} introuvable, table '{nom}' non publiée")
+            continue
+        df = pd.read_csv(fichier_csv, encoding="utf-8-sig")
+        df.columns = df.columns.str.strip()
+        # Pas de compression : c'est ce qui permet le memory-map sans copie
+        feather.write_feather(df, os.path.join(dossier_tmp, f"{nom}.arrow"), compression="uncompressed")
+        manifeste["tables"][nom] = {"source": fichier_csv, "lignes": len(df)}
+        print(f"✅ {nom} : {len(df)} lignes")
+
+    with open(os.path.join(dossier_tmp, "manifeste.json"), "w", encoding="utf-8") as f:
+        json.dump(manifeste, f, ensure_ascii=False, indent=2)
+
+    os.rename(dossier_tmp, os.path.join(dossier, version))
+
+    pointeur_tmp = os.path.join(dossier, f".{FICHIER_COURANT}.{version}")
+    with open(pointeur_tmp, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(pointeur_tmp, os.path.join(dossier, FICHIER_COURANT))
+
+    nettoyer_anciennes_versions(dossier)
+    print(f"🚀 Version {version} publiée dans {dossier}")
+    return version
+
+
+def versions_publiees(dossier=DOSSIER_STORE):
+    # Des plus anciennes aux plus récentes (les noms commencent par la date)
+    if not os.path.isdir(dossier):
+        return []
+    return sorted(d for d in os.listdir(dossier)
+                  if not d.startswith(".") and os.path.isdir(os.path.join(dossier, d)))
+
+
+def nettoyer_anciennes_versions(dossier=DOSSIER_STORE, a_conserver=VERSIONS_CONSERVEES):
+    # Les sessions encore attachées à une ancienne version gardent leur mapping :
+    # on ne supprime que les plus anciennes, au-delà de a_conserver.
+    versions = versions_publiees(dossier)
+    for ancienne in versions[:-a_conserver]:
+        shutil.rmtree(os.path.join(dossier, ancienne), ignore_errors=True)
+
+
+def version_courante(dossier=DOSSIER_STORE):
+    try:
+        with open(os.path.join(dossier, FICHIER_COURANT), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def ouvrir_table(nom, version=None, dossier=DOSSIER_STORE):
+    version = version or version_courante(dossier)
+    if version is None:
+        raise FileNotFoundError(f"Aucune version publiée dans {dossier}")
+    chemin = os.path.join(dossier, version, f"{nom}.arrow")
+    source = pa.memory_map(chemin, "r")
+    return pa.ipc.open_file(source).read_all()
+
+
+def ouvrir_dataframe(nom, version=None, dossier=DOSSIER_STORE):
+    # ArrowDtype : les colonnes pandas pointent directement sur les buffers mappés,
+    # aucune copie n'est faite lors de la conversion.
+    return ouvrir_table(nom, version, dossier).to_pandas(types_mapper=pd.ArrowDtype)
+
+
+if __name__ == "__main__":
+    publier()
@@ -0,0 +1,347 @@
+import argparse
+import os
+import re
+import sqlite3
+import time
+import unicodedata
+
+import pandas as pd
+
+from filtrage_designations import LIBELLE_NON_IDENTIFIABLE
+from service_correspondance import FICHIER_CORRESPONDANCE, FICHIER_REFERENTIEL
+
+# Store SQLite du référentiel et de la table de correspondance : mises à jour par upsert
+# (1 000 articles ajoutés = 1 000 lignes écrites, pas une réécriture des CSV), allocation des
+# CODE_PRODUIT, export CSV / Parquet à la demande dans le format des fichiers actuels.
+#
+# CODE_PRODUIT = préfixe de 4 caractères du bloc (FAMILLE, SOUS_FAMILLE, AGREGAT), ex. « CAC1 »
+# pour Carrosserie / Carrosserie, Vitres, Peinture / Partie arrière, suivi d'un numéro sur
+# 5 chiffres. Dans le référentiel actuel le numéro est une séquence unique sur tous les blocs
+# (1 à 24864) : le compteur est donc global, monotone, et jamais réutilisé après suppression.
+
+FICHIER_SQLITE = os.environ.get("REFERENTIEL_SQLITE", "referentiel.sqlite")
+LARGEUR_NUMERO = 5
+CARACTERES_PREFIXE = "ABCDEFGHIJKLMNOPQRSTUVWXYZ123456789"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS produits (
+    code_produit TEXT PRIMARY KEY,
+    nom_produit TEXT NOT NULL,
+    famille TEXT NOT NULL,
+    sous_famille TEXT NOT NULL,
+    agregat TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_produits_hierarchie ON produits (famille, sous_famille, agregat, nom_produit);
+
+CREATE TABLE IF NOT EXISTS correspondances (
+    code_article TEXT NOT NULL,
+    source TEXT NOT NULL,
+    code_produit TEXT NOT NULL,
+    PRIMARY KEY (code_article, source)
+);
+CREATE INDEX IF NOT EXISTS idx_correspondances_produit ON correspondances (code_produit);
+
+CREATE TABLE IF NOT EXISTS prefixes (
+    famille TEXT NOT NULL,
+    sous_famille TEXT NOT NULL,
+    agregat TEXT NOT NULL,
+    prefixe TEXT NOT NULL UNIQUE,
+    PRIMARY KEY (famille, sous_famille, agregat)
+);
+
+CREATE TABLE IF NOT EXISTS compteur (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    dernier_numero INTEGER NOT NULL
+);
+"""
+
+# Colonnes des fichiers actuels, pour l'import et l'export
+COLONNES_REFERENTIEL = {"CODE_PRODUIT": "code_produit", "NOM PRODUIT": "nom_produit", "FAMILLE": "famille",
+                        "SOUS_FAMILLE": "sous_famille", "AGREGAT": "agregat"}
+COLONNES_CORRESPONDANCE = {"CODE PRODUIT": "code_produit", "CODE ARTICLE": "code_article", "SOURCE": "source"}
+
+
+def _initiales(texte):
+    # Lettres candidates pour un nouveau préfixe : initiales des mots, puis toutes les lettres
+    texte = unicodedata.normalize("NFKD", texte).encode("ascii", "ignore").decode().upper()
+    mots = re.findall(r"[A-Z0-9]+", texte)
+    return "".join(dict.fromkeys("".join(m[0] for m in mots) + "".join(mots) + CARACTERES_PREFIXE))
+
+
+class StoreReferentiel:
+    def __init__(self, chemin=FICHIER_SQLITE):
+        self.chemin = chemin
+        # isolation_level=None : transactions explicites (BEGIN IMMEDIATE) autour de chaque lot
+        self.connexion = sqlite3.connect(chemin, isolation_level=None, timeout=30)
+        self.connexion.execute("PRAGMA journal_mode=WAL")
+        self.connexion.execute("PRAGMA synchronous=NORMAL")
+        self.connexion.executescript(SCHEMA)
+
+    def fermer(self):
+        self.connexion.close()
+
+    def _transaction(self, fonction, *args):
+        # BEGIN IMMEDIATE : un seul écrivain à la fois entre process, les lecteurs continuent (WAL)
+        self.connexion.execute("BEGIN IMMEDIATE")
+        try:
+            resultat = fonction(*args)
+        except BaseException:
+            self.connexion.execute("ROLLBACK")
+            raise
+        self.connexion.execute("COMMIT")
+        return resultat
+
+    # ────────────── IMPORT ──────────────
+
+    def importer_csv(self, fichier_ref=FICHIER_REFERENTIEL, fichier_corr=FICHIER_CORRESPONDANCE):
+        # Chargement initial depuis les CSV ; un doublon (CODE ARTICLE, SOURCE) garde la
+        # première occurrence, comme service_correspondance
+        ref = pd.read_csv(fichier_ref, encoding="utf-8-sig", dtype=str, keep_default_na=False)
+        corr = pd.read_csv(fichier_corr, encoding="utf-8-sig", dtype=str, keep_default_na=False)
+        ref.columns, corr.columns = ref.columns.str.strip(), corr.columns.str.strip()
+        ref = ref.rename(columns=COLONNES_REFERENTIEL)[list(COLONNES_REFERENTIEL.values())]
+        corr = corr.rename(columns=COLONNES_CORRESPONDANCE)[["code_article", "source", "code_produit"]]
+
+        def charger():
+            nb_produits = self.upsert_produits(ref, transaction=False)
+            avant = self.connexion.total_changes
+            self.connexion.executemany(
+                "INSERT OR IGNORE INTO correspondances (code_article, source, code_produit) VALUES (?, ?, ?)",
+                corr.itertuples(index=False, name=None))
+            nb_correspondances = self.connexion.total_changes - avant
+            # Préfixes et compteur repris des codes existants
+            self.connexion.execute("""
+                INSERT OR IGNORE INTO prefixes (famille, sous_famille, agregat, prefixe)
+                SELECT famille, sous_famille, agregat, substr(code_produit, 1, 4) FROM produits
+                GROUP BY famille, sous_famille, agregat""")
+            self.connexion.execute("""
+                INSERT INTO compteur (id, dernier_numero)
+                SELECT 1, coalesce(max(CAST(substr(code_produit, 5) AS INTEGER)), 0) FROM produits WHERE true
+                ON CONFLICT (id) DO UPDATE SET dernier_numero = max(dernier_numero, excluded.dernier_numero)""")
+            return nb_produits, nb_correspondances
+
+        nb_produits, nb_correspondances = self._transaction(charger)
+        print(f"✅ Import : {nb_produits} produits, {nb_correspondances} correspondances ajoutées "
+              f"({len(corr) - nb_correspondances} déjà présente(s) ou en double)")
+
+    # ────────────── UPSERTS ──────────────
+
+    def upsert_produits(self, df, transaction=True):
+        # df : colonnes code_produit, nom_produit, famille, sous_famille, agregat
+        lignes = df[list(COLONNES_REFERENTIEL.values())].itertuples(index=False, name=None)
+        requete = """
+            INSERT INTO produits (code_produit, nom_produit, famille, sous_famille, agregat) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (code_produit) DO UPDATE SET nom_produit = excluded.nom_produit, famille = excluded.famille,
+                sous_famille = excluded.sous_famille, agregat = excluded.agregat
+            WHERE (nom_produit, famille, sous_famille, agregat)
+                IS NOT (excluded.nom_produit, excluded.famille, excluded.sous_famille, excluded.agregat)"""
+        if not transaction:
+            self.connexion.executemany(requete, lignes)
+            return len(df)
+        self._transaction(self.connexion.executemany, requete, lignes)
+        return len(df)
+
+    def upsert_correspondances(self, df, transaction=True):
+        # df : colonnes code_article, source, code_produit ; un article déjà connu est réaffecté
+        lignes = df[["code_article", "source", "code_produit"]].itertuples(index=False, name=None)
+        requete = """
+            INSERT INTO correspondances (code_article, source, code_produit) VALUES (?, ?, ?)
+            ON CONFLICT (code_article, source) DO UPDATE SET code_produit = excluded.code_produit
+            WHERE code_produit != excluded.code_produit"""
+        if not transaction:
+            self.connexion.executemany(requete, lignes)
+            return len(df)
+        self._transaction(self.connexion.executemany, requete, lignes)
+        return len(df)
+
+    # ────────────── CODES ──────────────
+
+    def _prefixe(self, famille, sous_famille, agregat):
+        ligne = self.connexion.execute("SELECT prefixe FROM prefixes WHERE famille = ? AND sous_famille = ? AND agregat = ?",
+                                       (famille, sous_famille, agregat)).fetchone()
+        if ligne:
+            return ligne[0]
+        # Nouveau bloc : 2 lettres de famille, 1 de sous-famille, 1 d'agrégat, en reprenant celles
+        # déjà attribuées à la famille / sous-famille et sans collision avec les préfixes existants
+        def connu(requete, *args):
+            ligne = self.connexion.execute(requete, args).fetchone()
+            return ligne[0] if ligne else None
+
+        debut = connu("SELECT substr(prefixe, 1, 2) FROM prefixes WHERE famille = ?", famille)
+        if debut is None:
+            pris = {r[0] for r in self.connexion.execute("SELECT DISTINCT substr(prefixe, 1, 2) FROM prefixes")}
+            lettres = _initiales(famille)
+            debut = next(a + b for a in lettres for b in lettres if a != b and a + b not in pris)
+        milieu = connu("SELECT substr(prefixe, 1, 3) FROM prefixes WHERE famille = ? AND sous_famille = ?",
+                       famille, sous_famille)
+        if milieu is None:
+            pris = {r[0] for r in self.connexion.execute(
+                "SELECT DISTINCT substr(prefixe, 1, 3) FROM prefixes WHERE prefixe LIKE ?", (debut + "%",))}
+            milieu = next(debut + c for c in _initiales(sous_famille) if debut + c not in pris)
+        pris = {r[0] for r in self.connexion.execute("SELECT prefixe FROM prefixes WHERE prefixe LIKE ?", (milieu + "%",))}
+        prefixe = next(milieu + c for c in _initiales(agregat) if milieu + c not in pris)
+        self.connexion.execute("INSERT INTO prefixes (famille, sous_famille, agregat, prefixe) VALUES (?, ?, ?, ?)",
+                               (famille, sous_famille, agregat, prefixe))
+        return prefixe
+
+    def allouer_codes(self, famille, sous_famille, agregat, n=1, transaction=True):
+        # n codes consécutifs du bloc
+        return self._allouer([((famille, sous_famille, agregat), n)], transaction)[0]
+
+    def _allouer(self, demandes, transaction=True):
+        # demandes : [((famille, sous_famille, agregat), n), …] ; une seule mise à jour du
+        # compteur pour tout le lot, puis une plage de numéros par bloc
+        def allouer():
+            prefixes = [self._prefixe(*bloc) for bloc, _ in demandes]
+            total = sum(n for _, n in demandes)
+            if not total:
+                return [[] for _ in demandes]
+            dernier = self.connexion.execute(
+                "UPDATE compteur SET dernier_numero = dernier_numero + ? WHERE id = 1 RETURNING dernier_numero",
+                (total,)).fetchone()
+            if dernier is None:
+                self.connexion.execute("INSERT INTO compteur (id, dernier_numero) VALUES (1, ?)", (total,))
+                dernier = (total,)
+            numero = dernier[0] - total
+            codes = []
+            for prefixe, (_, n) in zip(prefixes, demandes):
+                codes.append([f"{prefixe}{k:0{LARGEUR_NUMERO}d}" for k in range(numero + 1, numero + n + 1)])
+                numero += n
+            return codes
+        return self._transaction(allouer) if transaction else allouer()
+
+    # ────────────── CLASSIFICATIONS ──────────────
+
+    def ajouter_classifications(self, df, col_article="ID", col_source="BASE"):
+        # df au format de resultat_dégroupé.csv : article, source, FAMILLE, SOUS_FAMILLE, AGREGAT, NOM PRODUIT.
+        # Un produit existant (même nom dans le même bloc) est réutilisé, sinon un code est alloué ;
+        # seules les lignes nouvelles ou modifiées sont écrites. Les lignes non classées (niveau vide,
+        # « inconnue », « Non identifiable ») ne deviennent pas des produits : elles sont ignorées.
+        niveaux = df[["FAMILLE", "SOUS_FAMILLE", "AGREGAT", "NOM PRODUIT"]].astype("string").apply(lambda c: c.str.strip())
+        non_classees = (niveaux.isna() | niveaux.apply(lambda c: c.str.lower()).isin(["", "inconnu", "inconnue"])
+                        | niveaux.eq(LIBELLE_NON_IDENTIFIABLE)).any(axis=1).fillna(True).astype(bool)
+        ignorees = int(non_classees.sum())
+        df = df[~non_classees.to_numpy()]
+        df = pd.DataFrame({
+            "code_article": df[col_article].astype(str).str.strip(),
+            "source": df[col_source].astype(str).str.strip(),
+            "nom_produit": df["NOM PRODUIT"].astype(str).str.strip(),
+            "famille": df["FAMILLE"].astype(str).str.strip(),
+            "sous_famille": df["SOUS_FAMILLE"].astype(str).str.strip(),
+            "agregat": df["AGREGAT"].astype(str).str.strip(),
+        })
+        cles = ["famille", "sous_famille", "agregat", "nom_produit"]
+        produits = df[cles].drop_duplicates()
+
+        def ajouter():
+            avant = self.connexion.total_changes
+            # Produits existants : une requête indexée par produit distinct du lot
+            existants = [self.connexion.execute(
+                "SELECT code_produit FROM produits WHERE famille = ? AND sous_famille = ? AND agregat = ? AND nom_produit = ?",
+                p).fetchone() for p in produits.itertuples(index=False, name=None)]
+            produits["code_produit"] = [e[0] if e else None for e in existants]
+            nouveaux = produits[produits["code_produit"].isna()]
+            blocs = list(nouveaux.groupby(["famille", "sous_famille", "agregat"], sort=False))
+            codes = self._allouer([(bloc, len(lignes)) for bloc, lignes in blocs], transaction=False)
+            for (_, lignes), codes_bloc in zip(blocs, codes):
+                produits.loc[lignes.index, "code_produit"] = codes_bloc
+            self.upsert_produits(produits.loc[nouveaux.index], transaction=False)
+            self.upsert_correspondances(df.merge(produits, on=cles), transaction=False)
+            return len(nouveaux), self.connexion.total_changes - avant
+
+        nb_nouveaux, nb_lignes = self._transaction(ajouter)
+        print(f"✅ {len(df)} article(s) classé(s) : {nb_nouveaux} nouveau(x) produit(s), {nb_lignes} ligne(s) écrite(s)"
+              + (f", {ignorees} ligne(s) non classée(s) ignorée(s)" if ignorees else ""))
+        return nb_nouveaux, nb_lignes
+
+    # ────────────── LECTURE / EXPORT ──────────────
+
+    def compter(self, table):
+        return self.connexion.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+
+    def referentiel(self):
+        df = pd.read_sql_query("SELECT * FROM produits ORDER BY rowid", self.connexion)
+        return df.rename(columns={v: k for k, v in COLONNES_REFERENTIEL.items()})
+
+    def table_correspondance(self):
+        df = pd.read_sql_query("SELECT code_produit, code_article, source FROM correspondances ORDER BY rowid",
+                               self.connexion)
+        return df.rename(columns={v: k for k, v in COLONNES_CORRESPONDANCE.items()})
+
+    def exporter(self, format="csv", dossier="."):
+        # Mêmes noms et colonnes que les fichiers actuels ; écriture puis renommage
+        os.makedirs(dossier, exist_ok=True)
+        fichiers = []
+        for df, fichier in [(self.referentiel(), FICHIER_REFERENTIEL), (self.table_correspondance(), FICHIER_CORRESPONDANCE)]:
+            chemin = os.path.join(dossier, fichier if format == "csv" else os.path.splitext(fichier)[0] + ".parquet")
+            if format == "csv":
+                df.to_csv(chemin + ".tmp", index=False, encoding="utf-8-sig")
+            else:
+                df.to_parquet(chemin + ".tmp", index=False)
+            os.replace(chemin + ".tmp", chemin)
+            fichiers.append(chemin)
+            print(f"✅ {len(df)} lignes -> {chemin}")
+        return fichiers
+
+
+def benchmark(nb_articles=1000, chemin="bench_referentiel.sqlite"):
+    # 1 000 articles classés : upsert dans le store contre réécriture complète des deux CSV
+    for suffixe in ("", "-wal", "-shm"):
+        if os.path.exists(chemin + suffixe):
+            os.remove(chemin + suffixe)
+    store = StoreReferentiel(chemin)
+    debut = time.perf_counter()
+    store.importer_csv()
+    duree_import = time.perf_counter() - debut
+
+    ref = store.referentiel().sample(nb_articles, random_state=0, replace=True).reset_index(drop=True)
+    nouveaux = ref.index % 10 == 0  # un sur dix : nouveau produit
+    ref.loc[nouveaux, "NOM PRODUIT"] = ref.loc[nouveaux, "NOM PRODUIT"] + " bench " + ref.index[nouveaux].astype(str)
+    lot = ref.assign(ID=[f"BENCH{i}" for i in range(nb_articles)], BASE="bench")
+
+    debut = time.perf_counter()
+    nb_nouveaux, nb_lignes = store.ajouter_classifications(lot)
+    duree_upsert = time.perf_counter() - debut
+
+    debut = time.perf_counter()
+    referentiel = pd.read_csv(FICHIER_REFERENTIEL, encoding="utf-8-sig", dtype=str)
+    table_corr = pd.read_csv(FICHIER_CORRESPONDANCE, encoding="utf-8-sig", dtype=str)
+    referentiel.to_csv(chemin + ".ref.csv", index=False, encoding="utf-8-sig")
+    table_corr.to_csv(chemin + ".corr.csv", index=False, encoding="utf-8-sig")
+    duree_csv = time.perf_counter() - debut
+    os.remove(chemin + ".ref.csv")
+    os.remove(chemin + ".corr.csv")
+
+    print(f"Import initial : {duree_import:.2f}s")
+    print(f"{nb_articles} articles (dont {nb_nouveaux} nouveaux produits) : {duree_upsert * 1000:.0f} ms, "
+          f"{nb_lignes} ligne(s) écrite(s)")
+    print(f"Réécriture des CSV ({len(referentiel) + len(table_corr)} lignes) : {duree_csv * 1000:.0f} ms")
+    store.fermer()
+    os.remove(chemin)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Store SQLite du référentiel et de la table de correspondance")
+    parser.add_argument("--base", default=FICHIER_SQLITE)
+    sous = parser.add_subparsers(dest="commande", required=True)
+    sous.add_parser("importer", help="charge Referentiel Central.csv et la Table de correspondance")
+    p = sous.add_parser("ajouter", help="ajoute des articles classés (format resultat_dégroupé.csv)")
+    p.add_argument("fichier", nargs="?", default="resultat_dégroupé.csv")
+    p = sous.add_parser("exporter", help="export CSV ou Parquet dans le format des fichiers actuels")
+    p.add_argument("--format", choices=["csv", "parquet"], default="csv")
+    p.add_argument("--dossier", default="export_referentiel")
+    p = sous.add_parser("bench", help="upsert de N articles contre réécriture des CSV")
+    p.add_argument("--articles", type=int, default=1000)
+    args = parser.parse_args()
+
+    if args.commande == "bench":
+        benchmark(args.articles)
+    else:
+        store = StoreReferentiel(args.base)
+        if args.commande == "importer":
+            store.importer_csv()
+        elif args.commande == "ajouter":
+            store.ajouter_classifications(pd.read_csv(args.fichier, encoding="utf-8-sig", dtype=str))
+        else:
+            store.exporter(args.format, args.dossier)
+        store.fermer()
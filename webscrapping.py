@@ -1,13 +1,124 @@
+import argparse
+import csv
+import hashlib
 import json
+import os
+import time
 import nodriver as uc
 import asyncio
 import pandas as pd
 
-async def main():
-    print("🌍 Lancement du navigateur...")
-    browser = await uc.start()
-    page = await browser.get("https://www.oscaro.com")
+BASE_URL = "https://www.oscaro.com"
+SELECTEUR_CATEGORIES = "div.category-item-header h2 a"
+SELECTEUR_PRODUITS = "div.link-list-column ul.link-list.link-primary li a"
+FICHIER_SORTIE = "Organe_SousOrgane_Produits_oscaro.csv"
+FICHIER_METRIQUES = "metriques_crawl.csv"
+DOSSIER_CACHE = "cache_crawl"
+COLONNES_SORTIE = ["Catégorie", "Sous-catégorie", "Lien", "Produit", "Lien produit"]
+AUCUN_PRODUIT = "Aucun produit trouvé"
+
+
+def url_absolue(href, base_url=BASE_URL):
+    href = (href or "").strip()
+    if href and not href.startswith("http"):
+        href = base_url.rstrip("/") + "/" + href.lstrip("/")
+    return href
+
+
+# ────────────── CACHE DE PAGES ──────────────
+# Une entrée par URL (clé = sha1 de l'URL) : liste extraite (texte, lien) + HTML de la page.
+# Une entrée plus ancienne que age_max est ignorée et la page est revisitée.
+
+class CachePages:
+    def __init__(self, dossier=DOSSIER_CACHE, age_max=None):
+        self.dossier = dossier
+        self.age_max = age_max  # en secondes, None = le cache n'expire jamais
+        os.makedirs(dossier, exist_ok=True)
+
+    def _chemin(self, url, extension):
+        return os.path.join(self.dossier, hashlib.sha1(url.encode("utf-8")).hexdigest() + extension)
+
+    def lire(self, url):
+        try:
+            with open(self._chemin(url, ".json"), "r", encoding="utf-8") as f:
+                entree = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if self.age_max is not None and time.time() - entree["date"] > self.age_max:
+            return None
+        return [tuple(e) for e in entree["elements"]]
+
+    def ecrire(self, url, elements, html=None):
+        if html is not None:
+            with open(self._chemin(url, ".html"), "w", encoding="utf-8") as f:
+                f.write(html)
+        chemin = self._chemin(url, ".json")
+        with open(chemin + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"url": url, "date": time.time(), "elements": elements}, f, ensure_ascii=False)
+        os.replace(chemin + ".tmp", chemin)  # jamais d'entrée à moitié écrite
+
+
+# ────────────── SORTIE INCRÉMENTALE ──────────────
+# Une ligne par produit, écrite et synchronisée sur disque dès qu'une sous-catégorie
+# est terminée. Le lien de la sous-catégorie est ensuite ajouté à <sortie>.terminees : une
+# sous-catégorie n'est finie que si elle y figure. Avec reprendre=True, les sous-catégories
+# finies sont sautées et les lignes d'une sous-catégorie interrompue en cours d'écriture
+# sont retirées du CSV avant de reprendre.
+
+class SortieIncrementale:
+    def __init__(self, chemin=FICHIER_SORTIE, reprendre=False):
+        self.terminees = set()
+        self.chemin_terminees = chemin + ".terminees"
+        if reprendre and os.path.exists(chemin):
+            with open(chemin, "r", encoding="utf-8-sig", newline="") as f:
+                lignes = list(csv.reader(f))[1:]
+            if os.path.exists(self.chemin_terminees):
+                with open(self.chemin_terminees, "r", encoding="utf-8") as f:
+                    self.terminees = {lien.rstrip("\n") for lien in f if lien.strip()}
+            else:  # sortie d'avant le journal : toutes ses sous-catégories sont tenues pour finies
+                self.terminees = {ligne[2] for ligne in lignes}
+                self._ajouter_terminees(sorted(self.terminees))
+            completes = [ligne for ligne in lignes if len(ligne) == len(COLONNES_SORTIE) and ligne[2] in self.terminees]
+            if len(completes) < len(lignes):
+                print(f"✂️ {len(lignes) - len(completes)} ligne(s) de sous-catégorie(s) inachevée(s) retirée(s)")
+                with open(chemin + ".tmp", "w", encoding="utf-8-sig", newline="") as f:
+                    csv.writer(f).writerows([COLONNES_SORTIE] + completes)
+                os.replace(chemin + ".tmp", chemin)
+            self.fichier = open(chemin, "a", encoding="utf-8", newline="")
+            print(f"↩️ Reprise : {len(self.terminees)} sous-catégorie(s) déjà écrites")
+        else:
+            self.fichier = open(chemin, "w", encoding="utf-8-sig", newline="")
+            csv.writer(self.fichier).writerow(COLONNES_SORTIE)
+            if os.path.exists(self.chemin_terminees):
+                os.remove(self.chemin_terminees)
+        self.writer = csv.writer(self.fichier)
+        self.nb_lignes = 0
+
+    def _ajouter_terminees(self, liens):
+        with open(self.chemin_terminees, "a", encoding="utf-8") as f:
+            f.writelines(f"{lien}\n" for lien in liens)
+            f.flush()
+            os.fsync(f.fileno())
 
+    def deja_faite(self, lien):
+        return lien in self.terminees
+
+    def ecrire(self, cat_nom, sub_nom, lien, produits):
+        produits = produits or [(AUCUN_PRODUIT, "")]
+        for nom, href in produits:
+            self.writer.writerow([cat_nom, sub_nom, lien, nom, href])
+        self.fichier.flush()
+        os.fsync(self.fichier.fileno())
+        # Marqueur de fin écrit après les lignes : sans lui, la sous-catégorie est refaite
+        self._ajouter_terminees([lien])
+        self.terminees.add(lien)
+        self.nb_lignes += len(produits)
+
+    def fermer(self):
+        self.fichier.close()
+
+
+async def injecter_auth(page):
     # Injection du localStorage
     try:
         with open("auth.json", "r", encoding="utf-8") as f:
@@ -20,69 +131,73 @@ async def main():
     except FileNotFoundError:
         print("❌ auth.json non trouvé")
 
+
+async def main(base_url=BASE_URL, cache=None, sortie=None):
+    cache = cache or CachePages()
+    sortie = sortie or SortieIncrementale()
+    print("🌍 Lancement du navigateur...")
+    browser = await uc.start()
+    page = await browser.get(base_url)
+
+    await injecter_auth(page)
+
     await asyncio.sleep(30)  # Attendre le chargement complet
 
     # Récupération des catégories principales
-    containers = await page.query_selector_all("div.category-item-header h2 a")
+    containers = await page.query_selector_all(SELECTEUR_CATEGORIES)
     print(f"Nombre de catégories trouvées : {len(containers)}")
 
-    all_data = []
-
     # Parcours des catégories principales
     for i, el in enumerate(containers):
         try:
             cat_nom = el.text.strip()
-            cat_href = el.attrs.get('href', '').strip()
-            if cat_href and not cat_href.startswith("http"):
-                cat_href = "https://www.oscaro.com" + cat_href
+            cat_href = url_absolue(el.attrs.get('href', ''), base_url)
             print(f"\n{i+1}️⃣ Catégorie : {cat_nom} -> {cat_href}")
 
-            # Charger la page de la catégorie
-            cat_page = await browser.get(cat_href)
-            await asyncio.sleep(5)
-
-            # Récupérer les sous-catégories
-            subcontainers = await cat_page.query_selector_all("div.category-item-header h2 a")
-            print(f"   ↪ Sous-catégories trouvées : {len(subcontainers)}")
+            # Charger la page de la catégorie (ou la reprendre du cache)
+            sous_categories = cache.lire(cat_href)
+            if sous_categories is None:
+                cat_page = await browser.get(cat_href)
+                await asyncio.sleep(5)
+                subcontainers = await cat_page.query_selector_all(SELECTEUR_CATEGORIES)
+                sous_categories = [(sub.text.strip(), url_absolue(sub.attrs.get('href', ''), base_url))
+                                   for sub in subcontainers]
+                # Liste vide après un délai fixe : page peut-être pas chargée, rien en cache
+                if sous_categories:
+                    cache.ecrire(cat_href, sous_categories)
+            print(f"   ↪ Sous-catégories trouvées : {len(sous_categories)}")
 
-            for j, sub in enumerate(subcontainers):
+            for j, (sub_nom, sub_href) in enumerate(sous_categories):
                 try:
-                    sub_nom = sub.text.strip()
-                    sub_href = sub.attrs.get('href', '').strip()
-                    if sub_href and not sub_href.startswith("http"):
-                        sub_href = "https://www.oscaro.com" + sub_href
+                    if sortie.deja_faite(sub_href):
+                        continue
                     print(f"   {j+1}. {sub_nom} -> {sub_href}")
 
-                    # Aller sur la page de la sous-catégorie
-                    sub_page = await browser.get(sub_href)
-                    await asyncio.sleep(5)
-
-                    # Récupérer les produits de la sous-catégorie
-                    subsubcontainers = await sub_page.query_selector_all(
-                        "div.link-list-column ul.link-list.link-primary li a"
-                    )
-
-                    produits = []
-                    for k, s in enumerate(subsubcontainers):
-                        try:
-                            s_nom = s.text.strip()
-                            s_href = s.attrs.get('href', '').strip() if s.attrs.get('href') else ""
-                            if s_href and not s_href.startswith("http"):
-                                s_href = "https://www.oscaro.com" + s_href
-                            produits.append(s_nom)
-                            print(f"       → Produit {k+1}: {s_nom}")
-                        except:
-                            print("aucun produit trouvé")
-
-                    if not produits:
-                        produits = ["Aucun produit trouvé"]
-
-                    all_data.append({
-                        "Catégorie": cat_nom,
-                        "Sous-catégorie": sub_nom,
-                        "Lien": sub_href,
-                        "Produits": ", ".join(produits)
-                    })
+                    produits = cache.lire(sub_href)
+                    if produits is None:
+                        # Aller sur la page de la sous-catégorie
+                        sub_page = await browser.get(sub_href)
+                        await asyncio.sleep(5)
+
+                        # Récupérer les produits de la sous-catégorie
+                        subsubcontainers = await sub_page.query_selector_all(SELECTEUR_PRODUITS)
+
+                        produits = []
+                        for k, s in enumerate(subsubcontainers):
+                            try:
+                                s_nom = s.text.strip()
+                                s_href = url_absolue(s.attrs.get('href', ''), base_url)
+                                produits.append((s_nom, s_href))
+                                print(f"       → Produit {k+1}: {s_nom}")
+                            except:
+                                print("aucun produit trouvé")
+                        if not produits:
+                            # Vide non confirmé : ni cache ni sortie, la reprise retentera ce lien
+                            print(f"⚠️ Aucun produit chargé pour {sub_href}, sous-catégorie à reprendre")
+                            continue
+                        cache.ecrire(sub_href, produits)
+
+                    sortie.ecrire(cat_nom, sub_nom, sub_href, produits)
 
                 except Exception as e_sub:
                     print(f"❌ Erreur sous-catégorie {j+1} de {cat_nom} :", e_sub)
@@ -90,18 +205,210 @@ async def main():
         except Exception as e_cat:
             print(f"❌ Erreur catégorie {i+1} :", e_cat)
 
-    # Sauvegarder dans un CSV
-    if all_data:
-        df = pd.DataFrame(all_data)
-        df.to_csv("Organe_SousOrgane_Produits_oscaro.csv", index=False, encoding="utf-8-sig")
-        print("✅ CSV généré avec succès")
+    sortie.fermer()
+    if sortie.nb_lignes:
+        print(f"✅ {sortie.nb_lignes} ligne(s) écrites dans {FICHIER_SORTIE}")
     else:
-        print("❌ Aucun élément trouvé")
+        print("❌ Aucun nouvel élément trouvé")
 
     # Fermer le navigateur
     if browser:
         browser.stop()
         print("🚀 Navigateur fermé.")
 
+
+# ────────────── MODE CONCURRENT ──────────────
+# Plusieurs onglets en parallèle (bornés par un sémaphore) et attente des sélecteurs
+# cibles au lieu des asyncio.sleep fixes.
+
+class Crawler:
+    def __init__(self, browser, base_url=BASE_URL, max_onglets=4, timeout=20, cache=None, sortie=None):
+        self.browser = browser
+        self.base_url = base_url
+        self.timeout = timeout
+        self.onglets = asyncio.Semaphore(max_onglets)
+        self.cache = cache or CachePages()
+        self.sortie = sortie or SortieIncrementale()
+        self.metriques = []
+
+    async def attendre_elements(self, tab, selecteur):
+        # select_all attend que le sélecteur apparaisse ; selon la version de nodriver,
+        # l'expiration du délai renvoie une liste vide ou lève TimeoutError.
+        try:
+            return await tab.select_all(selecteur, timeout=self.timeout)
+        except asyncio.TimeoutError:
+            return []
+
+    async def page_chargee(self, tab):
+        try:
+            return await tab.evaluate("document.readyState") == "complete"
+        except Exception:
+            return False
+
+    async def extraire(self, url, selecteur, type_page):
+        # Cache d'abord ; sinon ouvre un onglet, attend le sélecteur, extrait (texte, lien)
+        # puis ferme l'onglet. Seules les extractions réussies sont mises en cache.
+        # Retourne [] pour une page chargée sans élément (vraie page vide), None pour un
+        # timeout ou une erreur : l'appelant n'écrit rien et la reprise retentera l'URL.
+        elements = self.cache.lire(url)
+        if elements is not None:
+            self.metriques.append({"url": url, "type": type_page, "chargement_s": 0.0, "total_s": 0.0,
+                                   "elements": len(elements), "statut": "cache"})
+            return elements
+
+        async with self.onglets:
+            debut = time.perf_counter()
+            statut = "ok"
+            elements = []
+            tab = None
+            try:
+                tab = await self.browser.get(url, new_tab=True)
+                chargement = time.perf_counter() - debut
+                noeuds = await self.attendre_elements(tab, selecteur)
+                for n in noeuds:
+                    elements.append((n.text.strip(), url_absolue(n.attrs.get("href", ""), self.base_url)))
+                if elements:
+                    self.cache.ecrire(url, elements, await tab.get_content())
+                elif await self.page_chargee(tab):
+                    statut = "vide"
+                else:
+                    statut = "timeout"
+            except Exception as e:
+                chargement = time.perf_counter() - debut
+                statut = f"erreur: {e}"
+            finally:
+                if tab is not None:
+                    try:
+                        await tab.close()
+                    except Exception:
+                        pass
+            self.metriques.append({
+                "url": url,
+                "type": type_page,
+                "chargement_s": round(chargement, 3),
+                "total_s": round(time.perf_counter() - debut, 3),
+                "elements": len(elements),
+                "statut": statut,
+            })
+            return elements if statut in ("ok", "vide") else None
+
+    async def crawler_sous_categorie(self, cat_nom, sub_nom, sub_href):
+        if self.sortie.deja_faite(sub_href):
+            return
+        produits = await self.extraire(sub_href, SELECTEUR_PRODUITS, "sous-catégorie")
+        if produits is None:
+            print(f"   ⚠️ {cat_nom} / {sub_nom} : échec du chargement, sous-catégorie à reprendre")
+            return
+        self.sortie.ecrire(cat_nom, sub_nom, sub_href, produits)
+        print(f"   ✔ {cat_nom} / {sub_nom} : {len(produits)} produit(s)")
+
+    async def crawler_categorie(self, cat_nom, cat_href):
+        sous_categories = await self.extraire(cat_href, SELECTEUR_CATEGORIES, "catégorie")
+        if sous_categories is None:
+            print(f"⚠️ {cat_nom} : échec du chargement, catégorie à reprendre")
+            return
+        print(f"{cat_nom} -> {len(sous_categories)} sous-catégorie(s)")
+        await asyncio.gather(*[
+            self.crawler_sous_categorie(cat_nom, sub_nom, sub_href)
+            for sub_nom, sub_href in sous_categories
+        ])
+
+    def resume_metriques(self):
+        if not self.metriques:
+            return
+        df = pd.DataFrame(self.metriques)
+        df.to_csv(FICHIER_METRIQUES, index=False, encoding="utf-8-sig")
+        for type_page, groupe in df.groupby("type"):
+            visitees = groupe[groupe["statut"] != "cache"]
+            resume = f"📊 {type_page} : {len(visitees)} pages visitées, {len(groupe) - len(visitees)} depuis le cache"
+            if len(visitees):
+                resume += (f", p50 {visitees['total_s'].quantile(0.5):.2f}s, p95 {visitees['total_s'].quantile(0.95):.2f}s, "
+                           f"{(~visitees['statut'].isin(['ok', 'vide'])).sum()} en échec/timeout")
+            print(resume)
+
+
+async def main_concurrent(base_url=BASE_URL, max_onglets=4, timeout=20, cache=None, sortie=None):
+    print(f"🌍 Lancement du navigateur (mode concurrent, {max_onglets} onglets)...")
+    debut = time.perf_counter()
+    browser = await uc.start()
+    crawler = Crawler(browser, base_url, max_onglets, timeout, cache, sortie)
+
+    page = await browser.get(base_url)
+    await injecter_auth(page)
+    categories = crawler.cache.lire(base_url)
+    if categories is None:
+        categories = [
+            (el.text.strip(), url_absolue(el.attrs.get("href", ""), base_url))
+            for el in await crawler.attendre_elements(page, SELECTEUR_CATEGORIES)
+        ]
+        if categories:
+            crawler.cache.ecrire(base_url, categories)
+    print(f"Nombre de catégories trouvées : {len(categories)}")
+
+    # Chaque sous-catégorie est écrite dès qu'elle est terminée (ordre d'achèvement)
+    await asyncio.gather(*[crawler.crawler_categorie(nom, href) for nom, href in categories])
+
+    crawler.sortie.fermer()
+    if crawler.sortie.nb_lignes:
+        print(f"✅ {crawler.sortie.nb_lignes} ligne(s) écrites dans {FICHIER_SORTIE}")
+    else:
+        print("❌ Aucun nouvel élément trouvé")
+
+    crawler.resume_metriques()
+    print(f"⏱️ Durée totale : {time.perf_counter() - debut:.1f}s")
+    browser.stop()
+    print("🚀 Navigateur fermé.")
+
+
+# ────────────── SITE FIXTURE LOCAL ──────────────
+# Génère un petit site statique reprenant la structure d'oscaro.com, à servir avec
+# `python -m http.server --directory <dossier> 8000` puis
+# `python webscrapping.py --concurrent --base-url http://127.0.0.1:8000`.
+
+def generer_site_fixture(dossier, nb_categories=3, nb_sous_categories=4, nb_produits=5):
+    def ecrire(chemin, corps):
+        chemin = os.path.join(dossier, chemin)
+        os.makedirs(os.path.dirname(chemin), exist_ok=True)
+        with open(chemin, "w", encoding="utf-8") as f:
+            f.write(f"<html><body>{corps}</body></html>")
+
+    def bloc_categorie(nom, href):
+        return f'<div class="category-item-header"><h2><a href="{href}">{nom}</a></h2></div>'
+
+    ecrire("index.html", "".join(bloc_categorie(f"Catégorie {i}", f"/cat{i}/index.html")
+                                 for i in range(nb_categories)))
+    for i in range(nb_categories):
+        ecrire(f"cat{i}/index.html", "".join(bloc_categorie(f"Sous-catégorie {i}.{j}", f"/cat{i}/sub{j}.html")
+                                             for j in range(nb_sous_categories)))
+        for j in range(nb_sous_categories):
+            liens = "".join(f'<li><a href="/p/{i}-{j}-{k}">Produit {i}.{j}.{k}</a></li>'
+                            for k in range(nb_produits))
+            ecrire(f"cat{i}/sub{j}.html",
+                   f'<div class="link-list-column"><ul class="link-list link-primary">{liens}</ul></div>')
+    print(f"✅ Site fixture généré dans {dossier}")
+
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Scraping de la taxonomie oscaro")
+    parser.add_argument("--concurrent", action="store_true", help="onglets parallèles et attente des sélecteurs")
+    parser.add_argument("--onglets", type=int, default=4, help="nombre maximal d'onglets ouverts simultanément")
+    parser.add_argument("--timeout", type=float, default=20, help="attente maximale d'un sélecteur (s)")
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--reprendre", action="store_true",
+                        help="compléter le CSV existant en sautant les sous-catégories déjà écrites")
+    parser.add_argument("--age-max-heures", type=float, default=None,
+                        help="revisiter les pages dont le cache est plus ancien (défaut : cache sans expiration)")
+    parser.add_argument("--cache", default=DOSSIER_CACHE, help="dossier du cache de pages")
+    parser.add_argument("--generer-fixture", metavar="DOSSIER", help="générer un site statique de test et quitter")
+    args = parser.parse_args()
+
+    if args.generer_fixture:
+        generer_site_fixture(args.generer_fixture)
+    else:
+        age_max = args.age_max_heures * 3600 if args.age_max_heures is not None else None
+        cache = CachePages(args.cache, age_max)
+        sortie = SortieIncrementale(FICHIER_SORTIE, reprendre=args.reprendre)
+        if args.concurrent:
+            asyncio.run(main_concurrent(args.base_url, args.onglets, args.timeout, cache, sortie))
+        else:
+            asyncio.run(main(args.base_url, cache, sortie))